@@ -0,0 +1,100 @@
+import sys
+import os
+sys.path.insert(0, os.path.abspath(os.path.dirname(__file__) + "/.."))
+
+import logging
+import re
+import shutil
+import tempfile
+import time
+
+from tiny_etl.compression import COMPRESSION_OPENERS
+from tiny_etl.extractors.files import FilesListExtractor
+from tiny_etl.loaders.dbapi import DBAPI_BulkLoader, SQLiteConnectionFactory
+from tiny_etl.transformers.files import FileTextBlocksReaderTransformer
+
+LOGGER = logging.getLogger("Benchmarks")
+IN_DIR = os.path.abspath(os.path.dirname(__file__) + "/sample_data/books")
+CODECS_SUFFIXES = [(None, ''), ('gzip', '.gz'), ('bz2', '.bz2'), ('xz', '.xz')]
+
+def _size_in_mo(files):
+    return sum([os.path.getsize(f) for f in files])/1024/1024
+
+def bench_compressed_readers(in_dir: str = IN_DIR):
+    """
+    Reads and tokenizes the same text files stored raw, gzip, bz2 and xz compressed.
+    Prints the throughput per codec in Mo/sec of uncompressed text.
+    """
+    files = [item['_'] for item in FilesListExtractor(LOGGER, in_dir, '.txt', '_').extract()]
+    text_size_mo = _size_in_mo(files)
+    tmp_dir = tempfile.mkdtemp(prefix='bench_')
+    try:
+        print('{:<8} {:>12} {:>12} {:>10} {:>12}'.format('codec', 'text Mo', 'stored Mo', 'sec', 'Mo/sec'))
+        for (codec, suffix) in CODECS_SUFFIXES:
+            codec_dir = os.path.join(tmp_dir, codec or 'raw')
+            os.mkdir(codec_dir)
+            codec_files = []
+            for f in files:
+                dest = os.path.join(codec_dir, os.path.basename(f) + suffix)
+                with open(f, 'rb') as src, (COMPRESSION_OPENERS[codec](dest, 'wb') if codec else open(dest, 'wb')) as dst:
+                    shutil.copyfileobj(src, dst)
+                codec_files.append(dest)
+
+            reader = FileTextBlocksReaderTransformer(LOGGER, pattern='.txt', input_key_path=None, output_key=None,
+                                                     block_size=1024*1024, decompress=True)
+            pattern = re.compile('\\s+')
+            words = 0
+            start = time.perf_counter()
+            for f in codec_files:
+                for res in reader._map_item(f):
+                    words += len(pattern.split(res['content']))
+            duree = time.perf_counter() - start
+            print('{:<8} {:>12} {:>12} {:>10} {:>12}'.format(codec or 'raw',
+                                                             round(text_size_mo, 3),
+                                                             round(_size_in_mo(codec_files), 3),
+                                                             round(duree, 3),
+                                                             round(text_size_mo/duree, 3)))
+    finally:
+        shutil.rmtree(tmp_dir, ignore_errors=True)
+
+def bench_sqlite_bulk(rows_count: int = 300_000):
+    """
+    Inserts the same rows in a WAL sqlite3 database using DBAPI_BulkLoader :
+    one row per statement (executemany) vs multi rows statements, with different transaction sizes.
+    Prints the throughput in rows/sec.
+    """
+    items = [{'word': 'word_{}'.format(i), 'word_len': len('word_{}'.format(i)), 'file': 'file_{}.txt'.format(i % 100)} for i in range(rows_count)]
+    values_path = [('word', ['word'], True), ('word_len', ['word_len'], True), ('file', ['file'], True)]
+    configs = [('executemany', 3, 100_000), ('multi rows', 999, 100_000), ('multi rows', 999, 10_000), ('multi rows', 999, None)]
+    tmp_dir = tempfile.mkdtemp(prefix='bench_')
+    try:
+        print('{:<14} {:>14} {:>10} {:>12}'.format('statements', 'transaction', 'sec', 'rows/sec'))
+        for (idx, (name, max_params, transaction_rows)) in enumerate(configs):
+            factory = SQLiteConnectionFactory(os.path.join(tmp_dir, 'bench_{}.db'.format(idx)))
+            con = factory()
+            con.execute("CREATE TABLE words (word TEXT, word_len INTEGER, file TEXT)")
+            con.close()
+            loader = DBAPI_BulkLoader(LOGGER, None, values_path, factory, 'words',
+                                      buffer_size=10_000, max_params=max_params, transaction_rows=transaction_rows)
+            start = time.perf_counter()
+            for i in range(0, rows_count, 1000):
+                loader.load('bench', items[i:i+1000], False)
+            loader.close()
+            duree = time.perf_counter() - start
+            print('{:<14} {:>14} {:>10} {:>12}'.format(name, str(transaction_rows or 'per flush'), round(duree, 3), round(rows_count/duree)))
+    finally:
+        shutil.rmtree(tmp_dir, ignore_errors=True)
+
+BENCHMARKS = {
+    'compressed_readers': bench_compressed_readers,
+    'sqlite_bulk': bench_sqlite_bulk,
+}
+
+if __name__=="__main__":
+    names = sys.argv[1:] if len(sys.argv) > 1 else list(BENCHMARKS.keys())
+    for name in names:
+        if name not in BENCHMARKS:
+            print('Unknown benchmark {}, available : {}'.format(name, ', '.join(BENCHMARKS.keys())))
+            continue
+        print('========== {}'.format(name))
+        BENCHMARKS[name]()
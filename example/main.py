@@ -2,12 +2,13 @@ import sys
 import os
 sys.path.insert(0, os.path.abspath(os.path.dirname(__file__) + "/.."))
 
+import atexit
 import json
 import math
 import traceback
-from concurrent_log_handler import ConcurrentRotatingFileHandler
 import logging
 from logging import INFO, ERROR, WARN, Logger
+from logging.handlers import RotatingFileHandler
 import time
 from datetime import date
 from typing import Dict, AnyStr, Any
@@ -19,6 +20,8 @@ from tiny_etl.commons import block_join_threads_or_processes
 from tiny_etl.commons import get_dir_size_in_mo
 from tiny_etl.commons import basename_backwards_x4, format_duree, truncate_str_255, truncate_str_270
 from tiny_etl.commons import len_str_gt_255
+from tiny_etl.logs import QueueLogListener
+from tiny_etl.monitoring import PipelineStatsServer
 from tiny_etl.pipline import ThreadedPipeline
 from tiny_etl.extractors.files import FilesListExtractor
 from tiny_etl.extractors.commons import AbstractExtractor
@@ -32,18 +35,22 @@ from tiny_etl.loaders.commons import ConditionalLoader, NoopLoader
 from tiny_etl.loaders.loadbalancer import LoadBalanceLoader
 from tiny_etl.loaders.mysql import MySQL_DBLoader
 from tiny_etl.loaders.files import CSV_FileLoader
-from arabic_transformers import ArabicTextWordsTokenizerTransformer
+from tiny_etl.transformers.text import ArabicTextWordsTokenizerTransformer, remove_arabic_diacritics
 
 LOGGING_FORMAT = '%(name)s %(levelname)s : %(asctime)s - %(processName)s (%(threadName)s) : %(message)s'
-console_handler = logging.StreamHandler(stream=sys.stdout)
-console_handler.setFormatter(logging.Formatter(LOGGING_FORMAT))
-console_handler.setLevel(logging.INFO)
-logging.basicConfig(handlers=[ConcurrentRotatingFileHandler(mode="a",
-                                                                    filename=os.path.abspath(f'logs/log-{date.today()}.log'),
-                                                                    maxBytes=50*1024*1024, backupCount=100), console_handler], 
-                                                level=logging.DEBUG,
-                                                # encoding='utf-8',
-                                                format=LOGGING_FORMAT)
+
+def make_log_handlers():
+    # called in the log listener process : the only one writing the log file
+    console_handler = logging.StreamHandler(stream=sys.stdout)
+    console_handler.setFormatter(logging.Formatter(LOGGING_FORMAT))
+    console_handler.setLevel(logging.INFO)
+    file_handler = RotatingFileHandler(mode="a",
+                                        filename=os.path.abspath(f'logs/log-{date.today()}.log'),
+                                        maxBytes=50*1024*1024, backupCount=100, encoding='utf-8')
+    file_handler.setFormatter(logging.Formatter(LOGGING_FORMAT))
+    return [file_handler, console_handler]
+
+LOG_LISTENER = QueueLogListener(make_log_handlers, level=logging.INFO) # logging.DEBUG to log the items
 LOGGER = logging.getLogger("Global")
 
 
@@ -63,6 +70,7 @@ def make_threaded_pipeline(extractor_: AbstractExtractor, logger: Logger, config
                 use_threads_as_transformation_pipelines=config['use_threads_as_transformation_pipelines'],
                 use_threads_as_loaders_executors=config['use_threads_as_loaders_executors'],
                 trans_in_queue_max_size=config['trans_in_queue_max_size'],
+                collect_stats=config['stats_port'] is not None,
                 global_cpus_affinity_options=config['cpus_affinity_options'],
                 extractor=extractor_,
                 transformers=[
@@ -77,13 +85,15 @@ def make_threaded_pipeline(extractor_: AbstractExtractor, logger: Logger, config
                                         FileTextReaderTransformer(logger, 
                                                 pattern=".txt", 
                                                 input_key_path=None, 
-                                                output_key=None),
+                                                output_key=None,
+                                                memoize=True),
                                         TextWordTokenizerTransformer(logger, 
                                                 pattern="\\s+", 
                                                 input_key_path=['_', 'content'], 
                                                 output_key=None,
                                                 mappers=[str.strip],
-                                                ignore_word_fn=str.isspace),
+                                                ignore_word_fn=str.isspace,
+                                                memoize=True),
                                         # ArabicTextWordsTokenizerTransformer( logger, 
                                         #         input_key_path=['_', 'content'], 
                                         #         output_key=None,
@@ -103,7 +113,8 @@ def make_threaded_pipeline(extractor_: AbstractExtractor, logger: Logger, config
                                                 input_key_path=['file_path'], 
                                                 output_key='_',
                                                 copy_values_key_paths=[('file_path', ['file_path']), 
-                                                                    ('words_count', ['words_count'])]), 
+                                                                    ('words_count', ['words_count'])],
+                                                memoize=True), 
                                         TextWordTokenizerTransformer(logger, 
                                                  pattern="\\s+", 
                                                  input_key_path=['_', 'content'], 
@@ -112,10 +123,11 @@ def make_threaded_pipeline(extractor_: AbstractExtractor, logger: Logger, config
                                                  ignore_word_fn=str.isspace,
                                                  # remove_chars = ["\ufeff"],
                                                  copy_values_key_paths=[('file_path', ['file_path']), 
-                                                                     ('words_count', ['words_count'])]),
+                                                                     ('words_count', ['words_count'])],
+                                                 memoize=True),
                                         OneToOneItemAttributesTransformer(logger, 
                                                 derived_values_2=[
-                                                    (['_', 'word'], ['_', 'word_len'], [ArabicTextWordsTokenizerTransformer.remove_diac, str.__len__]),
+                                                    (['_', 'word'], ['_', 'word_len'], [remove_arabic_diacritics, str.__len__]),
                                                     (['_', 'word'], ['_', 'word_truncated'], [len_str_gt_255]),
                                                 ],
                                                 trans_values_3=[
@@ -165,8 +177,15 @@ if __name__=="__main__":
         'load_balancer_queue_max_size': 1_000,
         'load_balancer_buffer_size': 1_000,
         'mono_pipeline': MONO_PIPELINE,
+        'stats_port': 8765 if '-stats' in sys.argv else None,# GET http://127.0.0.1:8765/stats
     }
 
+    if not os.path.isdir('logs'):
+        os.mkdir('logs')
+    LOG_LISTENER.start()
+    LOG_LISTENER.install()
+    atexit.register(LOG_LISTENER.stop)
+
     start_exec_time = time.perf_counter()
     words_saver = None
 
@@ -261,6 +280,7 @@ if __name__=="__main__":
         -s           Start processing
         -f           Start processing even if the estimated RAM isn't enough
         --all-cpus   Start processing using the full CPUs (default to {}% of CPUs are used)
+        -stats       Serve the pipelines stats on http://127.0.0.1:8765/stats
 
         """.format(config['cpu_pax_usage']*100))
         if not config['force_run']:
@@ -274,17 +294,17 @@ if __name__=="__main__":
         -s           Start processing
         -f           Start processing even if the estimated RAM isn't enough
         --all-cpus   Start processing using the full CPUs (default to {}% of CPUs are used)
+        -stats       Serve the pipelines stats on http://127.0.0.1:8765/stats
 
         """.format(config['cpu_pax_usage']*100))
         exit()
         
     if not os.path.isdir(config['out_dir']):
         os.mkdir(config['out_dir'])
-    if not os.path.isdir('logs'):
-        os.mkdir('logs')
     # Start program
     LOGGER.log(INFO, "Script started")
     pipelines = []
+    stats_server = None
     try:
         dirs = [os.path.abspath(os.path.join(config['in_dir'], dir)) for dir in dirs]
         if config['mono_pipeline']:
@@ -300,14 +320,19 @@ if __name__=="__main__":
                                                         logger=_LOGGER, config=config))
 
         LOGGER.log(INFO, '{} pipelines created by root folder in {}'.format(len(pipelines), config['in_dir']))
+        if config['stats_port'] is not None:
+            stats_server = PipelineStatsServer(LOGGER, pipelines, port=config['stats_port'], input_size_mo=in_dir_size_mo)
+            stats_server.start()
         for pipeline in pipelines:
             pipeline.start()
         LOGGER.log(INFO, 'Pipelines started'.format(len(pipelines)))
         block_join_threads_or_processes(pipelines, logger=LOGGER, log_level=INFO, log_when_joined=True, log_msg="Pipeline joined")
         LOGGER.log(INFO, 'Pipelines joined'.format(len(pipelines)))
     except Exception as ex:
-        LOGGER.log(ERROR, "Trace : {}".format(str(traceback.format_exception(etype=type(ex), value=ex, tb=ex.__traceback__))))
+        LOGGER.log(ERROR, "Trace : {}".format(str(traceback.format_exception(type(ex), ex, ex.__traceback__))))
     finally:
+        if stats_server is not None:
+            stats_server.stop()
         end_exec_time=time.perf_counter()
         duree_exec = round(end_exec_time-start_exec_time, 3)
         rate = duree_exec/in_dir_size_mo/1024
@@ -0,0 +1,62 @@
+import sys
+import os
+sys.path.insert(0, os.path.abspath(os.path.dirname(__file__) + "/.."))
+
+import gzip
+import logging
+
+from tiny_etl.extractors.files import FileByteRangesExtractor, FilesListExtractor
+from tiny_etl.transformers.files import FileByteRangeReaderTransformer
+
+LOGGER = logging.getLogger("test_byte_ranges")
+TEXT = " ".join(["word{}".format(i) for i in range(2000)]) + "\n"
+
+
+def read_ranges(in_dir: str) -> dict:
+    extractor = FileByteRangesExtractor(LOGGER,
+                                        extractor=FilesListExtractor(LOGGER, in_dir, ".txt", 'path', accept_compressed=True),
+                                        path_key='path',
+                                        output_key='range',
+                                        chunk_size=1024)
+    reader = FileByteRangeReaderTransformer(LOGGER, input_key_path=['range'], output_key='text')
+    words = {}
+    ranges = {}
+    for item in extractor.extract():
+        file_path = item['range']['file_path']
+        ranges.setdefault(file_path, []).append(item['range'])
+        for res in reader.transform(item):
+            words.setdefault(file_path, []).extend(res['text']['content'].split())
+    return (ranges, words)
+
+
+def test_plain_file_split_in_ranges(tmp_path):
+    (tmp_path / 'a.txt').write_text(TEXT)
+    (ranges, words) = read_ranges(str(tmp_path))
+    file_ranges = ranges[str(tmp_path / 'a.txt')]
+    assert len(file_ranges) > 1
+    assert all(r['compression'] is None for r in file_ranges)
+    assert words[str(tmp_path / 'a.txt')] == TEXT.split()
+
+
+def test_compressed_file_one_range(tmp_path):
+    with gzip.open(str(tmp_path / 'a.txt.gz'), 'wt') as fh:
+        fh.write(TEXT)
+    with gzip.open(str(tmp_path / 'small.txt.gz'), 'wt') as fh:
+        fh.write("one two")
+    (ranges, words) = read_ranges(str(tmp_path))
+    for name in ('a.txt.gz', 'small.txt.gz'):
+        file_ranges = ranges[str(tmp_path / name)]
+        assert len(file_ranges) == 1
+        assert file_ranges[0]['compression'] == 'gzip'
+    assert words[str(tmp_path / 'a.txt.gz')] == TEXT.split()
+    assert words[str(tmp_path / 'small.txt.gz')] == ['one', 'two']
+
+
+def test_compressed_range_without_compression_key(tmp_path):
+    with gzip.open(str(tmp_path / 'a.txt.gz'), 'wt') as fh:
+        fh.write("one two")
+    reader = FileByteRangeReaderTransformer(LOGGER, input_key_path=['range'], output_key='text')
+    byte_range = {'file_path': str(tmp_path / 'a.txt.gz'), 'start': 0, 'end': 10, 'chunk_idx': 0, 'chunks_count': 1}
+    assert [res['text']['content'] for res in reader.transform({'range': byte_range})] == ['one two']
+    byte_range = dict(byte_range, chunk_idx=1, chunks_count=2)
+    assert list(reader.transform({'range': byte_range})) == []
@@ -0,0 +1,197 @@
+import sys
+import os
+sys.path.insert(0, os.path.abspath(os.path.dirname(__file__) + "/.."))
+
+import logging
+import sqlite3
+
+import pytest
+
+from tiny_etl.loaders.dbapi import DBAPI_BulkLoader, SQLiteConnectionFactory
+
+LOGGER = logging.getLogger("test_dbapi_bulk")
+VALUES_PATH = [('word', ['word'], True), ('n', ['n'], True)]
+
+
+class FlakyCursor:
+    def __init__(self, owner) -> None:
+        self.owner = owner
+        self.cursor = owner.connection.cursor()
+
+    def execute(self, sql: str, params: list) -> None:
+        idx = len(self.owner.statements)
+        self.owner.statements.append((sql, params))
+        if idx in self.owner.fail_on or (self.owner.fail_from is not None and idx >= self.owner.fail_from):
+            raise sqlite3.OperationalError('injected failure')
+        self.cursor.execute(sql, params)
+
+    def close(self) -> None:
+        self.cursor.close()
+
+
+class FlakyConnection:
+    """
+    sqlite3 connection failing on some statements (indexes of the executed statements)
+    """
+    def __init__(self, database_path: str, fail_on: set = None, fail_from: int = None) -> None:
+        self.database_path = database_path
+        self.connection = None
+        self.fail_on = fail_on if fail_on is not None else set()
+        self.fail_from = fail_from
+        self.statements = []
+        self.commits = 0
+        self.rollbacks = 0
+
+    def cursor(self) -> FlakyCursor:
+        if self.connection is None:
+            # opened by the thread using it (write behind)
+            self.connection = SQLiteConnectionFactory(self.database_path)()
+        return FlakyCursor(self)
+
+    def commit(self) -> None:
+        self.commits += 1
+        self.connection.commit()
+
+    def rollback(self) -> None:
+        self.rollbacks += 1
+        self.connection.rollback()
+
+    def close(self) -> None:
+        self.connection.close()
+
+
+@pytest.fixture
+def database_path(tmp_path) -> str:
+    path = str(tmp_path / 'words.db')
+    con = sqlite3.connect(path)
+    con.execute("CREATE TABLE words (word TEXT, n INTEGER)")
+    con.close()
+    return path
+
+
+def db_rows(database_path: str) -> list:
+    con = sqlite3.connect(database_path)
+    try:
+        return con.execute("SELECT word, n FROM words ORDER BY n").fetchall()
+    finally:
+        con.close()
+
+
+def make_items(count: int, width: int = 5, start: int = 0) -> list:
+    return [{'word': 'w' * width, 'n': start + i} for i in range(count)]
+
+
+def make_loader(connection: FlakyConnection, **kwargs) -> DBAPI_BulkLoader:
+    return DBAPI_BulkLoader(LOGGER, None, VALUES_PATH, lambda: connection, 'words', **kwargs)
+
+
+def load_by_batches(loader: DBAPI_BulkLoader, items: list, batch: int = 50) -> None:
+    for i in range(0, len(items), batch):
+        loader.load('job', items[i:i+batch], False)
+
+
+def test_statements_fit_the_bytes_budget_when_the_rows_widen(database_path):
+    connection = FlakyConnection(database_path)
+    loader = make_loader(connection, buffer_size=500, max_statement_bytes=20_000, transaction_rows=None)
+    items = make_items(1000) + make_items(600, width=300, start=1000) + make_items(3, width=30_000, start=1600)
+    load_by_batches(loader, items)
+    loader.close()
+
+    assert [n for (_, n) in db_rows(database_path)] == list(range(len(items)))
+    for (sql, params) in connection.statements:
+        rows_count = len(params) // 2
+        assert sql.count('(?,?)') == rows_count
+        assert rows_count & (rows_count - 1) == 0
+        assert rows_count == 1 or DBAPI_BulkLoader._params_bytes(params) <= 20_000
+    # the narrow rows use the max_params statements, the rows bigger than the budget are inserted alone
+    assert max([len(params) // 2 for (_, params) in connection.statements]) == 256
+    assert sum([1 for (_, params) in connection.statements if len(params) == 2 and len(params[0]) == 30_000]) == 3
+    assert loader.inserted_rows == len(items)
+    assert loader.failed_rows == 0
+
+
+def test_statements_respect_max_params(database_path):
+    connection = FlakyConnection(database_path)
+    loader = make_loader(connection, buffer_size=100, max_params=21, transaction_rows=None)
+    load_by_batches(loader, make_items(333))
+    loader.close()
+
+    assert max([len(params) for (_, params) in connection.statements]) <= 21
+    assert len(db_rows(database_path)) == 333
+
+
+def test_transaction_boundaries(database_path):
+    connection = FlakyConnection(database_path)
+    loader = make_loader(connection, buffer_size=100, max_params=64, transaction_rows=250)
+    visible = [0]
+    for i in range(0, 1000, 50):
+        loader.load('job', make_items(50, start=i), False)
+        visible.append(len(db_rows(database_path)))
+    # committed once 250 rows are inserted, at the end of a statement (32 rows at most)
+    transactions = [b - a for (a, b) in zip(visible, visible[1:]) if b != a]
+    assert len(transactions) == 3
+    assert all([250 <= rows < 250 + 32 for rows in transactions])
+    loader.close()
+
+    assert len(db_rows(database_path)) == 1000
+    assert connection.commits == 4
+    assert loader.inserted_rows == 1000
+
+
+def test_commit_after_each_flush_without_transaction_rows(database_path):
+    connection = FlakyConnection(database_path)
+    loader = make_loader(connection, buffer_size=100, transaction_rows=None)
+    load_by_batches(loader, make_items(505))
+    # flushed once the buffer holds more than buffer_size rows
+    assert len(db_rows(database_path)) == 450
+    loader.close()
+    assert len(db_rows(database_path)) == 505
+
+
+def test_rollback_requeues_the_uncommitted_flushes(database_path):
+    # 4 statements per flush of 101 rows (64+32+4+1), the 2nd statement of the 3rd flush fails :
+    # the 2 previous flushes and the first statement of the 3rd one are rolled back then inserted again
+    connection = FlakyConnection(database_path, fail_on={9})
+    loader = make_loader(connection, buffer_size=100, max_params=2*128, transaction_rows=1000)
+    load_by_batches(loader, make_items(1000, width=1), batch=101)
+    loader.close()
+
+    assert [len(params) // 2 for (_, params) in connection.statements[:10]] == [64, 32, 4, 1, 64, 32, 4, 1, 64, 32]
+    assert connection.rollbacks == 1
+    assert [n for (_, n) in db_rows(database_path)] == list(range(1000))
+    assert loader.inserted_rows == 1000
+    assert loader.failed_rows == 0
+
+
+def test_close_raises_when_the_rows_cant_be_inserted(database_path):
+    connection = FlakyConnection(database_path, fail_from=3)
+    loader = make_loader(connection, buffer_size=100, max_params=2*128, transaction_rows=200)
+    load_by_batches(loader, make_items(500, width=1), batch=101)
+    with pytest.raises(RuntimeError):
+        loader.close()
+
+    committed = len(db_rows(database_path))
+    assert committed == loader.inserted_rows
+    assert loader.inserted_rows + loader.failed_rows == 500
+    assert loader.failed_rows > 0
+
+
+def test_write_behind_retries_the_rolled_back_transaction(database_path):
+    connection = FlakyConnection(database_path, fail_on={1})
+    loader = make_loader(connection, buffer_size=100, max_params=2*128, transaction_rows=1000, write_behind=True)
+    load_by_batches(loader, make_items(600, width=1), batch=101)
+    loader.close()
+
+    assert connection.rollbacks == 1
+    assert [n for (_, n) in db_rows(database_path)] == list(range(600))
+    assert loader.inserted_rows == 600
+    assert loader.failed_rows == 0
+
+
+def test_write_behind_failure_raised_by_close(database_path):
+    connection = FlakyConnection(database_path, fail_from=0)
+    loader = make_loader(connection, buffer_size=100, write_behind=True)
+    load_by_batches(loader, make_items(300))
+    with pytest.raises(RuntimeError):
+        loader.close()
+    assert len(db_rows(database_path)) == 0
@@ -0,0 +1,128 @@
+import sys
+import os
+sys.path.insert(0, os.path.abspath(os.path.dirname(__file__) + "/.."))
+
+import logging
+import sqlite3
+
+import pytest
+
+from tiny_etl.commons import flatMapApply
+from tiny_etl.extractors.files import FilesListExtractor
+from tiny_etl.extractors.manifest import IncrementalFilesExtractor
+from tiny_etl.transformers.aggregators import ReduceItemTransformer
+from tiny_etl.transformers.commons import new_item_context
+from tiny_etl.transformers.files import FileTextReaderTransformer
+from tiny_etl.transformers.text import TextWordTokenizerTransformer
+
+LOGGER = logging.getLogger("test_incremental_files")
+
+
+def make_reduce_transformer() -> ReduceItemTransformer:
+    return ReduceItemTransformer(LOGGER,
+                                 input_key_path=(['_'], str),
+                                 output_key='words_count',
+                                 copy_values_key_paths=[('file_path', ['_'])],
+                                 transformers=[
+                                     FileTextReaderTransformer(LOGGER, pattern=".txt", input_key_path=None, output_key=None),
+                                     TextWordTokenizerTransformer(LOGGER, pattern="\\s+", input_key_path=['_', 'content'], output_key=None),
+                                 ],
+                                 initial_value=0,
+                                 reducer=ReduceItemTransformer.count)
+
+
+def transform_item(transformers: list, item: dict) -> list:
+    # same context as ThreadedPipeline.transform_items
+    return list(flatMapApply(item, list(map(lambda mapper: mapper.transform, transformers)), context=new_item_context(item)))
+
+
+def test_tombstone_skipped_by_top_level_reader():
+    reader = FileTextReaderTransformer(LOGGER, pattern=".txt", input_key_path=['_'], output_key='text')
+    assert transform_item([reader], {'_': '/nonexistent/a.txt', 'deleted': True}) == []
+    assert list(reader.transform({'_': '/nonexistent/a.txt', 'deleted': True})) == []
+
+
+def test_tombstone_skipped_by_nested_reader(tmp_path):
+    transformer = make_reduce_transformer()
+    tombstone = {'_': str(tmp_path / 'a.txt'), 'deleted': True}
+    assert transform_item([transformer], tombstone) == [{'file_path': str(tmp_path / 'a.txt'), 'words_count': 0}]
+    # called outside of a pipeline
+    assert list(transformer.transform(tombstone)) == [{'file_path': str(tmp_path / 'a.txt'), 'words_count': 0}]
+
+
+def test_nested_reader_reads_existing_file(tmp_path):
+    file_path = tmp_path / 'a.txt'
+    file_path.write_text("one two three\nfour")
+    transformer = make_reduce_transformer()
+    assert transform_item([transformer], {'_': str(file_path)}) == [{'file_path': str(file_path), 'words_count': 4}]
+    assert transform_item([transformer], {'_': str(file_path), 'deleted': False}) == [{'file_path': str(file_path), 'words_count': 4}]
+
+
+def make_extractor(in_dir: str, manifest_path: str, **kwargs) -> IncrementalFilesExtractor:
+    return IncrementalFilesExtractor(LOGGER, FilesListExtractor(LOGGER, in_dir, ".txt", 'path'), manifest_path, 'path',
+                                     emit_tombstones=True, **kwargs)
+
+
+def write_files(in_dir, names: list) -> None:
+    os.makedirs(str(in_dir), exist_ok=True)
+    for name in names:
+        (in_dir / name).write_text(name)
+
+
+def extracted(extractor: IncrementalFilesExtractor) -> list:
+    return sorted([(os.path.basename(item['path']), item.get('deleted', False)) for item in extractor.extract()])
+
+
+def test_scopes_sharing_a_manifest(tmp_path):
+    manifest_path = str(tmp_path / 'manifest.db')
+    write_files(tmp_path / 'a', ['a1.txt', 'a2.txt'])
+    write_files(tmp_path / 'b', ['b1.txt'])
+    extractor_a = make_extractor(str(tmp_path / 'a'), manifest_path)
+    extractor_b = make_extractor(str(tmp_path / 'b'), manifest_path)
+    assert extractor_a.scope != extractor_b.scope
+
+    # interleaved runs : the staging of a scope isn't discarded by the other one
+    assert extracted(extractor_a) == [('a1.txt', False), ('a2.txt', False)]
+    assert extracted(extractor_b) == [('b1.txt', False)]
+    extractor_a.commit_run()
+    extractor_b.commit_run()
+
+    os.remove(str(tmp_path / 'a' / 'a2.txt'))
+    assert extracted(extractor_a) == [('a2.txt', True)]
+    extractor_a.commit_run()
+    assert extracted(extractor_b) == []
+    extractor_b.commit_run()
+    assert extracted(extractor_a) == []
+
+
+def test_concurrent_runs_of_the_same_scope_refused(tmp_path):
+    manifest_path = str(tmp_path / 'manifest.db')
+    write_files(tmp_path / 'a', ['a1.txt'])
+    first = make_extractor(str(tmp_path / 'a'), manifest_path)
+    second = make_extractor(str(tmp_path / 'a'), manifest_path)
+    items = first.extract()
+    next(items)
+    assert extracted(second) == [('a1.txt', False)]
+    with pytest.raises(RuntimeError):
+        list(items)
+    with pytest.raises(RuntimeError):
+        first.commit_run()
+    second.commit_run()
+    assert extracted(second) == []
+
+
+def test_unscoped_manifest_migrated(tmp_path):
+    manifest_path = str(tmp_path / 'manifest.db')
+    write_files(tmp_path / 'a', ['a1.txt'])
+    file_path = str(tmp_path / 'a' / 'a1.txt')
+    st = os.stat(file_path)
+    connection = sqlite3.connect(manifest_path)
+    connection.execute("CREATE TABLE files (path TEXT PRIMARY KEY, size INTEGER NOT NULL, mtime REAL NOT NULL, hash TEXT, run_id TEXT NOT NULL) WITHOUT ROWID")
+    connection.execute("CREATE TABLE runs (run_id TEXT PRIMARY KEY, extracted_at REAL NOT NULL)")
+    connection.execute("INSERT INTO files VALUES (?,?,?,NULL,'old')", (file_path, st.st_size, st.st_mtime))
+    connection.commit()
+    connection.close()
+
+    extractor = make_extractor(str(tmp_path / 'a'), manifest_path, scope='')
+    assert extracted(extractor) == []
+    extractor.commit_run()
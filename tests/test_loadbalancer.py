@@ -0,0 +1,52 @@
+import sys
+import os
+sys.path.insert(0, os.path.abspath(os.path.dirname(__file__) + "/.."))
+
+import logging
+
+import pytest
+
+from tiny_etl.loaders.commons import NoopLoader
+from tiny_etl.loaders.loadbalancer import LoadBalanceLoader
+
+LOGGER = logging.getLogger("test_loadbalancer")
+
+
+class RecordingLoader(NoopLoader):
+    def __init__(self, logger, close_error: Exception = None) -> None:
+        super().__init__(logger, None)
+        self.close_error = close_error
+        self.items = []
+        self.closed = False
+
+    def load(self, job_uuid: str, items: list, last_call: bool) -> None:
+        self.items.extend(items)
+
+    def close(self) -> None:
+        self.closed = True
+        if self.close_error is not None:
+            raise self.close_error
+
+
+def make_balancer(loaders: list) -> LoadBalanceLoader:
+    return LoadBalanceLoader(LOGGER, [(100, loader) for loader in loaders], cpus_affinity_options=[0], buffer_size=10)
+
+
+def test_close_closes_all_the_loaders():
+    loaders = [RecordingLoader(LOGGER), RecordingLoader(LOGGER)]
+    balancer = make_balancer(loaders)
+    balancer.load('job', [{'i': i} for i in range(25)], last_call=True)
+    balancer.close()
+    assert all(loader.closed for loader in loaders)
+    assert sorted(item['i'] for loader in loaders for item in loader.items) == list(range(25))
+
+
+def test_close_raises_the_loaders_errors():
+    loaders = [RecordingLoader(LOGGER, close_error=RuntimeError('Failed to insert 10 rows')), RecordingLoader(LOGGER)]
+    balancer = make_balancer(loaders)
+    balancer.load('job', [{'i': i} for i in range(25)], last_call=True)
+    with pytest.raises(RuntimeError, match='Failed to insert 10 rows'):
+        balancer.close()
+    # the other loaders are closed anyway
+    assert all(loader.closed for loader in loaders)
+    assert not balancer.started
@@ -0,0 +1,194 @@
+import sys
+import os
+sys.path.insert(0, os.path.abspath(os.path.dirname(__file__) + "/.."))
+
+import logging
+
+import pytest
+
+from tiny_etl.loaders.mysql import MySQL_DBLoader, mysql_error_classes, mysql_escape_field
+
+(OperationalError, DataError, Error) = mysql_error_classes()
+LOGGER = logging.getLogger("test_mysql_bulk")
+VALUES_PATH = [('word', ['word'], True), ('count', ['count'], False)]
+
+
+class FakeCursor:
+    def __init__(self, connection) -> None:
+        self.connection = connection
+        self.rowcount = -1
+
+    def execute(self, statement: str) -> None:
+        self.connection.statements.append(statement)
+        if len(self.connection.errors) > 0:
+            raise self.connection.errors.pop(0)
+        # the temp file is removed once loaded, its content is read here
+        file_path = statement.split("'")[1]
+        with open(file_path, 'rb') as fh:
+            content = fh.read()
+        self.connection.files.append((file_path, content))
+        self.rowcount = content.count(b'\n')
+
+    def executemany(self, statement: str, rows: list) -> None:
+        self.connection.statements.append(statement)
+        if len(self.connection.errors) > 0:
+            raise self.connection.errors.pop(0)
+        self.connection.rows.extend(rows)
+        self.rowcount = len(rows)
+
+    def close(self) -> None:
+        pass
+
+
+class FakeConnection:
+    def __init__(self, errors: list = None) -> None:
+        self.errors = errors if errors is not None else []
+        self.statements = []
+        self.files = []
+        self.rows = []
+        self.connected = True
+        self.in_transaction = False
+        (self.reconnections, self.commits, self.rollbacks) = (0, 0, 0)
+        self.closed = False
+
+    def cursor(self) -> FakeCursor:
+        return FakeCursor(self)
+
+    def is_connected(self) -> bool:
+        return self.connected
+
+    def reconnect(self) -> None:
+        self.reconnections += 1
+        self.connected = True
+
+    def start_transaction(self) -> None:
+        self.in_transaction = True
+
+    def commit(self) -> None:
+        self.commits += 1
+        self.in_transaction = False
+
+    def rollback(self) -> None:
+        self.rollbacks += 1
+        self.in_transaction = False
+
+    def close(self) -> None:
+        self.closed = True
+
+
+def make_loader(connection: FakeConnection, tmp_path, **kwargs) -> MySQL_DBLoader:
+    return MySQL_DBLoader(LOGGER, None, VALUES_PATH,
+                          sql_query="INSERT INTO words (word, count) VALUES (%s, %s)",
+                          buffer_size=100,
+                          host=None, database=None, user=None, password=None,
+                          bulk_mode=True,
+                          bulk_table='words',
+                          bulk_tmp_dir=str(tmp_path),
+                          connection_factory=lambda: connection,
+                          **kwargs)
+
+
+def test_escape_field():
+    assert mysql_escape_field(None) == '\\N'
+    assert mysql_escape_field(True) == '1'
+    assert mysql_escape_field(False) == '0'
+    assert mysql_escape_field(12) == '12'
+    assert mysql_escape_field('a\tb\nc\\d\re\0') == 'a\\tb\\nc\\\\d\\re\\0'
+    assert mysql_escape_field('\\N') == '\\\\N'
+
+
+def test_bulk_file_and_statement(tmp_path):
+    connection = FakeConnection()
+    loader = make_loader(connection, tmp_path)
+    items = [{'word': 'plain', 'count': 1},
+             {'word': 'tab\there', 'count': None},
+             {'word': 'new\nline', 'count': 3},
+             {'word': 'back\\slash', 'count': 4},
+             {'count': 5}]
+    loader.load('job', items, last_call=True)
+    loader.close()
+
+    assert len(connection.files) == 1
+    (file_path, content) = connection.files[0]
+    assert content == b'plain\t1\ntab\\there\t\\N\nnew\\nline\t3\nback\\\\slash\t4\n'
+    assert connection.statements == [
+        "LOAD DATA LOCAL INFILE '{}' INTO TABLE words CHARACTER SET utf8mb4 "
+        "FIELDS TERMINATED BY '\\t' ESCAPED BY '\\\\' LINES TERMINATED BY '\\n' (word,count)".format(file_path)]
+    assert os.path.dirname(file_path) == str(tmp_path)
+    assert not os.path.exists(file_path)
+    assert connection.commits == 1
+    assert connection.closed
+
+
+def test_bulk_statement_quotes_the_file_path(tmp_path):
+    loader = make_loader(FakeConnection(), tmp_path, bulk_columns=['w', 'c'])
+    assert loader._bulk_statement("/tmp/it's\\x.tsv").startswith("LOAD DATA LOCAL INFILE '/tmp/it\\'s\\\\x.tsv' INTO TABLE words")
+    assert loader._bulk_statement("/tmp/a.tsv").endswith("(w,c)")
+
+
+def test_bulk_mode_requires_table():
+    with pytest.raises(RuntimeError):
+        MySQL_DBLoader(LOGGER, None, VALUES_PATH, None, 100, None, None, None, None, bulk_mode=True)
+
+
+def test_reconnects_and_retries_on_operational_error(tmp_path):
+    connection = FakeConnection(errors=[OperationalError('lost'), OperationalError('lost')])
+    connection.connected = False
+    loader = make_loader(connection, tmp_path)
+    loader.load('job', [{'word': 'a', 'count': 1}, {'word': 'b', 'count': 2}], last_call=True)
+
+    assert len(connection.statements) == 3
+    assert [content for (_, content) in connection.files] == [b'a\t1\nb\t2\n']
+    assert connection.reconnections == 1
+    assert connection.commits == 1
+    assert not loader.has_buffered_data()
+    assert os.listdir(str(tmp_path)) == []
+    loader.close()
+
+
+def test_rows_kept_when_the_retries_are_exhausted(tmp_path):
+    connection = FakeConnection(errors=[OperationalError('lost') for _ in range(6)])
+    loader = make_loader(connection, tmp_path)
+    loader.load('job', [{'word': 'a', 'count': 1}], last_call=True)
+
+    assert len(connection.statements) == 6
+    assert connection.commits == 0
+    assert loader.has_buffered_data()
+    assert os.listdir(str(tmp_path)) == []
+    # the next flush inserts the kept rows
+    loader.load('job', [{'word': 'b', 'count': 2}], last_call=True)
+    assert [content for (_, content) in connection.files] == [b'a\t1\nb\t2\n']
+    assert not loader.has_buffered_data()
+
+
+def test_rollback_on_data_error(tmp_path):
+    connection = FakeConnection(errors=[DataError('bad value')])
+    loader = make_loader(connection, tmp_path)
+    loader.load('job', [{'word': 'a', 'count': 1}], last_call=True)
+
+    assert connection.rollbacks == 1
+    assert connection.commits == 0
+    assert loader.has_buffered_data()
+
+
+def test_write_behind_failure_raised_by_close(tmp_path):
+    connection = FakeConnection(errors=[OperationalError('lost') for _ in range(6)])
+    loader = make_loader(connection, tmp_path, write_behind=True)
+    loader.load('job', [{'word': 'a', 'count': 1}], last_call=True)
+    with pytest.raises(RuntimeError):
+        loader.close()
+    assert connection.closed
+
+
+@pytest.mark.parametrize('write_behind', [False, True])
+def test_empty_last_call_loads_nothing(tmp_path, write_behind):
+    connection = FakeConnection()
+    loader = make_loader(connection, tmp_path, write_behind=write_behind)
+    loader.load('job', [], last_call=True)
+    loader.load('job', [{'count': 1}], last_call=True)
+    loader.close()
+
+    assert connection.statements == []
+    assert connection.files == []
+    assert connection.commits == 0
+    assert os.listdir(str(tmp_path)) == []
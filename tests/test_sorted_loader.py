@@ -0,0 +1,59 @@
+import sys
+import os
+sys.path.insert(0, os.path.abspath(os.path.dirname(__file__) + "/.."))
+
+import logging
+
+import pytest
+
+from tiny_etl.loaders.files import SortedCSV_FileLoader
+
+LOGGER = logging.getLogger("test_sorted_loader")
+VALUES_PATH = [('word', ['word'], True), ('count', ['count'], True)]
+
+
+def make_loader(tmp_path, **kwargs) -> SortedCSV_FileLoader:
+    os.makedirs(str(tmp_path / 'out'), exist_ok=True)
+    os.makedirs(str(tmp_path / 'spill'), exist_ok=True)
+    return SortedCSV_FileLoader(LOGGER, None, VALUES_PATH, str(tmp_path / 'out'),
+                                sort_key_paths=[['rank']],
+                                spill_dir=str(tmp_path / 'spill'),
+                                **kwargs)
+
+
+def output_lines(tmp_path) -> list:
+    [file_name] = os.listdir(str(tmp_path / 'out'))
+    with open(str(tmp_path / 'out' / file_name)) as fh:
+        return fh.read().splitlines()
+
+
+def test_rows_sorted_across_runs(tmp_path):
+    loader = make_loader(tmp_path, max_rows_in_memory=2)
+    loader.load('job', [{'word': w, 'count': str(r), 'rank': r} for (w, r) in [('c', 3), ('a', 1), ('e', 5), ('b', 2), ('d', 4)]], last_call=False)
+    loader.load('job', [], last_call=True)
+    loader.close()
+    assert output_lines(tmp_path) == ['a;1', 'b;2', 'c;3', 'd;4', 'e;5']
+    assert os.listdir(str(tmp_path / 'spill')) == []
+
+
+def test_rows_without_sort_key_skipped(tmp_path):
+    loader = make_loader(tmp_path)
+    loader.load('job', [{'word': 'b', 'count': '2', 'rank': 2}, {'word': 'x', 'count': '0'}, {'word': 'a', 'count': '1', 'rank': 1}], last_call=True)
+    loader.close()
+    assert loader.skipped_rows == 1
+    assert output_lines(tmp_path) == ['a;1', 'b;2']
+
+
+def test_close_raises_merge_errors(tmp_path):
+    loader = make_loader(tmp_path, max_rows_in_memory=1)
+    loader.load('job', [{'word': 'a', 'count': '1', 'rank': 1}, {'word': 'b', 'count': '2', 'rank': 2}], last_call=True)
+    assert loader.has_buffered_data()
+
+    def fail(rows):
+        raise OSError('No space left on device')
+    loader._write_rows = fail
+    with pytest.raises(OSError):
+        loader.close()
+    assert loader.file_hd is None
+    assert loader.runs == []
+    assert os.listdir(str(tmp_path / 'spill')) == []
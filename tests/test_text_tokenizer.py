@@ -0,0 +1,32 @@
+import sys
+import os
+sys.path.insert(0, os.path.abspath(os.path.dirname(__file__) + "/.."))
+
+import logging
+import re
+
+import pytest
+
+from tiny_etl.transformers.text import TextWordTokenizerTransformer, is_whitespace_pattern
+
+LOGGER = logging.getLogger("test_text_tokenizer")
+
+
+def test_whitespace_patterns():
+    for pattern in ("\\s+", "[ \\t]+", " +", "\\s{1,3}", "[\\n\\r]+"):
+        assert is_whitespace_pattern(pattern), pattern
+    for pattern in ("\\s*", "\\s?", "\\s{0,2}", "[ \\t]*", "\\W+", "[a-z]+", "", "(\\s"):
+        assert not is_whitespace_pattern(pattern), pattern
+
+
+def words(pattern: str, text: str, mappers: list) -> list:
+    transformer = TextWordTokenizerTransformer(LOGGER, pattern=pattern, input_key_path=['text'], output_key='token', mappers=mappers)
+    return [res['token']['word'] for res in transformer.transform({'text': text})]
+
+
+@pytest.mark.parametrize('pattern', ["\\s+", "\\s*", "\\s?", "[ ]{0,1}"])
+def test_case_mapping_output_identical(pattern):
+    text = 'straße x  İstanbul'
+    # the mapper applied on each token
+    expected = [word.upper() for word in re.split(pattern, text)]
+    assert words(pattern, text, [str.upper]) == expected
@@ -0,0 +1,98 @@
+import multiprocessing
+from multiprocessing import shared_memory
+from multiprocessing.sharedctypes import Value
+import pickle
+import queue
+import struct
+from typing import Any, List
+
+REFCOUNT_HEADER = struct.Struct('<q')
+
+
+class SharedBatchRef:
+    """
+    Message put in the loaders queues instead of the items : the name of the shared memory block holding the pickled batch
+    """
+    __slots__ = ('name', 'size', 'items_count')
+
+    def __init__(self, name: str, size: int, items_count: int) -> None:
+        self.name = name
+        self.size = size
+        self.items_count = items_count
+
+    def __getstate__(self):
+        return (self.name, self.size, self.items_count)
+
+    def __setstate__(self, state) -> None:
+        (self.name, self.size, self.items_count) = state
+
+
+def publish_shared_batch(items: List[Any], readers_count: int) -> SharedBatchRef:
+    """
+    Pickles the items once in a new shared memory block, read readers_count times before being released
+    """
+    data = pickle.dumps(items, protocol=pickle.HIGHEST_PROTOCOL)
+    shm = shared_memory.SharedMemory(create=True, size=REFCOUNT_HEADER.size + len(data))
+    try:
+        REFCOUNT_HEADER.pack_into(shm.buf, 0, readers_count)
+        shm.buf[REFCOUNT_HEADER.size:REFCOUNT_HEADER.size + len(data)] = data
+        return SharedBatchRef(shm.name, len(data), len(items))
+    finally:
+        shm.close()
+
+def read_shared_batch(ref: SharedBatchRef, lock: multiprocessing.Lock) -> List[Any]:
+    """
+    Unpickles the batch then releases the reference, the last reader unlinks the shared memory block
+    """
+    shm = shared_memory.SharedMemory(name=ref.name)
+    try:
+        with shm.buf[REFCOUNT_HEADER.size:REFCOUNT_HEADER.size + ref.size] as view:
+            items = pickle.loads(view)
+        with lock:
+            remaining = REFCOUNT_HEADER.unpack_from(shm.buf, 0)[0] - 1
+            REFCOUNT_HEADER.pack_into(shm.buf, 0, remaining)
+    finally:
+        shm.close()
+    if remaining == 0:
+        shm.unlink()
+    return items
+
+
+class SharedMemoryBroadcaster:
+    def __init__(self, out_queues: List[multiprocessing.Queue],
+                 pipeline_closed: Value,
+                 batch_size: int = 100,
+                 queue_no_block_timeout_sec: float = 0.05) -> None:
+        """
+        Sends the items of a transformation pipeline to all the loaders queues :
+        each batch of batch_size items is pickled once in shared memory and only a SharedBatchRef is put in every queue.
+
+        out_queues : the loaders queues
+        batch_size : items per shared memory block, flush() sends an incomplete batch (ex: the input queue is empty)
+        """
+        self.out_queues = out_queues
+        self.pipeline_closed = pipeline_closed
+        self.batch_size = max(1, batch_size)
+        self.queue_no_block_timeout_sec = queue_no_block_timeout_sec
+        self.batch = []
+
+    def push(self, x: Any) -> None:
+        self.batch.append(x)
+        if len(self.batch) >= self.batch_size:
+            self.flush()
+
+    def flush(self) -> None:
+        if len(self.batch) == 0:
+            return
+        items = self.batch
+        self.batch = []
+        ref = publish_shared_batch(items, len(self.out_queues))
+        pending_idx = {i for i in range(len(self.out_queues))}
+        while not self.pipeline_closed.value and len(pending_idx) > 0:
+            for (idx, out_queue) in enumerate(self.out_queues):
+                try:
+                    if idx in pending_idx:
+                        out_queue.put(ref, timeout=self.queue_no_block_timeout_sec)
+                        pending_idx.remove(idx)
+                except queue.Full:
+                    pass
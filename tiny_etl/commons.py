@@ -1,5 +1,7 @@
 from abc import ABC, abstractmethod
+import ctypes
 from functools import reduce
+import hashlib
 import logging
 from logging import ERROR, Logger, DEBUG, INFO
 import math
@@ -8,11 +10,13 @@ import os
 import random
 import sys
 import threading
+import time
 import traceback
 from typing import Any, AnyStr, Callable, Generator, List, Set, Tuple
 import uuid
 
 from tiny_etl.affinity import set_process_affinity_mask
+from tiny_etl.sketches import BloomFilter
 
 def rotary_iter(items: list, rand: bool=False):
     random.seed(str(uuid.uuid1()))
@@ -215,19 +219,48 @@ class WithLogging(ABC):
         self.logger = logger
 
     @staticmethod
-    def log_msg_sync(logger: Logger, msg: str, exception: Exception = None, level: int = logging.DEBUG):
+    def log_msg_sync(logger: Logger, msg: str, exception: Exception = None, level: int = logging.DEBUG, args: tuple = ()):
+        """
+        args : the msg %-format arguments, the message is formatted only if the level is enabled
+        """
         if not logger is None:
+            if not logger.isEnabledFor(level):
+                return
             if not exception is None and level==ERROR:
-                logger.log(level, "{}, Trace : {}".format(msg, 
-                                                          str(traceback.format_exception(etype=type(exception), value=exception, tb=exception.__traceback__))))
+                logger.log(level, "%s, Trace : %s", msg % args if args else msg,
+                                                    str(traceback.format_exception(type(exception), exception, exception.__traceback__)))
             else:
-                logger.log(level, msg)
+                logger.log(level, msg, *args)
         else:
-            print(msg)
+            print(msg % args if args else msg)
+
+    def log_enabled(self, level: int = logging.DEBUG) -> bool:
+        """
+        To guard the messages costly to build (ex: str(item)) in the hot paths
+        """
+        return self.logger is None or self.logger.isEnabledFor(level)
         
-    def log_msg(self, msg: str, exception: Exception = None, level: int = logging.DEBUG):
-        WithLogging.log_msg_sync(self.logger, msg, exception, level)
-        # threading.Thread(target=WithLogging.log_msg_sync, args=(self.logger, msg, exception, level)).start()
+    def log_msg(self, msg: str, exception: Exception = None, level: int = logging.DEBUG, args: tuple = ()):
+        WithLogging.log_msg_sync(self.logger, msg, exception, level, args)
+
+    def log_msg_sampled(self, msg: str, level: int = logging.DEBUG, args: tuple = (), interval_sec: float = 1.0):
+        """
+        Logs at most one message per interval_sec for the same msg (per item logs), the suppressed messages are counted
+        """
+        if not self.log_enabled(level):
+            return
+        samples = self.__dict__.setdefault('_log_samples', {})
+        now = time.monotonic()
+        sample = samples.get(msg)
+        if sample is not None and now - sample[0] < interval_sec:
+            sample[1] += 1
+            return
+        suppressed = sample[1] if sample is not None else 0
+        samples[msg] = [now, 0]
+        if suppressed > 0:
+            WithLogging.log_msg_sync(self.logger, msg + " (%d similar messages suppressed)", None, level, tuple(args) + (suppressed,))
+        else:
+            WithLogging.log_msg_sync(self.logger, msg, None, level, args)
     
 
 class LoggerWrapper(WithLogging):
@@ -307,4 +340,194 @@ class ConcurrentKeyBagSet(AbstractConcurrentKeyBagSet):
         except Exception:
             pass
         finally:
-            self.lock.release()
\ No newline at end of file
+            self.lock.release()
+
+class BloomFilterKeyBagSet(AbstractConcurrentKeyBagSet):
+    def __init__(self, lock: multiprocessing.Lock, expected_items: int = 1_000_000, false_positive_rate: float = 0.01) -> None:
+        """
+        Key bag set with a fixed memory per bag : one BloomFilter per bag key.
+        add_if_absent returns False for a new value with a probability ~ false_positive_rate, a duplicate is never seen as new.
+
+        lock                : multiprocessing.Lock
+        expected_items      : max distinct values per bag
+        false_positive_rate : float in ]0, 1[, memory per bag = -expected_items * ln(false_positive_rate) / ln(2)² bits
+        """
+        self.lock = lock
+        self.expected_items = expected_items
+        self.false_positive_rate = false_positive_rate
+        self.content = dict()
+        BloomFilter(expected_items, false_positive_rate)
+
+    def add_if_absent(self, bag_key, value) -> bool:
+        with self.lock:
+            if bag_key not in self.content:
+                self.content[bag_key] = BloomFilter(self.expected_items, self.false_positive_rate)
+            return self.content[bag_key].add(value)
+
+    def clear(self, bag_key):
+        with self.lock:
+            self.content.pop(bag_key, None)
+
+    def clearAll(self):
+        with self.lock:
+            self.content.clear()
+
+    def contains(self, bag_key, value) -> bool:
+        with self.lock:
+            if bag_key in self.content:
+                return value in self.content[bag_key]
+            return False
+
+def fingerprint64(*values) -> int:
+    """
+    Stable (the same in all processes) 64 bits fingerprint of the values, never 0
+    """
+    h = hashlib.blake2b(digest_size=8)
+    for value in values:
+        h.update(value.encode('utf-8', 'surrogatepass') if isinstance(value, str) else repr(value).encode('utf-8'))
+        h.update(b'\x00')
+    return int.from_bytes(h.digest(), 'little') or 1
+
+class SharedFingerprintKeyBagSet(AbstractConcurrentKeyBagSet):
+    EMPTY = 0
+    DELETED = 0xFFFFFFFFFFFFFFFF
+
+    def __init__(self, capacity: int = 1_000_000, stripes: int = 64) -> None:
+        """
+        Shared memory key bag set, usable from all the transformation pipelines processes.
+        It is an open addressing hash table of 64 bits fingerprints of (bag_key, value), with fixed memory (16 bytes per slot).
+        The table is split into stripes, each one has its own lock, so concurrent adds rarely wait.
+
+        capacity : max number of values (all bags), an error is raised when a stripe is full
+        stripes  : number of stripes (locks)
+
+        Two different values have a ~n²/2^65 chance to share a fingerprint (n = values count), the second one is then seen as a duplicate.
+        clear(bag_key) scans the whole table (UniqueFilterTransformer refuses clear_bag=True with this bag),
+        the freed slots are reclaimed by the same scan so the lookups don't slow down after many clears.
+        """
+        super().__init__()
+        self.stripes = max(1, stripes)
+        self.stripe_size = max(1, math.ceil(capacity/self.stripes))
+        self.capacity = self.stripe_size * self.stripes
+        self.slots = multiprocessing.RawArray(ctypes.c_uint64, self.capacity)
+        self.bags = multiprocessing.RawArray(ctypes.c_uint64, self.capacity)
+        self.locks = [multiprocessing.Lock() for _ in range(self.stripes)]
+
+    def _stripe(self, fp: int) -> int:
+        return (fp >> 32) % self.stripes
+
+    def _find(self, fp: int, stripe: int) -> Tuple[int, int]:
+        """
+        Returns (slot index of fp or -1, first free slot index or -1)
+        """
+        base = stripe * self.stripe_size
+        start = fp % self.stripe_size
+        free = -1
+        slots = self.slots
+        for i in range(self.stripe_size):
+            idx = base + (start + i) % self.stripe_size
+            val = slots[idx]
+            if val == fp:
+                return (idx, free)
+            if val == SharedFingerprintKeyBagSet.EMPTY:
+                return (-1, idx if free == -1 else free)
+            if val == SharedFingerprintKeyBagSet.DELETED and free == -1:
+                free = idx
+        return (-1, free)
+
+    @staticmethod
+    def _fingerprints(bag_key, value) -> Tuple[int, int]:
+        bag_fp = fingerprint64(bag_key)
+        fp = fingerprint64(bag_key, value)
+        if fp == SharedFingerprintKeyBagSet.DELETED:
+            fp -= 1
+        return (bag_fp, fp)
+
+    def add_if_absent(self, bag_key, value) -> bool:
+        (bag_fp, fp) = SharedFingerprintKeyBagSet._fingerprints(bag_key, value)
+        stripe = self._stripe(fp)
+        with self.locks[stripe]:
+            (idx, free) = self._find(fp, stripe)
+            if idx >= 0:
+                return False
+            if free < 0:
+                raise RuntimeError('SharedFingerprintKeyBagSet stripe {} is full (capacity={})'.format(stripe, self.capacity))
+            self.bags[free] = bag_fp
+            self.slots[free] = fp
+            return True
+
+    def clear(self, bag_key):
+        bag_fp = fingerprint64(bag_key)
+        for stripe in range(self.stripes):
+            base = stripe * self.stripe_size
+            with self.locks[stripe]:
+                cleared = False
+                for idx in range(base, base + self.stripe_size):
+                    if self.bags[idx] == bag_fp and self.slots[idx] != SharedFingerprintKeyBagSet.EMPTY:
+                        self.slots[idx] = SharedFingerprintKeyBagSet.DELETED
+                        self.bags[idx] = 0
+                        cleared = True
+                if cleared:
+                    self._reclaim_deleted(stripe)
+
+    def _reclaim_deleted(self, stripe: int) -> None:
+        """
+        A deleted slot followed by an empty one ends the probe sequences the same way, it becomes empty.
+        The stripe is rehashed when too many deleted slots remain (the lookups stop only on an empty slot).
+        Called with the stripe lock held.
+        """
+        (EMPTY, DELETED) = (SharedFingerprintKeyBagSet.EMPTY, SharedFingerprintKeyBagSet.DELETED)
+        base = stripe * self.stripe_size
+        size = self.stripe_size
+        slots = self.slots
+        empty = -1
+        for i in range(size):
+            if slots[base + i] == EMPTY:
+                empty = i
+                break
+        deleted = 0
+        if empty < 0:
+            deleted = sum([1 for i in range(base, base + size) if slots[i] == DELETED])
+        else:
+            # walks backward from an empty slot, the emptied slots make the previous deleted ones reclaimable
+            for k in range(1, size):
+                idx = base + (empty - k) % size
+                if slots[idx] == DELETED:
+                    if slots[base + (empty - k + 1) % size] == EMPTY:
+                        slots[idx] = EMPTY
+                    else:
+                        deleted += 1
+        if deleted > size // 8:
+            self._rehash(stripe)
+
+    def _rehash(self, stripe: int) -> None:
+        (EMPTY, DELETED) = (SharedFingerprintKeyBagSet.EMPTY, SharedFingerprintKeyBagSet.DELETED)
+        base = stripe * self.stripe_size
+        size = self.stripe_size
+        (slots, bags) = (self.slots, self.bags)
+        entries = [(slots[i], bags[i]) for i in range(base, base + size) if slots[i] != EMPTY and slots[i] != DELETED]
+        for i in range(base, base + size):
+            slots[i] = EMPTY
+            bags[i] = 0
+        for (fp, bag_fp) in entries:
+            start = fp % size
+            for i in range(size):
+                idx = base + (start + i) % size
+                if slots[idx] == EMPTY:
+                    slots[idx] = fp
+                    bags[idx] = bag_fp
+                    break
+
+    def clearAll(self):
+        for lock in self.locks:
+            lock.acquire()
+        try:
+            ctypes.memset(self.slots, 0, ctypes.sizeof(self.slots))
+            ctypes.memset(self.bags, 0, ctypes.sizeof(self.bags))
+        finally:
+            for lock in self.locks:
+                lock.release()
+
+    def contains(self, bag_key, value) -> bool:
+        (_, fp) = SharedFingerprintKeyBagSet._fingerprints(bag_key, value)
+        return self._find(fp, self._stripe(fp))[0] >= 0
@@ -0,0 +1,107 @@
+import bz2
+import gzip
+import io
+import lzma
+import os
+import queue
+import threading
+from typing import Any
+
+COMPRESSION_SUFFIXES = {'.gz': 'gzip', '.bz2': 'bz2', '.xz': 'xz'}
+COMPRESSION_MAGICS = [(b'\x1f\x8b', 'gzip'), (b'BZh', 'bz2'), (b'\xfd7zXZ\x00', 'xz')]
+COMPRESSION_OPENERS = {'gzip': gzip.open, 'bz2': bz2.open, 'xz': lzma.open}
+
+def strip_compression_suffix(file_path: str) -> str:
+    (root, ext) = os.path.splitext(file_path)
+    return root if ext in COMPRESSION_SUFFIXES else file_path
+
+def detect_compression(file_path: str, check_magic: bool = True) -> str:
+    """
+    Returns 'gzip', 'bz2', 'xz' or None, using the file suffix then the magic bytes
+    """
+    codec = COMPRESSION_SUFFIXES.get(os.path.splitext(file_path)[1])
+    if codec is not None or not check_magic:
+        return codec
+    with open(file_path, 'rb') as fh:
+        head = fh.read(6)
+    for (magic, codec) in COMPRESSION_MAGICS:
+        if head.startswith(magic):
+            return codec
+    return None
+
+
+class ThreadedDecompressReader(io.RawIOBase):
+    """
+    Binary reader of a compressed file, the decompression runs in a separate thread
+    which prefetches up to prefetch_blocks decompressed blocks, so it overlaps with the consumer work (ex: tokenization).
+    The compression modules release the GIL while decompressing.
+    """
+    def __init__(self, file_path: str, codec: str, block_size: int = 1024*1024, prefetch_blocks: int = 4) -> None:
+        super().__init__()
+        self.file_path = file_path
+        self.codec = codec
+        self.block_size = block_size
+        self.blocks = queue.Queue(maxsize=max(1, prefetch_blocks))
+        self.stop = threading.Event()
+        self.current = memoryview(b'')
+        self.eof = False
+        self.thread = threading.Thread(target=self._decompress, daemon=True)
+        self.thread.start()
+
+    def _put(self, block: Any) -> None:
+        while not self.stop.is_set():
+            try:
+                self.blocks.put(block, timeout=0.1)
+                return
+            except queue.Full:
+                pass
+
+    def _decompress(self) -> None:
+        try:
+            with COMPRESSION_OPENERS[self.codec](self.file_path, 'rb') as fh:
+                while not self.stop.is_set():
+                    block = fh.read(self.block_size)
+                    if not block:
+                        break
+                    self._put(block)
+            self._put(None)
+        except Exception as ex:
+            self._put(ex)
+
+    def readable(self) -> bool:
+        return True
+
+    def readinto(self, buffer) -> int:
+        while len(self.current) == 0:
+            if self.eof:
+                return 0
+            block = self.blocks.get()
+            if block is None:
+                self.eof = True
+                return 0
+            if isinstance(block, Exception):
+                self.eof = True
+                raise block
+            self.current = memoryview(block)
+        n = min(len(buffer), len(self.current))
+        buffer[:n] = self.current[:n]
+        self.current = self.current[n:]
+        return n
+
+    def close(self) -> None:
+        if not self.closed:
+            self.stop.set()
+            self.thread.join()
+        super().close()
+
+
+def open_input_file(file_path: str, decompress: bool = True, threaded: bool = True, block_size: int = 1024*1024):
+    """
+    Opens the file in binary mode, compressed files (gzip, bz2, xz) are decompressed on the fly
+    """
+    codec = detect_compression(file_path) if decompress else None
+    if codec is None:
+        return open(file_path, 'rb', buffering=0)
+    if threaded:
+        return ThreadedDecompressReader(file_path, codec, block_size=block_size)
+    return COMPRESSION_OPENERS[codec](file_path, 'rb')
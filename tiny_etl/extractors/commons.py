@@ -1,8 +1,20 @@
 from abc import abstractmethod
 from logging import Logger
+import os
 from typing import Dict, Generator, AnyStr, List
 from tiny_etl.commons import WithLogging
 
+def path_size_in_bytes(path: str) -> int:
+    """
+    Returns 0 when the path is None or can't be read
+    """
+    if path is None:
+        return 0
+    try:
+        return os.path.getsize(path)
+    except OSError:
+        return 0
+
 class AbstractExtractor(WithLogging):
     def __init__(self, logger: Logger) -> None:
         super().__init__(logger)
@@ -11,5 +23,11 @@ class AbstractExtractor(WithLogging):
     def extract(self) -> Generator[Dict, None, None]:
         pass
 
+    def item_size_in_bytes(self, item: Dict) -> int:
+        """
+        Input bytes represented by an extracted item (ex: the file size), used by the pipeline stats for the progress and the ETA
+        """
+        return 0
+
     def close(self) -> None:
-        pass
\ No newline at end of file
+        pass
@@ -1,18 +1,27 @@
-from logging import Logger
-from typing import Dict, Generator, AnyStr, List
+from fnmatch import translate
+from logging import Logger, ERROR, INFO
 import os
+import queue
+import re
+import threading
+from typing import Dict, Generator, AnyStr, List, Tuple
 
-from tiny_etl.extractors.commons import AbstractExtractor
+from tiny_etl.compression import detect_compression, strip_compression_suffix
+from tiny_etl.extractors.commons import AbstractExtractor, path_size_in_bytes
 
 class FilesListExtractor(AbstractExtractor):
     """
     yields a dict
     """
-    def __init__(self, logger: Logger, input_dir: str, file_pattern: str, output_key: str) -> None:
+    def __init__(self, logger: Logger, input_dir: str, file_pattern: str, output_key: str, accept_compressed: bool = False) -> None:
+        """
+        accept_compressed : True to yield also the gzip, bz2 and xz files (ex: file.txt.gz matches the file_pattern .txt)
+        """
         super().__init__(logger)
         self.input_dir = input_dir
         self.output_key = output_key
         self.file_pattern = file_pattern
+        self.accept_compressed = accept_compressed
         if not os.path.isdir(input_dir):
             raise RuntimeError("{} should be a valid directory".format(input_dir))
 
@@ -20,20 +29,27 @@ class FilesListExtractor(AbstractExtractor):
         for root_dir, dirs, files in os.walk(self.input_dir):
             if len(files)>0:
                 for file in files:
-                    if file.endswith(self.file_pattern):
+                    if file.endswith(self.file_pattern) or (self.accept_compressed and strip_compression_suffix(file).endswith(self.file_pattern)):
                         file_path = os.path.join(root_dir, file)
                         res = dict([(self.output_key,file_path)])
                         yield res
 
+    def item_size_in_bytes(self, item: dict) -> int:
+        return path_size_in_bytes(item.get(self.output_key))
+
 class FoldersFilesListExtractor(AbstractExtractor):
     """
     yields a dict
     """
-    def __init__(self, logger: Logger, input_dirs: List[AnyStr], file_pattern: str, output_key: str) -> None:
+    def __init__(self, logger: Logger, input_dirs: List[AnyStr], file_pattern: str, output_key: str, accept_compressed: bool = False) -> None:
+        """
+        accept_compressed : True to yield also the gzip, bz2 and xz files (ex: file.txt.gz matches the file_pattern .txt)
+        """
         super().__init__(logger)
         self.input_dirs = input_dirs
         self.output_key = output_key
         self.file_pattern = file_pattern
+        self.accept_compressed = accept_compressed
         for input_dir in input_dirs:
             if not os.path.isdir(input_dir):
                 raise RuntimeError("{} should be a valid directory".format(input_dir))
@@ -43,7 +59,285 @@ class FoldersFilesListExtractor(AbstractExtractor):
             for root_dir, dirs, files in os.walk(input_dir):
                 if len(files)>0:
                     for file in files:
-                        if file.endswith(self.file_pattern):
+                        if file.endswith(self.file_pattern) or (self.accept_compressed and strip_compression_suffix(file).endswith(self.file_pattern)):
                             file_path = os.path.join(root_dir, file)
                             res = dict([(self.output_key, file_path)])
-                            yield res
\ No newline at end of file
+                            yield res
+
+    def item_size_in_bytes(self, item: dict) -> int:
+        return path_size_in_bytes(item.get(self.output_key))
+
+class ScandirFilesExtractor(AbstractExtractor):
+    """
+    yields a dict : {output_key: file_path, size_key: int, mtime_key: float}
+    """
+    def __init__(self, logger: Logger, 
+                 input_dirs: List[AnyStr], 
+                 output_key: str,
+                 file_pattern: str = None,
+                 file_regex: str = None,
+                 exclude_patterns: List[AnyStr] = [],
+                 min_size: int = None,
+                 max_size: int = None,
+                 min_mtime: float = None,
+                 max_mtime: float = None,
+                 size_key: str = 'file_size',
+                 mtime_key: str = 'file_mtime',
+                 max_walkers: int = 4,
+                 queue_max_size: int = 10_000,
+                 follow_symlinks: bool = False,
+                 accept_compressed: bool = False) -> None:
+        """
+        input_dirs        : List[dir_path]
+        output_key        : str
+        file_pattern      : glob matched against the file name (ex: "*.txt")
+        file_regex        : regex searched in the file name
+        exclude_patterns  : List[glob] matched against files and folders names, excluded folders are not walked
+        min_size/max_size : file size range in bytes (inclusive)
+        min_mtime/max_mtime : file modification time range in seconds since epoch (inclusive)
+        size_key          : key of the file size in the yielded dict (None to omit it)
+        mtime_key         : key of the file mtime in the yielded dict (None to omit it)
+        max_walkers       : number of threads walking the subfolders in parallel
+        queue_max_size    : max files discovered but not yet yielded
+        follow_symlinks   : True to follow symbolic links
+        accept_compressed : True to match file_pattern/file_regex also against the names without the .gz, .bz2 and .xz suffix
+        
+        Files are yielded in the order they are discovered.
+        Size and mtime come from the DirEntry stat cache, so later stages can skip the os.path.isfile/os.stat calls.
+        """
+        super().__init__(logger)
+        self.input_dirs = input_dirs
+        self.output_key = output_key
+        self.file_pattern = file_pattern
+        self.file_regex = file_regex
+        self.exclude_patterns = exclude_patterns if exclude_patterns is not None else []
+        self.min_size = min_size
+        self.max_size = max_size
+        self.min_mtime = min_mtime
+        self.max_mtime = max_mtime
+        self.size_key = size_key
+        self.mtime_key = mtime_key
+        self.max_walkers = max(1, max_walkers)
+        self.queue_max_size = max(1, queue_max_size)
+        self.follow_symlinks = follow_symlinks
+        self.accept_compressed = accept_compressed
+        for input_dir in input_dirs:
+            if not os.path.isdir(input_dir):
+                raise RuntimeError("{} should be a valid directory".format(input_dir))
+
+    def _compile_filters(self):
+        file_re = re.compile(translate(self.file_pattern)) if self.file_pattern is not None else None
+        regex_re = re.compile(self.file_regex) if self.file_regex is not None else None
+        exclude_re = re.compile('|'.join([translate(p) for p in self.exclude_patterns])) if len(self.exclude_patterns)>0 else None
+        return (file_re, regex_re, exclude_re)
+
+    def _accept_name(self, name: str, file_re, regex_re) -> bool:
+        names = [name, strip_compression_suffix(name)] if self.accept_compressed else [name]
+        for name in names:
+            if (file_re is None or file_re.match(name)) and (regex_re is None or regex_re.search(name)):
+                return True
+        return False
+
+    def _accept_stat(self, size: int, mtime: float) -> bool:
+        if self.min_size is not None and size < self.min_size:
+            return False
+        if self.max_size is not None and size > self.max_size:
+            return False
+        if self.min_mtime is not None and mtime < self.min_mtime:
+            return False
+        if self.max_mtime is not None and mtime > self.max_mtime:
+            return False
+        return True
+
+    @staticmethod
+    def _put_until_stopped(files_queue: queue.Queue, res: dict, stop: threading.Event):
+        while not stop.is_set():
+            try:
+                files_queue.put(res, timeout=0.1)
+                break
+            except queue.Full:
+                pass
+
+    def _walk(self, dirs_queue: queue.Queue, files_queue: queue.Queue, pending: list, lock: threading.Lock, stop: threading.Event):
+        (file_re, regex_re, exclude_re) = self._compile_filters()
+        while not stop.is_set():
+            dir_path = dirs_queue.get()
+            if dir_path is None:
+                break
+            sub_dirs = []
+            try:
+                with os.scandir(dir_path) as it:
+                    for entry in it:
+                        if stop.is_set():
+                            break
+                        name = entry.name
+                        if exclude_re is not None and exclude_re.match(name):
+                            continue
+                        try:
+                            if entry.is_dir(follow_symlinks=self.follow_symlinks):
+                                sub_dirs.append(entry.path)
+                                continue
+                            if not entry.is_file(follow_symlinks=self.follow_symlinks):
+                                continue
+                            if not self._accept_name(name, file_re, regex_re):
+                                continue
+                            st = entry.stat(follow_symlinks=self.follow_symlinks)
+                        except OSError as ex:
+                            super().log_msg("Scandir error on {} : {}".format(entry.path, str(ex.args)))
+                            continue
+                        if not self._accept_stat(st.st_size, st.st_mtime):
+                            continue
+                        res = {self.output_key: entry.path}
+                        if self.size_key is not None:
+                            res[self.size_key] = st.st_size
+                        if self.mtime_key is not None:
+                            res[self.mtime_key] = st.st_mtime
+                        ScandirFilesExtractor._put_until_stopped(files_queue, res, stop)
+            except OSError as ex:
+                super().log_msg("Scandir error on {} : {}".format(dir_path, str(ex.args)), exception=ex, level=ERROR)
+            finally:
+                with lock:
+                    for sub_dir in sub_dirs:
+                        dirs_queue.put(sub_dir)
+                    pending[0] += len(sub_dirs) - 1
+                    walk_finished = pending[0] == 0
+                if walk_finished:
+                    for _ in range(self.max_walkers):
+                        dirs_queue.put(None)
+                    ScandirFilesExtractor._put_until_stopped(files_queue, None, stop)
+
+    def extract(self) -> Generator[dict, None, None]:
+        dirs_queue = queue.Queue()
+        files_queue = queue.Queue(maxsize=self.queue_max_size)
+        lock = threading.Lock()
+        stop = threading.Event()
+        pending = [len(self.input_dirs)]
+        if pending[0]==0:
+            return
+        for input_dir in self.input_dirs:
+            dirs_queue.put(input_dir)
+
+        walkers = [threading.Thread(target=self._walk, args=(dirs_queue, files_queue, pending, lock, stop), daemon=True) 
+                    for _ in range(self.max_walkers)]
+        for walker in walkers:
+            walker.start()
+        super().log_msg("{} scandir walkers started".format(len(walkers)), level=INFO)
+        try:
+            while True:
+                res = files_queue.get()
+                if res is None:
+                    break
+                yield res
+        finally:
+            stop.set()
+            for _ in range(self.max_walkers):
+                dirs_queue.put(None)
+            for walker in walkers:
+                walker.join()
+
+    def item_size_in_bytes(self, item: dict) -> int:
+        size = item.get(self.size_key) if self.size_key is not None else None
+        return size if size is not None else path_size_in_bytes(item.get(self.output_key))
+
+
+class FileByteRangesExtractor(AbstractExtractor):
+    """
+    yields a dict : the wrapped extractor item + {output_key: {file_path, start, end, chunk_idx, chunks_count, compression}}
+    """
+    WHITESPACE_BYTES = b' \t\n\r\x0b\x0c'
+    LINE_BYTES = b'\n'
+
+    def __init__(self, logger: Logger,
+                 extractor: AbstractExtractor,
+                 path_key: str,
+                 output_key: str,
+                 chunk_size: int = 64*1024*1024,
+                 min_file_size: int = None,
+                 size_key: str = None,
+                 align_on: str = 'whitespace',
+                 align_window_size: int = 64*1024) -> None:
+        """
+        extractor          : AbstractExtractor listing the files (ex: FilesListExtractor, ScandirFilesExtractor)
+        path_key           : key of the file path in the items of the wrapped extractor
+        output_key         : str
+        chunk_size         : approximate size in bytes of each byte range
+        min_file_size      : files smaller than this size are yielded as one range (default to chunk_size)
+        size_key           : key of the file size in the items (ex: ScandirFilesExtractor), None to call os.path.getsize
+        align_on           : 'whitespace' or 'line', the ranges end just after an ASCII whitespace or a new line byte
+        align_window_size  : bytes read at once when searching for the alignment byte
+
+        ASCII whitespaces never appear inside an UTF-8 multibytes sequence, so the ranges can be decoded separately.
+        The compressed files (gzip, bz2, xz) are yielded as one unsplit range (compression set), read whole and decompressed by the reader.
+        Use FileByteRangeReaderTransformer to read the ranges and ChunksMergeLoader to recombine the per file aggregates.
+        """
+        super().__init__(logger)
+        self.extractor = extractor
+        self.path_key = path_key
+        self.output_key = output_key
+        self.chunk_size = max(1, chunk_size)
+        self.min_file_size = min_file_size if min_file_size is not None else self.chunk_size
+        self.size_key = size_key
+        self.align_window_size = max(1, align_window_size)
+        if align_on == 'whitespace':
+            self.align_bytes = FileByteRangesExtractor.WHITESPACE_BYTES
+        elif align_on == 'line':
+            self.align_bytes = FileByteRangesExtractor.LINE_BYTES
+        else:
+            raise RuntimeError("align_on should be 'whitespace' or 'line', {} given".format(align_on))
+
+        if extractor is None:
+            raise RuntimeError("Wrapped extractor required")
+
+    def _next_aligned_offset(self, fh, offset: int, size: int) -> int:
+        fh.seek(offset)
+        while offset < size:
+            window = fh.read(self.align_window_size)
+            if not window:
+                break
+            positions = [p for p in (window.find(b) for b in self.align_bytes) if p >= 0]
+            if len(positions) > 0:
+                return offset + min(positions) + 1
+            offset += len(window)
+        return size
+
+    def _byte_ranges(self, file_path: str, size: int) -> List[Tuple[int, int]]:
+        if size < self.min_file_size or size <= self.chunk_size:
+            return [(0, size)]
+        ranges = []
+        start = 0
+        with open(file_path, 'rb') as fh:
+            while start < size:
+                end = size if start + self.chunk_size >= size else self._next_aligned_offset(fh, start + self.chunk_size, size)
+                ranges.append((start, end))
+                start = end
+        return ranges
+
+    def extract(self) -> Generator[dict, None, None]:
+        for item in self.extractor.extract():
+            if item is None:
+                continue
+            file_path = item.get(self.path_key)
+            if file_path is None:
+                raise RuntimeError("Item doesn't contains the path_key={}".format(self.path_key))
+            size = item.get(self.size_key) if self.size_key is not None else None
+            if size is None:
+                size = os.path.getsize(file_path)
+            # the offsets of a compressed stream can't be decompressed separately
+            compression = detect_compression(file_path)
+            ranges = self._byte_ranges(file_path, size) if compression is None else [(0, size)]
+            for (chunk_idx, (start, end)) in enumerate(ranges):
+                res = dict(item)
+                res[self.output_key] = {'file_path': file_path, 
+                                        'start': start, 
+                                        'end': end, 
+                                        'chunk_idx': chunk_idx, 
+                                        'chunks_count': len(ranges),
+                                        'compression': compression}
+                yield res
+
+    def item_size_in_bytes(self, item: dict) -> int:
+        byte_range = item.get(self.output_key)
+        return byte_range['end'] - byte_range['start'] if byte_range is not None else 0
+
+    def close(self) -> None:
+        self.extractor.close()
@@ -0,0 +1,314 @@
+from logging import Logger, INFO, WARN
+import hashlib
+import os
+import sqlite3
+import time
+from typing import Generator, List, Tuple
+import uuid
+
+from tiny_etl.extractors.commons import AbstractExtractor
+from tiny_etl.finalizers import AbstractFinalizer
+
+
+class FilesManifest:
+    """
+    Persistent manifest of the loaded files : path, size, mtime and an optional content hash.
+    It is stored in a SQLite database (indexed by scope and path) so the lookups stay fast for millions of files.
+    The files are grouped by scope (ex: the input directory of a pipeline), the runs of a scope never change the files of the others.
+    The files seen by a run are staged under its run_id, they replace the loaded files of its scope only once the run is promoted.
+    The staged files are buffered and written by commit() in one short transaction, so the runs sharing the manifest don't wait
+    for each other (timeout : seconds to wait for the database lock).
+    """
+    def __init__(self, manifest_path: str, timeout: float = 60) -> None:
+        self.manifest_path = manifest_path
+        self.timeout = timeout
+        self.connection = None
+        self.staged = []
+
+    def _columns(self, table: str) -> List[str]:
+        return [row[1] for row in self.connection.execute("PRAGMA table_info({})".format(table)).fetchall()]
+
+    def _migrate(self) -> None:
+        """
+        Manifests created without scopes : their files get the default scope '', the staged runs are discarded
+        """
+        if 'scope' in self._columns('runs'):
+            return
+        with self.connection:
+            self.connection.execute("DROP TABLE IF EXISTS staged_files")
+            self.connection.execute("DROP TABLE IF EXISTS runs")
+            if len(self._columns('files')) > 0 and 'scope' not in self._columns('files'):
+                self.connection.execute("ALTER TABLE files RENAME TO files_unscoped")
+                self._create_tables()
+                self.connection.execute("""INSERT INTO files (scope, path, size, mtime, hash, run_id)
+                                              SELECT '', path, size, mtime, hash, run_id FROM files_unscoped""")
+                self.connection.execute("DROP TABLE files_unscoped")
+
+    def _create_tables(self) -> None:
+        self.connection.execute("""CREATE TABLE IF NOT EXISTS files (
+                                        scope TEXT NOT NULL,
+                                        path TEXT NOT NULL,
+                                        size INTEGER NOT NULL,
+                                        mtime REAL NOT NULL,
+                                        hash TEXT,
+                                        run_id TEXT NOT NULL,
+                                        PRIMARY KEY (scope, path)) WITHOUT ROWID""")
+        self.connection.execute("""CREATE TABLE IF NOT EXISTS staged_files (
+                                        run_id TEXT NOT NULL,
+                                        path TEXT NOT NULL,
+                                        size INTEGER NOT NULL,
+                                        mtime REAL NOT NULL,
+                                        hash TEXT,
+                                        PRIMARY KEY (run_id, path)) WITHOUT ROWID""")
+        self.connection.execute("""CREATE TABLE IF NOT EXISTS runs (
+                                        run_id TEXT PRIMARY KEY,
+                                        scope TEXT NOT NULL,
+                                        started_at REAL NOT NULL,
+                                        extracted_at REAL)""")
+
+    def open(self) -> None:
+        if self.connection is None:
+            self.connection = sqlite3.connect(self.manifest_path, timeout=self.timeout)
+            self.connection.execute("PRAGMA journal_mode=WAL")
+            self.connection.execute("PRAGMA synchronous=NORMAL")
+            self._migrate()
+            self._create_tables()
+            self.connection.commit()
+
+    def get(self, scope: str, path: str) -> Tuple[int, float, str]:
+        row = self.connection.execute("SELECT size, mtime, hash FROM files WHERE scope=? AND path=?", (scope, path)).fetchone()
+        return row
+
+    def start_run(self, run_id: str, scope: str) -> int:
+        """
+        Removes the staged files of the runs of the scope never promoted (ex: crashed runs), then registers the run.
+        Returns the count of the runs discarded
+        """
+        run_ids = [run for (run,) in self.connection.execute("SELECT run_id FROM runs WHERE scope=? AND run_id<>?", (scope, run_id)).fetchall()]
+        for run in run_ids + [run_id]:
+            self.connection.execute("DELETE FROM staged_files WHERE run_id=?", (run,))
+            self.connection.execute("DELETE FROM runs WHERE run_id=?", (run,))
+        # staged by a run discarded while it was running
+        self.connection.execute("DELETE FROM staged_files WHERE run_id NOT IN (SELECT run_id FROM runs)")
+        self.connection.execute("INSERT INTO runs (run_id, scope, started_at, extracted_at) VALUES (?,?,?,NULL)", (run_id, scope, time.time()))
+        return len(run_ids)
+
+    def stage(self, path: str, size: int, mtime: float, hash: str, run_id: str) -> None:
+        self.staged.append((run_id, path, size, mtime, hash))
+
+    def deleted_paths(self, run_id: str, scope: str) -> Generator[str, None, None]:
+        for (path,) in self.connection.execute("""SELECT f.path FROM files f
+                                                  LEFT JOIN staged_files s ON s.run_id=? AND s.path=f.path
+                                                  WHERE f.scope=? AND s.path IS NULL""", (run_id, scope)).fetchall():
+            yield path
+
+    def set_extracted(self, run_id: str) -> bool:
+        """
+        Returns False if the run was discarded (another run of the same scope started meanwhile)
+        """
+        return self.connection.execute("UPDATE runs SET extracted_at=? WHERE run_id=?", (time.time(), run_id)).rowcount == 1
+
+    def is_extracted(self, run_id: str) -> bool:
+        return self.connection.execute("SELECT 1 FROM runs WHERE run_id=? AND extracted_at IS NOT NULL", (run_id,)).fetchone() is not None
+
+    def promote(self, run_id: str, scope: str) -> Tuple[int, int]:
+        """
+        The staged files of the run replace the manifest files of the scope, the files of the scope not seen by the run are removed.
+        Returns (files count, deleted files count)
+        """
+        with self.connection:
+            deleted = self.connection.execute("""DELETE FROM files WHERE scope=? AND path NOT IN
+                                                    (SELECT path FROM staged_files WHERE run_id=?)""", (scope, run_id)).rowcount
+            files = self.connection.execute("""INSERT OR REPLACE INTO files (scope, path, size, mtime, hash, run_id)
+                                                  SELECT ?, path, size, mtime, hash, run_id FROM staged_files WHERE run_id=?""", (scope, run_id)).rowcount
+            self.connection.execute("DELETE FROM staged_files WHERE run_id=?", (run_id,))
+            self.connection.execute("DELETE FROM runs WHERE run_id=?", (run_id,))
+        return (files, deleted)
+
+    def commit(self) -> None:
+        if self.connection is not None:
+            if len(self.staged) > 0:
+                self.connection.executemany("INSERT OR REPLACE INTO staged_files (run_id, path, size, mtime, hash) VALUES (?,?,?,?,?)",
+                                            self.staged)
+                self.staged = []
+            self.connection.commit()
+
+    def close(self) -> None:
+        """
+        The changes not committed are discarded
+        """
+        self.staged = []
+        if self.connection is not None:
+            self.connection.close()
+            self.connection = None
+
+
+class IncrementalFilesExtractor(AbstractExtractor):
+    """
+    yields the dicts of the wrapped extractor
+    """
+    def __init__(self, logger: Logger,
+                 extractor: AbstractExtractor,
+                 manifest_path: str,
+                 path_key: str,
+                 size_key: str = None,
+                 mtime_key: str = None,
+                 incremental: bool = True,
+                 hash_content: bool = False,
+                 hash_algorithm: str = 'blake2b',
+                 emit_tombstones: bool = False,
+                 tombstone_key: str = 'deleted',
+                 commit_every: int = 1000,
+                 scope: str = None) -> None:
+        """
+        extractor        : AbstractExtractor listing the files (ex: FilesListExtractor, ScandirFilesExtractor)
+        manifest_path    : path of the manifest database file
+        path_key         : key of the file path in the items of the wrapped extractor
+        size_key         : key of the file size in the items (ex: ScandirFilesExtractor), None to call os.stat
+        mtime_key        : key of the file mtime in the items (ex: ScandirFilesExtractor), None to call os.stat
+        incremental      : True to yield only the new or changed files, False to yield all the files (the manifest is refreshed)
+        hash_content     : True to store a content hash, a file with a new mtime but the same content is not yielded
+        hash_algorithm   : hashlib algorithm name
+        emit_tombstones  : True to yield {path_key: path, tombstone_key: True} for the files deleted since the last run,
+                           the file readers (ex: FileTextReaderTransformer(tombstone_key=...)) skip them
+        tombstone_key    : str
+        commit_every     : number of files between two commits of the staged files
+        scope            : the files set of this extractor in the manifest, default to the input directories of the wrapped extractor
+                           (input_dir or input_dirs attribute). Pipelines sharing a manifest (ex: one pipeline per sub-directory)
+                           should have distinct scopes
+
+        The wrapped extractor should list the whole scope, otherwise the files filtered out are seen as deleted.
+        Two runs of the same scope can't be concurrent : the last one started discards the other, which raises a RuntimeError.
+        The files seen are staged : the manifest is updated by commit_run() once the files are loaded
+        (ThreadedPipeline(..., finalizers=[ManifestCommitFinalizer(logger, extractor)])), so a crashed run yields them again.
+        """
+        super().__init__(logger)
+        self.extractor = extractor
+        self.manifest_path = manifest_path
+        self.path_key = path_key
+        self.size_key = size_key
+        self.mtime_key = mtime_key
+        self.incremental = incremental
+        self.hash_content = hash_content
+        self.hash_algorithm = hash_algorithm
+        self.emit_tombstones = emit_tombstones
+        self.tombstone_key = tombstone_key
+        self.commit_every = max(1, commit_every)
+        self.scope = scope if scope is not None else IncrementalFilesExtractor.default_scope(extractor)
+        # set before the extractor is sent to the pipeline processes, so commit_run() knows the run to promote
+        self.run_id = str(uuid.uuid1())
+
+        if extractor is None:
+            raise RuntimeError("Wrapped extractor required")
+        hashlib.new(hash_algorithm)
+
+    @staticmethod
+    def default_scope(extractor: AbstractExtractor) -> str:
+        input_dirs = getattr(extractor, 'input_dirs', None)
+        if input_dirs is None:
+            input_dir = getattr(extractor, 'input_dir', None)
+            input_dirs = [input_dir] if input_dir is not None else []
+        return os.pathsep.join(sorted([os.path.abspath(input_dir) for input_dir in input_dirs]))
+
+    def _file_hash(self, file_path: str) -> str:
+        h = hashlib.new(self.hash_algorithm)
+        with open(file_path, 'rb') as fh:
+            while True:
+                block = fh.read(1024*1024)
+                if not block:
+                    break
+                h.update(block)
+        return h.hexdigest()
+
+    def _file_stat(self, item: dict, file_path: str) -> Tuple[int, float]:
+        size = item.get(self.size_key) if self.size_key is not None else None
+        mtime = item.get(self.mtime_key) if self.mtime_key is not None else None
+        if size is None or mtime is None:
+            st = os.stat(file_path)
+            (size, mtime) = (st.st_size, st.st_mtime)
+        return (size, mtime)
+
+    def extract(self) -> Generator[dict, None, None]:
+        run_id = self.run_id
+        manifest = FilesManifest(self.manifest_path)
+        manifest.open()
+        (seen, yielded, deleted) = (0, 0, 0)
+        try:
+            discarded = manifest.start_run(run_id, self.scope)
+            manifest.commit()
+            if discarded > 0:
+                super().log_msg("Manifest {} : {} runs of the scope {} never committed, discarded".format(self.manifest_path, discarded, self.scope), level=WARN)
+            for item in self.extractor.extract():
+                if item is None:
+                    continue
+                file_path = item.get(self.path_key)
+                if file_path is None:
+                    raise RuntimeError("Item doesn't contains the path_key={}".format(self.path_key))
+                (size, mtime) = self._file_stat(item, file_path)
+                row = manifest.get(self.scope, file_path)
+                changed = row is None or row[0] != size or row[1] != mtime
+                content_hash = row[2] if row is not None else None
+                if self.hash_content and (changed or content_hash is None):
+                    new_hash = self._file_hash(file_path)
+                    if row is not None and content_hash is not None:
+                        changed = new_hash != content_hash
+                    # else : no stored hash (manifest created without hash_content), compared by size and mtime only
+                    content_hash = new_hash
+                manifest.stage(file_path, size, mtime, content_hash, run_id)
+                seen += 1
+                if seen % self.commit_every == 0:
+                    manifest.commit()
+                if changed or not self.incremental:
+                    yielded += 1
+                    yield item
+
+            manifest.commit()
+            for file_path in manifest.deleted_paths(run_id, self.scope):
+                deleted += 1
+                if self.emit_tombstones:
+                    yield {self.path_key: file_path, self.tombstone_key: True}
+            if not manifest.set_extracted(run_id):
+                raise RuntimeError("The run {} of the manifest {} was discarded by a concurrent run of the scope {}".format(
+                                        run_id, self.manifest_path, self.scope))
+            manifest.commit()
+            super().log_msg("Manifest {} : {} files seen, {} yielded, {} deleted (staged, run {})".format(
+                                self.manifest_path, seen, yielded, deleted, run_id), level=INFO)
+        finally:
+            manifest.close()
+
+    def commit_run(self) -> None:
+        """
+        Promotes the files staged by the last extract() into the manifest, to be called once they are loaded.
+        Raises RuntimeError if the extraction didn't reach the end (the manifest is left unchanged).
+        """
+        manifest = FilesManifest(self.manifest_path)
+        manifest.open()
+        try:
+            if not manifest.is_extracted(self.run_id):
+                raise RuntimeError("The run {} of the manifest {} wasn't fully extracted (or was discarded by a concurrent run of the scope {})".format(
+                                        self.run_id, self.manifest_path, self.scope))
+            (files, deleted) = manifest.promote(self.run_id, self.scope)
+        finally:
+            manifest.close()
+        super().log_msg("Manifest {} : run {} committed, {} files, {} deleted".format(self.manifest_path, self.run_id, files, deleted), level=INFO)
+        self.run_id = str(uuid.uuid1())
+
+    def item_size_in_bytes(self, item: dict) -> int:
+        if item.get(self.tombstone_key) is True:
+            return 0
+        return self.extractor.item_size_in_bytes(item)
+
+    def close(self) -> None:
+        self.extractor.close()
+
+
+class ManifestCommitFinalizer(AbstractFinalizer):
+    def __init__(self, logger: Logger, extractor: IncrementalFilesExtractor) -> None:
+        """
+        Commits the run of the extractor of the pipeline once its loaders are closed
+        """
+        super().__init__(logger)
+        self.extractor = extractor
+
+    def finalize(self, job_uuid: str) -> None:
+        self.extractor.commit_run()
@@ -0,0 +1,290 @@
+from abc import abstractmethod
+from concurrent.futures import ThreadPoolExecutor
+import hashlib
+import json
+from logging import INFO, Logger
+import os
+import shutil
+import tempfile
+import time
+from typing import Any, Callable, List, Tuple
+import zlib
+
+from tiny_etl.commons import WithLogging
+from tiny_etl.spill import merge_sorted_runs, write_sorted_run
+
+COPY_BUFFER_SIZE = 4*1024*1024
+
+
+class AbstractFinalizer(WithLogging):
+    def __init__(self, logger: Logger) -> None:
+        super().__init__(logger)
+
+    @abstractmethod
+    def finalize(self, job_uuid: str) -> None:
+        """
+        Called by the pipeline once all the loaders are closed
+        """
+        pass
+
+
+class OutputFileStats:
+    def __init__(self, file_path: str) -> None:
+        self.file_path = file_path
+        self.rows = 0
+        self.bytes = 0
+        self.sha256 = hashlib.sha256()
+
+    def to_dict(self) -> dict:
+        return {'file': os.path.basename(self.file_path), 'rows': self.rows, 'bytes': self.bytes, 'sha256': self.sha256.hexdigest()}
+
+
+class OutputCompactionFinalizer(AbstractFinalizer):
+    def __init__(self,
+                 logger: Logger,
+                 in_dir: str,
+                 out_dir: str = None,
+                 in_file_name_prefix: str = "out_",
+                 in_file_ext: str = "txt",
+                 out_files_count: int = 4,
+                 out_file_name_prefix: str = "part_",
+                 out_file_ext: str = None,
+                 dedup: bool = False,
+                 sort: bool = False,
+                 sort_key: Callable[[bytes], Any] = None,
+                 max_rows_in_memory: int = 1_000_000,
+                 spill_dir: str = None,
+                 max_workers: int = 4,
+                 remove_inputs: bool = False,
+                 manifest_file_name: str = "manifest.json") -> None:
+        """
+        Merges the line based files written by the loaders (ex: CSV_FileLoader, one file per loader) into out_files_count files
+        and writes a JSON manifest with the rows count, the size and the sha256 of each file.
+
+        in_dir               : directory of the loaders files
+        out_dir              : directory of the merged files and the manifest, default to in_dir
+        in_file_name_prefix  : the merged files are the files <in_file_name_prefix>*.<in_file_ext> of in_dir
+        out_files_count      : merged files count, the files are named <out_file_name_prefix><job_uuid>_<idx>.<out_file_ext>
+        out_file_ext         : default to in_file_ext
+        dedup                : True to remove the duplicated rows (all the files)
+        sort                 : True to sort the rows of each merged file
+        sort_key             : fn(row: bytes) -> key, None to sort by the row bytes
+        max_rows_in_memory   : rows sorted in memory per merged file with dedup/sort, past it sorted runs are spilled in spill_dir
+        max_workers          : merged files written in parallel
+        remove_inputs        : True to delete the loaders files once merged
+
+        Without dedup and sort, the rows are copied in their order and each merged file gets ~ total size/out_files_count bytes
+        (the files are cut at the lines boundaries).
+        With dedup or sort, the rows are partitioned by the hash of the row (the duplicates are in the same merged file),
+        then each merged file is sorted (external merge sort).
+        """
+        super().__init__(logger)
+        self.in_dir = in_dir
+        self.out_dir = out_dir if out_dir is not None else in_dir
+        self.in_file_name_prefix = in_file_name_prefix
+        self.in_file_ext = in_file_ext
+        self.out_files_count = max(1, out_files_count)
+        self.out_file_name_prefix = out_file_name_prefix
+        self.out_file_ext = out_file_ext if out_file_ext is not None else in_file_ext
+        self.dedup = dedup
+        self.sort = sort
+        self.sort_key = sort_key
+        self.max_rows_in_memory = max(1, max_rows_in_memory)
+        self.spill_dir = spill_dir
+        self.max_workers = max(1, max_workers)
+        self.remove_inputs = remove_inputs
+        self.manifest_file_name = manifest_file_name
+
+        if in_file_name_prefix == out_file_name_prefix and self.out_dir == in_dir:
+            raise RuntimeError('The merged files prefix should be different from the loaders files one')
+
+    def _input_files(self) -> List[Tuple[str, int]]:
+        suffix = "." + self.in_file_ext
+        files = []
+        for name in sorted(os.listdir(self.in_dir)):
+            path = os.path.join(self.in_dir, name)
+            if name.startswith(self.in_file_name_prefix) and name.endswith(suffix) and os.path.isfile(path):
+                size = os.path.getsize(path)
+                if size > 0:
+                    files.append((path, size))
+        return files
+
+    def _out_file_path(self, job_uuid: str, idx: int) -> str:
+        return os.path.join(self.out_dir, "{}{}_{}.{}".format(self.out_file_name_prefix, job_uuid, idx, self.out_file_ext))
+
+    def finalize(self, job_uuid: str) -> None:
+        start = time.perf_counter()
+        inputs = self._input_files()
+        input_bytes = sum([size for (_, size) in inputs])
+        super().log_msg("Compacting {} files ({} Mo) into {} files".format(len(inputs), round(input_bytes/1024/1024, 3), self.out_files_count), level=INFO)
+        os.makedirs(self.out_dir, exist_ok=True)
+
+        input_rows = None
+        if self.dedup or self.sort:
+            (input_rows, outputs) = self._merge_partitions(job_uuid, inputs)
+        else:
+            outputs = self._merge_segments(job_uuid, inputs)
+        outputs = [out for out in outputs if out is not None]
+        rows = sum([out.rows for out in outputs])
+
+        manifest = {
+            'job_uuid': job_uuid,
+            'created_at': time.strftime('%Y-%m-%dT%H:%M:%S%z'),
+            'inputs_count': len(inputs),
+            'input_bytes': input_bytes,
+            'rows': rows,
+            'duplicates_removed': input_rows - rows if input_rows is not None and self.dedup else 0,
+            'dedup': self.dedup,
+            'sort': self.sort,
+            'files': [out.to_dict() for out in outputs]
+        }
+        with open(os.path.join(self.out_dir, self.manifest_file_name), 'w', encoding='utf-8') as fh:
+            json.dump(manifest, fh, indent=2)
+
+        if self.remove_inputs:
+            for (path, _) in inputs:
+                os.remove(path)
+        duree = time.perf_counter() - start
+        super().log_msg("{} rows compacted into {} files in {} sec, {} Mo/sec".format(
+                            rows, len(outputs), round(duree, 3), round(input_bytes/1024/1024/duree, 3) if duree > 0 else 0), level=INFO)
+
+    #region : Without dedup and sort
+    def _merge_segments(self, job_uuid: str, inputs: List[Tuple[str, int]]) -> List[OutputFileStats]:
+        segments = split_at_lines(inputs, self.out_files_count)
+        with ThreadPoolExecutor(max_workers=self.max_workers) as executor:
+            return list(executor.map(lambda idx: self._copy_segments(self._out_file_path(job_uuid, idx), segments[idx]) if len(segments[idx]) > 0 else None,
+                                     range(len(segments))))
+
+    def _copy_segments(self, out_path: str, segments: List[Tuple[str, int, int]]) -> OutputFileStats:
+        stats = OutputFileStats(out_path)
+        with open(out_path, 'wb') as out:
+            for (path, begin, end) in segments:
+                with open(path, 'rb') as fh:
+                    fh.seek(begin)
+                    remaining = end - begin
+                    last = b''
+                    while remaining > 0:
+                        data = fh.read(min(COPY_BUFFER_SIZE, remaining))
+                        if not data:
+                            break
+                        remaining -= len(data)
+                        _write_counted(out, stats, data)
+                        last = data[-1:]
+                    if last != b'\n':
+                        _write_counted(out, stats, b'\n')
+        return stats
+    #endregion
+
+    #region : With dedup or sort
+    def _merge_partitions(self, job_uuid: str, inputs: List[Tuple[str, int]]) -> Tuple[int, List[OutputFileStats]]:
+        tmp_dir = tempfile.mkdtemp(prefix='compaction_', dir=self.spill_dir)
+        try:
+            with ThreadPoolExecutor(max_workers=self.max_workers) as executor:
+                input_rows = sum(executor.map(lambda idx: self._partition_file(tmp_dir, idx, inputs[idx][0]), range(len(inputs))))
+                partitions = [[os.path.join(tmp_dir, "{}_{}".format(idx, part)) for idx in range(len(inputs))] for part in range(self.out_files_count)]
+                outputs = list(executor.map(lambda part: self._sort_partition(tmp_dir, self._out_file_path(job_uuid, part), partitions[part]),
+                                            range(self.out_files_count)))
+            return (input_rows, outputs)
+        finally:
+            shutil.rmtree(tmp_dir, ignore_errors=True)
+
+    def _partition_file(self, tmp_dir: str, idx: int, path: str) -> int:
+        n = self.out_files_count
+        buffers = [[] for _ in range(n)]
+        files = [open(os.path.join(tmp_dir, "{}_{}".format(idx, part)), 'wb') for part in range(n)]
+        rows = 0
+        try:
+            with open(path, 'rb', buffering=COPY_BUFFER_SIZE) as fh:
+                for line in fh:
+                    row = line.rstrip(b'\n')
+                    part = zlib.crc32(row) % n
+                    buffers[part].append(row)
+                    rows += 1
+                    if len(buffers[part]) >= 10_000:
+                        files[part].write(b'\n'.join(buffers[part]) + b'\n')
+                        buffers[part] = []
+            for part in range(n):
+                if len(buffers[part]) > 0:
+                    files[part].write(b'\n'.join(buffers[part]) + b'\n')
+        finally:
+            for f in files:
+                f.close()
+        return rows
+
+    def _sort_partition(self, tmp_dir: str, out_path: str, partition_files: List[str]) -> OutputFileStats:
+        sort_key = self.sort_key
+        key_fn = (lambda row: (sort_key(row), row)) if sort_key is not None else None
+        runs = []
+        rows = []
+        for path in partition_files:
+            with open(path, 'rb', buffering=COPY_BUFFER_SIZE) as fh:
+                for line in fh:
+                    rows.append(line.rstrip(b'\n'))
+                    if len(rows) >= self.max_rows_in_memory:
+                        rows.sort(key=key_fn)
+                        runs.append(write_sorted_run(tmp_dir, rows, key_fn=key_fn))
+                        rows = []
+            os.remove(path)
+        rows.sort(key=key_fn)
+        if len(runs) > 0:
+            runs.append(write_sorted_run(tmp_dir, rows, key_fn=key_fn))
+            rows = merge_sorted_runs(runs, key_fn=key_fn)
+        elif len(rows) == 0:
+            return None
+
+        stats = OutputFileStats(out_path)
+        with open(out_path, 'wb', buffering=COPY_BUFFER_SIZE) as out:
+            previous = None
+            block = []
+            for row in rows:
+                if self.dedup and row == previous:
+                    continue
+                previous = row
+                block.append(row)
+                if len(block) >= 10_000:
+                    _write_counted(out, stats, b'\n'.join(block) + b'\n')
+                    block = []
+            if len(block) > 0:
+                _write_counted(out, stats, b'\n'.join(block) + b'\n')
+        for run in runs:
+            run.remove()
+        return stats
+    #endregion
+
+
+def split_at_lines(inputs: List[Tuple[str, int]], parts_count: int) -> List[List[Tuple[str, int, int]]]:
+    """
+    Splits the files (path, size) into parts_count lists of segments (path, begin, end) of ~ the same size,
+    the segments are cut after a new line
+    """
+    total = sum([size for (_, size) in inputs])
+    parts = [[] for _ in range(parts_count)]
+    if total == 0:
+        return parts
+    target = -(-total // parts_count)
+    part = 0
+    part_bytes = 0
+    for (path, size) in inputs:
+        begin = 0
+        with open(path, 'rb') as fh:
+            while begin < size:
+                end = min(size, begin + target - part_bytes)
+                if end < size and part < parts_count - 1:
+                    # moves the cut after the end of the current line
+                    fh.seek(end - 1)
+                    end = min(size, end - 1 + len(fh.readline()))
+                else:
+                    end = size
+                parts[part].append((path, begin, end))
+                part_bytes += end - begin
+                begin = end
+                if part_bytes >= target and part < parts_count - 1:
+                    part += 1
+                    part_bytes = 0
+    return parts
+
+def _write_counted(out, stats: OutputFileStats, data: bytes) -> None:
+    out.write(data)
+    stats.rows += data.count(b'\n')
+    stats.bytes += len(data)
+    stats.sha256.update(data)
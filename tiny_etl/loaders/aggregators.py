@@ -0,0 +1,248 @@
+import heapq
+from logging import INFO, WARN, ERROR, Logger, DEBUG
+from typing import Any, AnyStr, Callable, List, Tuple
+
+from tiny_etl.commons import dict_deep_get, dict_deep_set
+from tiny_etl.commons import dict_deep_remove
+from tiny_etl.loaders.commons import AbstractLoader
+from tiny_etl.spill import SpillingKeyedAggregator
+
+
+class ChunksMergeLoader(AbstractLoader):
+    def __init__(self,
+                    logger: Logger,
+                    wrapped_loader: AbstractLoader,
+                    chunk_key_path: List[AnyStr],
+                    value_key_paths: List[List[AnyStr]],
+                    combiner: Callable[[Any, Any], Any],
+                    remove_chunk_key: bool = True) -> None:
+        """
+        Recombines the per chunk aggregates (ex: ReduceItemTransformer words count of each FileByteRangesExtractor range)
+        into one item per file, then loads it using the wrapped loader.
+
+        wrapped_loader    : AbstractLoader
+        chunk_key_path    : List[in_path] of the range dict {file_path, chunk_idx, chunks_count}
+        value_key_paths   : List[List[in_path]] of the values to combine
+        combiner          : function or method reference (lambda are not allowed)
+                                fn(value_1, value_2) -> combined_value (ex: operator.add)
+        remove_chunk_key  : True to remove the chunk_key_path from the merged item
+
+        Items without the chunk_key_path are loaded as is.
+        """
+        super().__init__(logger, None, None)
+        self.wrapped_loader = wrapped_loader
+        self.chunk_key_path = chunk_key_path
+        self.value_key_paths = value_key_paths
+        self.combiner = combiner
+        self.remove_chunk_key = remove_chunk_key
+        self.pending = {}
+        self.job_uuid = None
+
+        if wrapped_loader is None:
+            raise RuntimeError('Wrapped loader required')
+
+    def _merge(self, item: dict) -> dict:
+        chunk = dict_deep_get(item, self.chunk_key_path)
+        if chunk is None:
+            return item
+        if chunk['chunks_count'] > 1:
+            file_path = chunk['file_path']
+            if file_path not in self.pending:
+                self.pending[file_path] = [0, item]
+            else:
+                merged = self.pending[file_path][1]
+                for value_key_path in self.value_key_paths:
+                    dict_deep_set(merged, value_key_path, self.combiner(dict_deep_get(merged, value_key_path), dict_deep_get(item, value_key_path)))
+            self.pending[file_path][0] += 1
+            if self.pending[file_path][0] < chunk['chunks_count']:
+                return None
+            item = self.pending.pop(file_path)[1]
+        if self.remove_chunk_key:
+            dict_deep_remove(item, self.chunk_key_path)
+        return item
+
+    def load(self, job_uuid: str, items: List[dict], last_call: bool) -> None:
+        self.job_uuid = job_uuid
+        merged_items = []
+        for item in items:
+            merged = self._merge(item)
+            if merged is not None:
+                merged_items.append(merged)
+        if last_call:
+            merged_items = merged_items + self._incomplete_items()
+        if len(merged_items) > 0 or last_call:
+            self.wrapped_loader.load(job_uuid, merged_items, last_call)
+
+    def _incomplete_items(self) -> List[dict]:
+        items = []
+        for (file_path, (received, item)) in self.pending.items():
+            super().log_msg("Incomplete chunks for {} : {} received".format(file_path, received), level=WARN)
+            if self.remove_chunk_key:
+                dict_deep_remove(item, self.chunk_key_path)
+            items.append(item)
+        self.pending.clear()
+        return items
+
+    def close(self) -> None:
+        if len(self.pending) > 0:
+            self.wrapped_loader.load(self.job_uuid, self._incomplete_items(), True)
+        return self.wrapped_loader.close()
+
+    def has_buffered_data(self) -> bool:
+        return len(self.pending) > 0 or self.wrapped_loader.has_buffered_data()
+
+    def kill_threads_processes(self):
+        return self.wrapped_loader.kill_threads_processes()
+
+
+class GroupByMergeLoader(AbstractLoader):
+    def __init__(self,
+                    logger: Logger,
+                    wrapped_loader: AbstractLoader,
+                    key_path: List[AnyStr],
+                    value_key_paths: List[List[AnyStr]],
+                    combiner: Callable[[Any, Any], Any],
+                    batch_size: int = 10_000,
+                    max_keys_in_memory: int = None,
+                    spill_dir: str = None) -> None:
+        """
+        Merges the partial aggregates of the GroupByAggregateTransformer of all the transformation pipelines,
+        the final aggregates are loaded by the wrapped loader when the loader is closed.
+
+        wrapped_loader    : AbstractLoader
+        key_path          : List[in_path] of the group by key (the key_output_key of the GroupByAggregateTransformer)
+        value_key_paths   : List[List[in_path]] of the values to combine
+        combiner          : function or method reference (lambda are not allowed)
+                                fn(value_1, value_2) -> combined_value (ex: operator.add)
+        batch_size        : number of merged items passed to each wrapped_loader.load call
+        max_keys_in_memory: past this number of keys the merged items are spilled to disk as sorted runs, merged at close,
+                                None to keep all the keys in memory
+        spill_dir         : directory of the spilled runs, None for the system temp directory
+
+        Items without the key_path are loaded as is.
+        """
+        super().__init__(logger, None, None)
+        self.wrapped_loader = wrapped_loader
+        self.key_path = key_path
+        self.value_key_paths = value_key_paths
+        self.combiner = combiner
+        self.batch_size = max(1, batch_size)
+        self.merged = SpillingKeyedAggregator(self._combine_items, max_keys_in_memory, spill_dir)
+        self.job_uuid = None
+
+        if wrapped_loader is None:
+            raise RuntimeError('Wrapped loader required')
+
+    def _combine_items(self, merged: dict, item: dict) -> dict:
+        for value_key_path in self.value_key_paths:
+            dict_deep_set(merged, value_key_path, self.combiner(dict_deep_get(merged, value_key_path), dict_deep_get(item, value_key_path)))
+        return merged
+
+    def _merge(self, item: dict) -> bool:
+        key = dict_deep_get(item, self.key_path)
+        if key is None:
+            return False
+        self.merged.add(key, item)
+        return True
+
+    def load(self, job_uuid: str, items: List[dict], last_call: bool) -> None:
+        self.job_uuid = job_uuid
+        passed_items = [item for item in items if not self._merge(item)]
+        if len(passed_items) > 0:
+            self.wrapped_loader.load(job_uuid, passed_items, False)
+
+    def _load_merged(self) -> None:
+        (batch, keys) = ([], 0)
+        for (_, item) in self.merged.items():
+            batch.append(item)
+            keys += 1
+            if len(batch) >= self.batch_size:
+                self.wrapped_loader.load(self.job_uuid, batch, False)
+                batch = []
+        self.wrapped_loader.load(self.job_uuid, batch, True)
+        super().log_msg("GroupBy merge : {} keys, {}".format(keys, str(self.merged.stats)), level=INFO)
+
+    def close(self) -> None:
+        self._load_merged()
+        return self.wrapped_loader.close()
+
+    def has_buffered_data(self) -> bool:
+        return len(self.merged) > 0 or self.wrapped_loader.has_buffered_data()
+
+    def kill_threads_processes(self):
+        return self.wrapped_loader.kill_threads_processes()
+
+
+class TopKMergeLoader(AbstractLoader):
+    def __init__(self,
+                    logger: Logger,
+                    wrapped_loader: AbstractLoader,
+                    k: int,
+                    key_path: List[AnyStr],
+                    count_key_path: List[AnyStr],
+                    group_key_path: List[AnyStr] = None,
+                    rank_key: str = 'rank') -> None:
+        """
+        Sums the counts yielded by the TopKTransformer (global scope) of all the transformation pipelines,
+        then loads the top K items (per group) using the wrapped loader when the loader is closed.
+
+        wrapped_loader    : AbstractLoader
+        k                 : int
+        key_path          : List[in_path] of the key (the key_output_key of the TopKTransformer)
+        count_key_path    : List[in_path] of the count (the count_output_key of the TopKTransformer)
+        group_key_path    : List[in_path] of a group key (ex: the file path), None for a global top K
+        rank_key          : key of the rank (1..k) in the loaded items
+
+        Items without the key_path are loaded as is.
+        """
+        super().__init__(logger, None, None)
+        self.wrapped_loader = wrapped_loader
+        self.k = max(1, k)
+        self.key_path = key_path
+        self.count_key_path = count_key_path
+        self.group_key_path = group_key_path
+        self.rank_key = rank_key
+        self.merged = {}
+        self.job_uuid = None
+
+        if wrapped_loader is None:
+            raise RuntimeError('Wrapped loader required')
+
+    def _merge(self, item: dict) -> bool:
+        key = dict_deep_get(item, self.key_path)
+        if key is None:
+            return False
+        group = dict_deep_get(item, self.group_key_path) if self.group_key_path is not None else None
+        groups = self.merged.setdefault(group, {})
+        merged = groups.get(key)
+        if merged is None:
+            groups[key] = item
+        else:
+            dict_deep_set(merged, self.count_key_path, dict_deep_get(merged, self.count_key_path) + dict_deep_get(item, self.count_key_path))
+        return True
+
+    def _count_of(self, item: dict):
+        return dict_deep_get(item, self.count_key_path)
+
+    def load(self, job_uuid: str, items: List[dict], last_call: bool) -> None:
+        self.job_uuid = job_uuid
+        passed_items = [item for item in items if not self._merge(item)]
+        if len(passed_items) > 0:
+            self.wrapped_loader.load(job_uuid, passed_items, False)
+
+    def close(self) -> None:
+        top_items = []
+        for groups in self.merged.values():
+            for (rank, item) in enumerate(heapq.nlargest(self.k, groups.values(), key=self._count_of)):
+                item[self.rank_key] = rank + 1
+                top_items.append(item)
+        super().log_msg("Top {} : {} groups, {} items loaded".format(self.k, len(self.merged), len(top_items)), level=INFO)
+        self.merged.clear()
+        self.wrapped_loader.load(self.job_uuid, top_items, True)
+        return self.wrapped_loader.close()
+
+    def has_buffered_data(self) -> bool:
+        return len(self.merged) > 0 or self.wrapped_loader.has_buffered_data()
+
+    def kill_threads_processes(self):
+        return self.wrapped_loader.kill_threads_processes()
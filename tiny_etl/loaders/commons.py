@@ -1,20 +1,109 @@
 from abc import abstractmethod
 from logging import INFO, WARN, ERROR, Logger, DEBUG
 from multiprocessing.sharedctypes import Value
-from typing import AnyStr, List, Set, Tuple
+import queue
+import threading
+from typing import Any, AnyStr, Callable, List, Set, Tuple
 import uuid
 
 from tiny_etl.commons import WithLogging
 from tiny_etl.commons import dict_deep_get
+
+
+class WriteBehindFlusher:
+    """
+    Runs the submitted flushes in order in a dedicated thread, at most max_inflight_flushes are waiting,
+    submit blocks when the limit is reached. After an error the next flushes are skipped, the error is raised by join.
+    """
+    def __init__(self, max_inflight_flushes: int = 1) -> None:
+        self.flushes = queue.Queue(maxsize=max(1, max_inflight_flushes))
+        self.error = None
+        self.thread = threading.Thread(target=self._run, daemon=True)
+        self.thread.start()
+
+    def _run(self) -> None:
+        while True:
+            flush = self.flushes.get()
+            try:
+                if flush is None:
+                    return
+                if self.error is None:
+                    (fn, args) = flush
+                    fn(*args)
+            except Exception as ex:
+                self.error = ex
+            finally:
+                self.flushes.task_done()
+
+    def _raise_error(self) -> None:
+        if self.error is not None:
+            error = self.error
+            self.error = None
+            raise RuntimeError('Write-behind flush failed : {}'.format(error)) from error
+
+    def submit(self, fn: Callable, args: tuple) -> None:
+        self.flushes.put((fn, args))
+
+    def pending(self) -> bool:
+        return self.flushes.unfinished_tasks > 0
+
+    def join(self) -> None:
+        self.flushes.join()
+        self._raise_error()
+
+    def stop(self) -> None:
+        self.flushes.put(None)
+        self.thread.join()
+
  
 class AbstractLoader(WithLogging):
     def __init__(self, logger: Logger, 
                 input_key_path: List[AnyStr],
-                values_path: List[Tuple[str, List[AnyStr], bool]]) -> None:
+                values_path: List[Tuple[str, List[AnyStr], bool]],
+                write_behind: bool = False,
+                max_inflight_flushes: int = 1) -> None:
+        """
+        write_behind         : True to run the flushes (ex: file writes, database transactions) in a dedicated thread,
+                               load() hands the filled buffer to the flusher thread and continues with a new buffer
+        max_inflight_flushes : max buffers waiting for the flusher thread, load() blocks when it is reached
+        """
         super().__init__(logger)
         self.input_key_path = input_key_path
         self.values_path = values_path
         self.uuid = str(uuid.uuid1())
+        self.write_behind = write_behind
+        self.max_inflight_flushes = max(1, max_inflight_flushes)
+        self.flusher = None
+
+    def _submit_flush(self, fn: Callable, *args) -> None:
+        """
+        Calls fn(*args) in the flusher thread in write behind mode, synchronously otherwise
+        """
+        if not self.write_behind:
+            fn(*args)
+            return
+        if self.flusher is None:
+            # created in the loader process
+            self.flusher = WriteBehindFlusher(self.max_inflight_flushes)
+        self.flusher.submit(fn, args)
+
+    def _flushes_pending(self) -> bool:
+        return self.flusher is not None and self.flusher.pending()
+
+    def _wait_flushes(self) -> None:
+        """
+        Waits for the submitted flushes, raises the first flush error
+        """
+        if self.flusher is not None:
+            self.flusher.join()
+
+    def _stop_flusher(self) -> None:
+        if self.flusher is not None:
+            try:
+                self._wait_flushes()
+            finally:
+                self.flusher.stop()
+                self.flusher = None
         
     def loadWithAck(self, job_uuid: str, items: List[dict], ack_counter: Value, last_call: bool) -> None:
         try:
@@ -48,9 +137,10 @@ class NoopLoader(AbstractLoader):
         self.log_level = log_level
 
     def load(self, job_uuid: str, items: List[dict], last_call: bool) -> None:
-        if self.log:
+        if self.log and super().log_enabled(self.log_level):
             for item in items:
-                super().log_msg("NoopLoader <Item loaded> : {}".format(str(self._row_from_data(dict_deep_get(item, self.input_key_path) if self.input_key_path is not None else item))), level=self.log_level)
+                super().log_msg_sampled("NoopLoader <Item loaded> : %s", level=self.log_level,
+                                        args=(self._row_from_data(dict_deep_get(item, self.input_key_path) if self.input_key_path is not None else item),))
 
     def _row_from_data(self, item: dict)->list:
         row = []
@@ -85,14 +175,14 @@ class ConditionalLoader(AbstractLoader):
         if self.check_condition():
             return self.wrapped_loader.loadWithAck(job_uuid, items, ack_counter, last_call)
         elif self.else_log:
-            super().log_msg("Item loaded : {}".format(str(items)))
+            super().log_msg_sampled("Item loaded : %s", args=(items,))
         ack_counter.value -= 1
 
     def load(self, job_uuid: str, items: List[dict], last_call: bool) -> None:
         if self.check_condition(items):
             return self.wrapped_loader.load(job_uuid, items, last_call)
         elif self.else_log:
-            super().log_msg("Item loaded : {}".format(str(items)))
+            super().log_msg_sampled("Item loaded : %s", args=(items,))
 
     def close(self) -> None:
         if self.check_condition():
@@ -0,0 +1,272 @@
+from logging import INFO, WARN, ERROR, Logger, DEBUG
+from multiprocessing.sharedctypes import Value
+import threading
+import time
+from typing import Any, AnyStr, Callable, Generator, List, Tuple
+
+from tiny_etl.commons import dict_deep_get
+from tiny_etl.loaders.commons import AbstractLoader
+
+PARAMSTYLE_PLACEHOLDERS = {'qmark': '?', 'format': '%s', 'pyformat': '%s'}
+
+
+class SQLiteConnectionFactory:
+    def __init__(self, database_path: str, wal: bool = True, synchronous: str = 'NORMAL', timeout: float = 30) -> None:
+        """
+        Picklable connection factory (the connection is opened in the loader process) for DBAPI_BulkLoader
+
+        database_path : sqlite3 database file
+        wal           : True to use the WAL journal mode (concurrent readers, faster commits)
+        synchronous   : PRAGMA synchronous value (OFF, NORMAL, FULL)
+        timeout       : seconds to wait for the database lock (many loaders writing in the same database)
+        """
+        self.database_path = database_path
+        self.wal = wal
+        self.synchronous = synchronous
+        self.timeout = timeout
+
+    def __call__(self):
+        import sqlite3
+
+        connection = sqlite3.connect(self.database_path, timeout=self.timeout)
+        if self.wal:
+            connection.execute("PRAGMA journal_mode=WAL")
+        connection.execute("PRAGMA synchronous={}".format(self.synchronous))
+        return connection
+
+
+class DBAPI_BulkLoader(AbstractLoader):
+    def __init__(self,
+                logger: Logger,
+                input_key_path: List[AnyStr],
+                values_path: List[Tuple[str, List[AnyStr], bool]],
+                connection_factory: Callable[[], Any],
+                table: str,
+                columns: List[str] = None,
+                buffer_size: int = 10_000,
+                max_statement_bytes: int = 1024*1024,
+                max_params: int = 999,
+                transaction_rows: int = 100_000,
+                paramstyle: str = 'qmark',
+                insert_verb: str = 'INSERT',
+                write_behind: bool = False,
+                max_inflight_flushes: int = 1) -> None:
+        """
+        Loads the rows in any DB-API 2 database using multi rows statements : INSERT INTO table (cols) VALUES (...),(...),...
+
+        connection_factory  : picklable callable returning a DB-API connection (ex: SQLiteConnectionFactory), called in the loader process
+        table               : str
+        columns             : List[str] of the table columns, default to the values_path titles
+        buffer_size         : rows count buffered before inserting them
+        max_statement_bytes : bytes budget of one statement values (ex: less than the MySQL max_allowed_packet),
+                              each statement is sized on the encoded size of its rows, with a power of 2 rows count
+                              so few different statements are prepared (a row bigger than the budget is inserted alone)
+        max_params          : max parameters count of one statement (SQLITE_MAX_VARIABLE_NUMBER, 999 for old sqlite versions)
+        transaction_rows    : rows count per transaction, None to commit after each buffer insert.
+                              The rows of a rolled back transaction are inserted again by the next flush (retried once in write behind mode),
+                              close() raises a RuntimeError if some rows can't be inserted
+        paramstyle          : 'qmark' (sqlite3) or 'format'/'pyformat' (MySQL, PostgreSQL drivers)
+        insert_verb         : ex: 'INSERT', 'INSERT OR IGNORE', 'REPLACE'
+        write_behind        : True to insert the buffers in a dedicated thread, the connection is opened and used by this thread only.
+                              A failed insert is raised by close()
+        max_inflight_flushes: max buffers waiting to be inserted in write behind mode
+        """
+        super().__init__(logger, input_key_path, values_path, write_behind, max_inflight_flushes)
+        self.connection_factory = connection_factory
+        self.table = table
+        self.columns = columns if columns is not None else [title for (title, key_path, required) in values_path]
+        self.buffer_size = max(1, buffer_size)
+        self.max_statement_bytes = max(1, max_statement_bytes)
+        self.max_params = max(len(self.columns), max_params)
+        self.transaction_rows = transaction_rows
+        self.paramstyle = paramstyle
+        self.insert_verb = insert_verb
+        self.connection = None
+        self.buffer = []
+        self.statements = {}
+        self.rows_per_statement_hint = None
+        self.uncommitted = []
+        self.inserted_rows = 0
+        self.failed_rows = 0
+        self.statements_count = 0
+        self.insert_sec = 0.0
+        self.calling_thread = Value('q', -1)
+
+        if connection_factory is None:
+            raise RuntimeError('Connection factory required')
+        if paramstyle not in PARAMSTYLE_PLACEHOLDERS:
+            raise RuntimeError('Unsupported paramstyle {}, available : {}'.format(paramstyle, ', '.join(PARAMSTYLE_PLACEHOLDERS.keys())))
+
+    def _row_from_data(self, item: dict)->list:
+        row = []
+        for (title, key_path, required) in self.values_path:
+            val = dict_deep_get(item, key_path)
+            if required is not None and required is True and val is None:
+                return None
+            row.append(val)
+        return row
+
+    def _connect(self):
+        if self.connection is None:
+            self.connection = self.connection_factory()
+            super().log_msg("Connection opened <{}>".format(self.connection.__class__.__name__), level=INFO)
+        return self.connection
+
+    def _statement(self, rows_count: int) -> str:
+        """
+        The statements are cached by rows count, so the drivers statement caches reuse the prepared statements
+        """
+        sql = self.statements.get(rows_count)
+        if sql is None:
+            placeholder = PARAMSTYLE_PLACEHOLDERS[self.paramstyle]
+            values = "({})".format(",".join([placeholder] * len(self.columns)))
+            sql = "{} INTO {} ({}) VALUES {}".format(self.insert_verb, self.table, ",".join(self.columns), ",".join([values] * rows_count))
+            self.statements[rows_count] = sql
+        return sql
+
+    @staticmethod
+    def _params_bytes(params: list) -> int:
+        """
+        Encoded size of the values as literals (quotes and separators included)
+        """
+        return len(repr(params).encode('utf-8'))
+
+    def _chunks(self, rows: List[list]) -> Generator[Tuple[int, int, list], None, None]:
+        """
+        Yields (offset, rows count, params) of the statements : a power of 2 rows count within max_params,
+        halved until the encoded params fit in max_statement_bytes (checked for every statement)
+        """
+        max_rows = 1 << (max(1, self.max_params // len(self.columns)).bit_length() - 1)
+        offset = 0
+        while offset < len(rows):
+            start = self.rows_per_statement_hint or max_rows
+            count = min(start, 1 << ((len(rows) - offset).bit_length() - 1))
+            halved = False
+            while True:
+                params = [val for row in rows[offset:offset+count] for val in row]
+                size = DBAPI_BulkLoader._params_bytes(params)
+                if count == 1 or size <= self.max_statement_bytes:
+                    break
+                count //= 2
+                halved = True
+            # the next statements start from the last count fitting in the budget, doubled when half of it is used
+            if halved:
+                self.rows_per_statement_hint = count
+            elif count == start and size * 2 <= self.max_statement_bytes:
+                self.rows_per_statement_hint = min(max_rows, count * 2)
+            yield (offset, count, params)
+            offset += count
+
+    def load(self, job_uuid: str, items: List[dict], last_call: bool) -> None:
+        id = threading.get_ident()
+        if self.calling_thread.value==-1:
+            self.calling_thread.value=id
+        elif id != self.calling_thread.value:
+            raise RuntimeError('Calling the same loader from diffrent threads')
+
+        buffer = self.buffer
+        for item in items:
+            x = dict_deep_get(item, self.input_key_path) if self.input_key_path is not None else item
+            if x is not None:
+                d = self._row_from_data(x)
+                if d is not None:
+                    buffer.append(d)
+
+        if last_call or len(self.buffer) > self.buffer_size:
+            self.write_buffered_data_to_disk()
+
+    def _commit(self) -> None:
+        if len(self.uncommitted) > 0:
+            self.connection.commit()
+            self.inserted_rows += len(self.uncommitted)
+            self.uncommitted = []
+
+    def write_buffered_data_to_disk(self, commit: bool = False) -> None:
+        """
+        commit : True to commit the current transaction (end of stream)
+        """
+        rows = self.buffer
+        self.buffer = []
+        if self.write_behind:
+            self._submit_flush(self._insert_or_raise, rows, commit)
+        elif len(rows) > 0 or len(self.uncommitted) > 0:
+            retry_rows = self._insert_rows(rows, commit)
+            if len(retry_rows) > 0:
+                # inserted again by the next flush
+                self.buffer = retry_rows + self.buffer
+
+    def _insert_or_raise(self, rows: List[list], commit: bool) -> None:
+        retry_rows = self._insert_rows(rows, commit)
+        if len(retry_rows) > 0:
+            retry_rows = self._insert_rows(retry_rows, commit)
+        if len(retry_rows) > 0:
+            self.failed_rows += len(retry_rows)
+            raise RuntimeError('Failed to insert {} rows'.format(len(retry_rows)))
+
+    def _insert_rows(self, rows: List[list], commit: bool = False) -> List[list]:
+        """
+        Inserts the rows in the current transaction.
+        Returns the rows to insert again if the transaction failed : the rolled back rows (including the rows of the previous flushes
+        not committed yet) and the rows not inserted, an empty list otherwise
+        """
+        start = time.perf_counter()
+        connection = self._connect()
+        cursor = connection.cursor()
+        inserted_end = 0
+        try:
+            for (offset, count, params) in self._chunks(rows):
+                cursor.execute(self._statement(count), params)
+                self.statements_count += 1
+                self.uncommitted.extend(rows[offset:offset+count])
+                inserted_end = offset + count
+                if self.transaction_rows is not None and len(self.uncommitted) >= self.transaction_rows:
+                    self._commit()
+            if commit or self.transaction_rows is None:
+                self._commit()
+            super().log_msg("%d rows inserted", args=(len(rows),))
+            return []
+        except Exception as error:
+            retry_rows = self.uncommitted + rows[inserted_end:]
+            self.uncommitted = []
+            super().log_msg("Failed to insert records, {} rows rolled back. Error={}".format(len(retry_rows), error), exception=error, level=ERROR)
+            try:
+                connection.rollback()
+            except Exception as ex:
+                super().log_msg("Failed to rollback inserted records {}".format(ex.args), exception=ex, level=ERROR)
+            return retry_rows
+        finally:
+            cursor.close()
+            self.insert_sec += time.perf_counter() - start
+
+    def _close_connection(self) -> None:
+        if self.connection is not None:
+            self.connection.close()
+            self.connection = None
+
+    def close(self) -> None:
+        try:
+            super().log_msg('Flushing buffered data in <{}>'.format(str(self.__class__.__name__)), level=INFO)
+            self.write_buffered_data_to_disk(commit=True)
+            if len(self.buffer) > 0:
+                # the last transaction failed, retried once
+                self.write_buffered_data_to_disk(commit=True)
+            if len(self.buffer) > 0:
+                self.failed_rows += len(self.buffer)
+                failed = len(self.buffer)
+                self.buffer = []
+                raise RuntimeError('Failed to insert {} rows'.format(failed))
+            super().log_msg('Flushed buffered data in <{}>'.format(str(self.__class__.__name__)), level=INFO)
+            self._wait_flushes()
+        finally:
+            try:
+                # closed by the thread using it (sqlite3 connections are bound to their thread)
+                self._submit_flush(self._close_connection)
+                self._stop_flusher()
+                super().log_msg("{} rows inserted ({} failed) using {} statements in {} sec, {} rows/sec".format(
+                                    self.inserted_rows, self.failed_rows, self.statements_count, round(self.insert_sec, 3),
+                                    round(self.inserted_rows/self.insert_sec) if self.insert_sec > 0 else 0), level=INFO)
+            except Exception as ex:
+                super().log_msg("Error closing the connection", exception=ex , level=ERROR)
+
+    def has_buffered_data(self) -> bool:
+        return len(self.buffer)>0 or self._flushes_pending()
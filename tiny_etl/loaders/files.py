@@ -1,12 +1,19 @@
 import io
 from logging import INFO, WARN, ERROR, Logger, DEBUG
 from multiprocessing.sharedctypes import Value
+import operator
+import os
+import shutil
+import tempfile
 import threading
-from typing import AnyStr, List, Set, Tuple
+import time
+from typing import Any, AnyStr, List, Set, Tuple
 import uuid
 
 from tiny_etl.commons import dict_deep_get
 from tiny_etl.loaders.commons import AbstractLoader
+from tiny_etl.loaders.formats import COMPRESSION_EXTENSIONS, AbstractOutputFormat, BlockFileWriter, make_compressor
+from tiny_etl.spill import SpillStats, merge_sorted_runs, write_sorted_run
 
 class CSV_FileLoader(AbstractLoader):
     def __init__(self, 
@@ -17,18 +24,48 @@ class CSV_FileLoader(AbstractLoader):
                 col_sep: str=";",
                 out_file_ext="txt",
                 out_file_name_prefix="out_",
-                buffer_size: int = 1000
+                buffer_size: int = 1000,
+                write_buffer_size: int = 4*1024*1024,
+                rotate_max_bytes: int = None,
+                rotate_max_rows: int = None,
+                fsync_every_flushes: int = None,
+                write_behind: bool = False,
+                max_inflight_flushes: int = 1
                 ):
-        super().__init__(logger, input_key_path, values_path)
+        """
+        buffer_size          : rows count buffered before writing them to the file
+        write_buffer_size    : size in bytes of the file writer buffer
+        rotate_max_bytes     : a new file is opened when the current one reaches this size (checked after each write),
+                               None for no size limit
+        rotate_max_rows      : max rows count per file, None for no limit
+        fsync_every_flushes  : the file is fsynced every fsync_every_flushes buffer writes and at close, None to let the OS decide
+        write_behind         : True to write the buffers in a dedicated thread (see AbstractLoader)
+        max_inflight_flushes : max buffers waiting to be written in write behind mode
+
+        With rotation, the files are named <out_file_name_prefix>_<uuid>_<part>.<out_file_ext>
+        """
+        super().__init__(logger, input_key_path, values_path, write_behind, max_inflight_flushes)
         self.out_dir=out_dir
         self.file_hd = None
         self.col_sep = col_sep
         self.out_file_ext = out_file_ext
         self.out_file_name_prefix = out_file_name_prefix
-        self.calling_thread = Value('i', -1)
+        self.calling_thread = Value('q', -1)
         self.buffer_size=buffer_size
         self.buffer = []
         self.uuid = str(uuid.uuid1())
+        self.write_buffer_size = max(io.DEFAULT_BUFFER_SIZE, write_buffer_size)
+        self.rotate_max_bytes = rotate_max_bytes
+        self.rotate_max_rows = rotate_max_rows
+        self.fsync_every_flushes = fsync_every_flushes
+        self.file_part = 0
+        self.file_bytes = 0
+        self.file_rows = 0
+        self.files_count = 0
+        self.flushes_count = 0
+        self.bytes_written = 0
+        self.rows_written = 0
+        self.write_sec = 0.0
 
     def _row_from_item(self, item: dict) -> List[AnyStr]:
         row = []
@@ -36,7 +73,7 @@ class CSV_FileLoader(AbstractLoader):
             val = dict_deep_get(item, key_path)
             if required is not None and required is True and val is None:
                 return None
-            row.append(str(val))
+            row.append(val if type(val) is str else str(val))
         return row
 
     def load(self, job_uuid: str, items: List[dict], last_call: bool):
@@ -47,41 +84,85 @@ class CSV_FileLoader(AbstractLoader):
         elif id != self.calling_thread.value:
             raise RuntimeError('Calling the same loader from diffrent threads')
         
-        rows = []
+        buffer = self.buffer
+        col_sep = self.col_sep
         for item in items:
             x = dict_deep_get(item, self.input_key_path) if self.input_key_path is not None else item
             if x is not None:
                 row = self._row_from_item(x)
                 if row is not None:
-                    rows.append(self.col_sep.join(row))
-
-        if len(rows) >0: 
-            self.buffer = self.buffer + rows
+                    buffer.append(col_sep.join(row))
 
         if last_call or len(self.buffer) > self.buffer_size:
             self.write_buffered_data_to_disk()
 
     def _out_filename(self, job_uuid: str) -> str:
+        if self.rotate_max_bytes is not None or self.rotate_max_rows is not None:
+            return "{}_{}_{}.{}".format(self.out_file_name_prefix, job_uuid, self.file_part, self.out_file_ext)
         return "{}_{}.{}".format(self.out_file_name_prefix, job_uuid, self.out_file_ext)
 
     def _open_file(self):
-        import codecs
-        import os
-
         if self.file_hd is None:
             file_name = self._out_filename(self.uuid)
             file_path = os.path.join(self.out_dir, file_name)
-            self.file_hd = codecs.open(file_path, 'a', encoding = "utf-8")
-            super().log_msg("File {} opened using the buffering {}bytes".format(file_path, io.DEFAULT_BUFFER_SIZE))
+            self.file_hd = open(file_path, 'ab', buffering=self.write_buffer_size)
+            self.file_bytes = 0
+            self.file_rows = 0
+            self.files_count += 1
+            super().log_msg("File {} opened using the buffering {}bytes".format(file_path, self.write_buffer_size))
         return self.file_hd
 
+    def _close_file(self) -> None:
+        if self.file_hd is not None:
+            self.file_hd.flush()
+            if self.fsync_every_flushes is not None:
+                os.fsync(self.file_hd.fileno())
+            self.file_hd.close()
+            self.file_hd = None
+
+    def _rotate_file(self) -> None:
+        self._close_file()
+        self.file_part += 1
+
+    def _write_rows(self, rows: List[AnyStr]) -> None:
+        start = time.perf_counter()
+        offset = 0
+        while offset < len(rows):
+            fhd = self._open_file()
+            end = len(rows)
+            if self.rotate_max_rows is not None:
+                end = min(end, offset + self.rotate_max_rows - self.file_rows)
+            data = self._encode_rows(rows[offset:end])
+            fhd.write(data)
+            self.file_bytes += len(data)
+            self.file_rows += end - offset
+            self.bytes_written += len(data)
+            self.rows_written += end - offset
+            offset = end
+            if (self.rotate_max_rows is not None and self.file_rows >= self.rotate_max_rows) or \
+                    (self.rotate_max_bytes is not None and self.file_bytes >= self.rotate_max_bytes):
+                self._rotate_file()
+        self.flushes_count += 1
+        if self.fsync_every_flushes is not None and self.file_hd is not None and self.flushes_count % self.fsync_every_flushes == 0:
+            self.file_hd.flush()
+            os.fsync(self.file_hd.fileno())
+        self.write_sec += time.perf_counter() - start
+
+    def _encode_rows(self, rows: List[AnyStr]) -> bytes:
+        return ("\n".join(rows) + "\n").encode('utf-8')
+
     def write_buffered_data_to_disk(self):
         rows_nbr = len(self.buffer)  
         if rows_nbr>0:
-            fhd = self._open_file()
-            fhd.write("\n".join(self.buffer) + "\n")
-            super().log_msg("{} total rows written in the file".format(rows_nbr))
-            self.buffer.clear()
+            rows = self.buffer
+            self.buffer = []
+            self._submit_flush(self._write_rows, rows)
+            super().log_msg("%d total rows written in the file", args=(rows_nbr,))
+
+    def _log_write_stats(self) -> None:
+        mo = self.bytes_written/1024/1024
+        super().log_msg("{} rows, {} Mo written in {} files, {} Mo/sec".format(self.rows_written, round(mo, 3), self.files_count,
+                                                                               round(mo/self.write_sec, 3) if self.write_sec > 0 else 0), level=INFO)
 
     def close(self) -> None:
         super().log_msg("Closing loader <>".format(__class__.__name__), level=INFO)
@@ -89,13 +170,229 @@ class CSV_FileLoader(AbstractLoader):
             if len(self.buffer) > 0:
                 super().log_msg('Flushing buffered data in <{}>'.format(str(self.__class__.__name__)), level=INFO)
                 self.write_buffered_data_to_disk()
-                self.buffer.clear()
                 super().log_msg('Flushed buffered data in <{}>'.format(str(self.__class__.__name__)), level=INFO)
-            self.file_hd.flush()
-            self.file_hd.close()
-            super().log_msg("File closed successfully")
+            self._stop_flusher()
+        finally:
+            try:
+                self._close_file()
+                self._log_write_stats()
+                super().log_msg("File closed successfully")
+            except Exception as ex:
+                super().log_msg("Error closing File handler", exception=ex , level=ERROR)
+
+    def has_buffered_data(self) -> bool:
+        return len(self.buffer)>0 or self._flushes_pending()
+
+
+class SortedCSV_FileLoader(CSV_FileLoader):
+    def __init__(self,
+                logger: Logger,
+                input_key_path: List[AnyStr],
+                values_path: List[Tuple[str, List[AnyStr], bool]],
+                out_dir: str,
+                sort_key_paths: List[List[AnyStr]],
+                col_sep: str=";",
+                out_file_ext="txt",
+                out_file_name_prefix="out_",
+                max_rows_in_memory: int = 1_000_000,
+                spill_dir: str = None,
+                reverse: bool = False
+                ):
+        """
+        CSV_FileLoader writing one file sorted by the sort_key_paths values (external merge sort) :
+        the rows are buffered up to max_rows_in_memory, then written to a temp file as a sorted run,
+        the runs are merged (k-way streaming merge) into the output file at close.
+
+        sort_key_paths     : List[List[in_path]] of the sort values, in the item after applying input_key_path
+        max_rows_in_memory : memory bound, independent of the output size
+        spill_dir          : directory of the runs temp files, None for the system temp directory
+        reverse            : True for a descending order
+
+        The rows missing a sort value are skipped (counted in skipped_rows), like the rows missing a required value.
+        close() raises the merge and write errors, the runs temp files are removed anyway.
+        """
+        super().__init__(logger, input_key_path, values_path, out_dir, col_sep, out_file_ext, out_file_name_prefix, max_rows_in_memory)
+        self.sort_key_paths = sort_key_paths
+        self.max_rows_in_memory = max(1, max_rows_in_memory)
+        self.spill_dir = spill_dir
+        self.reverse = reverse
+        self.runs = []
+        self.tmp_dir = None
+        self.stats = SpillStats()
+        self.skipped_rows = 0
+
+        if sort_key_paths is None or len(sort_key_paths) == 0:
+            raise RuntimeError('At least one sort key path is required')
+
+    def load(self, job_uuid: str, items: List[dict], last_call: bool):
+        id = threading.get_ident()
+        if self.calling_thread.value==-1:
+            self.calling_thread.value=id
+        elif id != self.calling_thread.value:
+            raise RuntimeError('Calling the same loader from diffrent threads')
+
+        for item in items:
+            x = dict_deep_get(item, self.input_key_path) if self.input_key_path is not None else item
+            if x is not None:
+                row = self._row_from_item(x)
+                if row is not None:
+                    sort_key = tuple([dict_deep_get(x, sort_key_path) for sort_key_path in self.sort_key_paths])
+                    if None in sort_key:
+                        self.skipped_rows += 1
+                        super().log_msg_sampled("Row skipped, missing sort key paths %s", level=WARN, args=(self.sort_key_paths,))
+                        continue
+                    self.buffer.append((sort_key, self.col_sep.join(row)))
+
+        if len(self.buffer) >= self.max_rows_in_memory:
+            self._spill()
+
+    def _spill(self) -> None:
+        if len(self.buffer) == 0:
+            return
+        if self.tmp_dir is None:
+            self.tmp_dir = tempfile.mkdtemp(prefix='sort_', dir=self.spill_dir)
+        self.buffer.sort(key=operator.itemgetter(0), reverse=self.reverse)
+        run = write_sorted_run(self.tmp_dir, self.buffer, key_fn=operator.itemgetter(0))
+        self.stats.add_run(run)
+        self.runs.append(run)
+        self.buffer.clear()
+
+    def _sorted_rows(self):
+        if len(self.runs) == 0:
+            self.buffer.sort(key=operator.itemgetter(0), reverse=self.reverse)
+            return iter(self.buffer)
+        self._spill()
+        return merge_sorted_runs(self.runs, key_fn=operator.itemgetter(0), reverse=self.reverse)
+
+    def close(self) -> None:
+        super().log_msg("Closing loader <{}>".format(__class__.__name__), level=INFO)
+        try:
+            start = time.perf_counter()
+            rows = []
+            for (_, row) in self._sorted_rows():
+                rows.append(row)
+                if len(rows) >= 10_000:
+                    self._write_rows(rows)
+                    rows.clear()
+            if len(rows) > 0:
+                self._write_rows(rows)
+            self.buffer.clear()
+            self.stats.merge_sec += time.perf_counter() - start
+            self._close_file()
+            super().log_msg("Sorted file written : {}, {} rows skipped (missing sort key)".format(str(self.stats), self.skipped_rows), level=INFO)
+            self._log_write_stats()
         except Exception as ex:
-            super().log_msg("Error closing File handler", exception=ex , level=ERROR)
+            super().log_msg("Error writing the sorted file", exception=ex , level=ERROR)
+            raise ex
+        finally:
+            try:
+                # the partial output file after a failure
+                self._close_file()
+            except Exception as ex:
+                super().log_msg("Error closing File handler", exception=ex , level=ERROR)
+            for run in self.runs:
+                run.remove()
+            self.runs = []
+            if self.tmp_dir is not None:
+                shutil.rmtree(self.tmp_dir, ignore_errors=True)
+                self.tmp_dir = None
 
     def has_buffered_data(self) -> bool:
-        return len(self.buffer)>0
\ No newline at end of file
+        return len(self.buffer)>0 or len(self.runs)>0
+
+
+class FormattedFileLoader(CSV_FileLoader):
+    def __init__(self,
+                logger: Logger,
+                input_key_path: List[AnyStr],
+                values_path: List[Tuple[str, List[AnyStr], bool]],
+                out_dir: str,
+                output_format: AbstractOutputFormat,
+                compression: str = None,
+                compression_level: int = None,
+                background_writer: bool = True,
+                out_file_name_prefix="out_",
+                buffer_size: int = 10_000,
+                write_buffer_size: int = 4*1024*1024,
+                rotate_max_bytes: int = None,
+                rotate_max_rows: int = None,
+                fsync_every_flushes: int = None
+                ):
+        """
+        CSV_FileLoader writing the rows using an output format (tiny_etl.loaders.formats) :
+        DelimitedFormat, JsonLinesFormat or LengthPrefixedBinaryFormat.
+
+        output_format     : AbstractOutputFormat
+        compression       : None, 'gzip' or 'lzma', the file extension gets the .gz or .xz suffix
+        compression_level : gzip level or lzma preset, None for the default one
+        background_writer : True to compress and write the blocks in a separate thread (double buffering)
+        rotate_max_bytes  : checked on the uncompressed size
+        """
+        super().__init__(logger, input_key_path, values_path, out_dir,
+                         out_file_ext=output_format.file_ext + ('.' + COMPRESSION_EXTENSIONS[compression] if compression is not None else ''),
+                         out_file_name_prefix=out_file_name_prefix,
+                         buffer_size=buffer_size,
+                         write_buffer_size=write_buffer_size,
+                         rotate_max_bytes=rotate_max_bytes,
+                         rotate_max_rows=rotate_max_rows,
+                         fsync_every_flushes=fsync_every_flushes)
+        self.output_format = output_format
+        self.compression = compression
+        self.compression_level = compression_level
+        self.background_writer = background_writer
+        self.titles = [title for (title, key_path, required) in values_path]
+
+        if output_format is None:
+            raise RuntimeError('Output format required')
+        make_compressor(compression, compression_level)
+
+    def _row_from_item(self, item: dict) -> List[Any]:
+        row = []
+        for (title, key_path, required) in self.values_path:
+            val = dict_deep_get(item, key_path)
+            if required is not None and required is True and val is None:
+                return None
+            row.append(val)
+        return row
+
+    def load(self, job_uuid: str, items: List[dict], last_call: bool):
+        id = threading.get_ident()
+        if self.calling_thread.value==-1:
+            self.calling_thread.value=id
+        elif id != self.calling_thread.value:
+            raise RuntimeError('Calling the same loader from diffrent threads')
+
+        buffer = self.buffer
+        for item in items:
+            x = dict_deep_get(item, self.input_key_path) if self.input_key_path is not None else item
+            if x is not None:
+                row = self._row_from_item(x)
+                if row is not None:
+                    buffer.append(row)
+
+        if last_call or len(self.buffer) > self.buffer_size:
+            self.write_buffered_data_to_disk()
+
+    def _encode_rows(self, rows: List[List[Any]]) -> bytes:
+        return self.output_format.encode_rows(self.titles, rows)
+
+    def _open_file(self):
+        if self.file_hd is None:
+            file_path = os.path.join(self.out_dir, self._out_filename(self.uuid))
+            self.file_hd = BlockFileWriter(file_path, self.compression, self.compression_level,
+                                           background=self.background_writer, buffering=self.write_buffer_size)
+            self.file_bytes = 0
+            self.file_rows = 0
+            self.files_count += 1
+            super().log_msg("File {} opened ({}, compression: {})".format(file_path, self.output_format.__class__.__name__, self.compression))
+        return self.file_hd
+
+    def _close_file(self) -> None:
+        if self.file_hd is not None:
+            # the compressed stream trailer is written before the fsync
+            self.file_hd.finish()
+        super()._close_file()
+
+    def kill_threads_processes(self):
+        if self.file_hd is not None and self.file_hd.thread is not None:
+            self.file_hd.blocks.put(None)
@@ -0,0 +1,184 @@
+from abc import ABC, abstractmethod
+import json
+import lzma
+import queue
+import struct
+import threading
+from typing import Any, AnyStr, Generator, List
+import zlib
+
+COMPRESSION_EXTENSIONS = {'gzip': 'gz', 'lzma': 'xz'}
+NULL_FIELD_LENGTH = 0xFFFFFFFF
+
+
+class AbstractOutputFormat(ABC):
+    def __init__(self, file_ext: str) -> None:
+        self.file_ext = file_ext
+
+    @abstractmethod
+    def encode_rows(self, titles: List[str], rows: List[List[Any]]) -> bytes:
+        pass
+
+
+class DelimitedFormat(AbstractOutputFormat):
+    def __init__(self, col_sep: str = ";", file_ext: str = "txt") -> None:
+        """
+        One line per row, the values are separated by col_sep (None values are written as empty strings)
+        """
+        super().__init__(file_ext)
+        self.col_sep = col_sep
+
+    def encode_rows(self, titles: List[str], rows: List[List[Any]]) -> bytes:
+        col_sep = self.col_sep
+        lines = [col_sep.join(['' if val is None else (val if type(val) is str else str(val)) for val in row]) for row in rows]
+        return ("\n".join(lines) + "\n").encode('utf-8')
+
+
+class JsonLinesFormat(AbstractOutputFormat):
+    def __init__(self, file_ext: str = "jsonl") -> None:
+        """
+        One JSON object per line, the keys are the values titles
+        """
+        super().__init__(file_ext)
+        self.encoder = json.JSONEncoder(ensure_ascii=False, separators=(',', ':'), default=str)
+
+    def encode_rows(self, titles: List[str], rows: List[List[Any]]) -> bytes:
+        encode = self.encoder.encode
+        lines = [encode(dict(zip(titles, row))) for row in rows]
+        return ("\n".join(lines) + "\n").encode('utf-8')
+
+
+class LengthPrefixedBinaryFormat(AbstractOutputFormat):
+    def __init__(self, file_ext: str = "bin") -> None:
+        """
+        Compact binary rows : <fields count: uint16> then for each field <length: uint32><utf-8 bytes>,
+        the length 0xFFFFFFFF is a None value. All the integers are little endian.
+        The rows can be read using read_length_prefixed_rows.
+        """
+        super().__init__(file_ext)
+
+    def encode_rows(self, titles: List[str], rows: List[List[Any]]) -> bytes:
+        out = bytearray()
+        pack_count = struct.Struct('<H').pack
+        pack_length = struct.Struct('<I').pack
+        for row in rows:
+            out += pack_count(len(row))
+            for val in row:
+                if val is None:
+                    out += pack_length(NULL_FIELD_LENGTH)
+                else:
+                    data = (val if type(val) is str else str(val)).encode('utf-8')
+                    out += pack_length(len(data))
+                    out += data
+        return bytes(out)
+
+def read_length_prefixed_rows(fh) -> Generator[List[AnyStr], None, None]:
+    """
+    Yields the rows written by LengthPrefixedBinaryFormat from the binary file handler fh
+    """
+    while True:
+        head = fh.read(2)
+        if len(head) < 2:
+            return
+        row = []
+        for _ in range(struct.unpack('<H', head)[0]):
+            length = struct.unpack('<I', fh.read(4))[0]
+            row.append(None if length == NULL_FIELD_LENGTH else fh.read(length).decode('utf-8'))
+        yield row
+
+
+def make_compressor(compression: str, compression_level: int = None):
+    """
+    compression : None, 'gzip' or 'lzma' (xz container)
+    """
+    if compression is None:
+        return None
+    if compression == 'gzip':
+        return zlib.compressobj(compression_level if compression_level is not None else 6, zlib.DEFLATED, 31)
+    if compression == 'lzma':
+        return lzma.LZMACompressor(format=lzma.FORMAT_XZ, preset=compression_level if compression_level is not None else 6)
+    raise RuntimeError('Unknown compression {}, available : {}'.format(compression, ', '.join(COMPRESSION_EXTENSIONS.keys())))
+
+
+class BlockFileWriter:
+    """
+    Appends encoded blocks to a file, optionally compressed (gzip or lzma streams).
+    With background=True, the compression and the write run in a separate thread with double buffering :
+    one block is compressed and written while the caller encodes the next one (the compression modules release the GIL).
+    The errors of the background thread are raised by the next write, flush or close call.
+    """
+    def __init__(self, file_path: str, compression: str = None, compression_level: int = None,
+                 background: bool = True, buffering: int = 4*1024*1024) -> None:
+        self.file_path = file_path
+        self.compressor = make_compressor(compression, compression_level)
+        self.fh = open(file_path, 'ab', buffering=buffering)
+        self.error = None
+        self.thread = None
+        self.finished = False
+        if background:
+            self.blocks = queue.Queue(maxsize=1)
+            self.thread = threading.Thread(target=self._run, daemon=True)
+            self.thread.start()
+
+    def _write_block(self, data: bytes) -> None:
+        if self.compressor is not None:
+            data = self.compressor.compress(data)
+        if data:
+            self.fh.write(data)
+
+    def _run(self) -> None:
+        while True:
+            block = self.blocks.get()
+            try:
+                if block is None:
+                    return
+                if self.error is None:
+                    self._write_block(block)
+            except Exception as ex:
+                self.error = ex
+            finally:
+                self.blocks.task_done()
+
+    def _raise_error(self) -> None:
+        if self.error is not None:
+            error = self.error
+            self.error = None
+            raise error
+
+    def write(self, data: bytes) -> None:
+        self._raise_error()
+        if self.finished:
+            raise RuntimeError('File {} already finished'.format(self.file_path))
+        if self.thread is not None:
+            self.blocks.put(data)
+        else:
+            self._write_block(data)
+
+    def flush(self) -> None:
+        if self.thread is not None:
+            self.blocks.join()
+        self._raise_error()
+        self.fh.flush()
+
+    def fileno(self) -> int:
+        return self.fh.fileno()
+
+    def finish(self) -> None:
+        """
+        Writes the last compressed block and the stream trailer, then flushes the file : it can be fsynced, no more write is allowed
+        """
+        if self.thread is not None:
+            self.blocks.put(None)
+            self.thread.join()
+            self.thread = None
+        self._raise_error()
+        if self.compressor is not None and not self.finished:
+            self.fh.write(self.compressor.flush())
+        self.finished = True
+        self.fh.flush()
+
+    def close(self) -> None:
+        try:
+            self.finish()
+        finally:
+            self.fh.close()
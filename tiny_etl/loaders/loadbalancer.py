@@ -2,6 +2,7 @@ from logging import INFO, WARN, ERROR, Logger, DEBUG
 import multiprocessing
 from multiprocessing.sharedctypes import Value
 import queue
+import time
 from typing import AnyStr, List, Set, Tuple
 
 from tiny_etl.commons import WithLogging
@@ -12,6 +13,8 @@ from tiny_etl.commons import make_thread_process
 from tiny_etl.commons import set_process_affinity
 from tiny_etl.loaders.commons import AbstractLoader
 
+BALANCE_POLICIES = ('round_robin', 'weighted_round_robin', 'least_outstanding', 'latency_aware')
+
 
 class LoadBalanceLoader(AbstractLoader):
     def __init__(self, 
@@ -21,8 +24,27 @@ class LoadBalanceLoader(AbstractLoader):
                     buffer_size: int = 1000,
                     queue_no_block_timeout_sec: int = 0.09,
                     queue_block_timeout_sec: int = 0.1,
-                    use_threads_as_loaders_executors: bool = True) -> None:
-        super().__init__(logger, None, None)
+                    use_threads_as_loaders_executors: bool = True,
+                    write_behind: bool = False,
+                    max_inflight_flushes: int = 1,
+                    policy: str = 'round_robin',
+                    latency_ewma_alpha: float = 0.2) -> None:
+        """
+        loaders              : List[(weight, loader)], the weight is also the loader queue size (min 100)
+        write_behind         : True to push the buffers to the loaders queues in a dedicated thread
+        max_inflight_flushes : max buffers waiting to be pushed in write behind mode
+        policy               : the loader receiving the next buffer :
+                                'round_robin'          : each loader in turn
+                                'weighted_round_robin' : smooth weighted round robin, a loader gets weight/sum(weights) of the buffers
+                                'least_outstanding'    : the loader with the fewest buffers not yet loaded, relative to its weight
+                                'latency_aware'        : the loader with the lowest expected completion time :
+                                                         (buffers not yet loaded + 1) * average load time of a buffer / weight
+                               When the queue of the chosen loader is full, the next best one is tried
+        latency_ewma_alpha   : smoothing factor of the average load time of a buffer (exponentially weighted moving average)
+
+        close() closes all the loaders then raises a RuntimeError if some of them failed (ex: a write behind flush error)
+        """
+        super().__init__(logger, None, None, write_behind, max_inflight_flushes)
         self.loaders = loaders
         self.cpus_affinity_options = set(cpus_affinity_options)
         self.started = False
@@ -36,7 +58,16 @@ class LoadBalanceLoader(AbstractLoader):
         self.use_threads_as_loaders_executors = use_threads_as_loaders_executors
         self.load_balancer_closed= Value('i', 0)
         self.loaders_threads = []
-
+        self.policy = policy
+        self.latency_ewma_alpha = min(1.0, max(0.01, latency_ewma_alpha))
+        self.weights = [max(1, weight) for (weight, _) in loaders]
+        self.outstanding = [Value('i', 0) for _ in loaders]
+        self.latencies = [Value('d', 0.0) for _ in loaders]
+        self.wrr_current = [0] * len(loaders)
+        self.sent_batches = [0] * len(loaders)
+
+        if policy not in BALANCE_POLICIES:
+            raise RuntimeError('Unknown balance policy {}, available : {}'.format(policy, ', '.join(BALANCE_POLICIES)))
         if len(loaders)<=1:
             raise RuntimeError('At least two loaders should be passed to the load balancer')
         if len(cpus_affinity_options)==0:
@@ -49,12 +80,24 @@ class LoadBalanceLoader(AbstractLoader):
                     loader: AbstractLoader, 
                     queue_block_timeout_sec: int,
                     load_balancer_closed: Value,
-                    logger: WithLogging) -> None:
+                    logger: WithLogging,
+                    outstanding: Value = None,
+                    latency: Value = None,
+                    latency_ewma_alpha: float = 0.2) -> None:
         finished = False
         while True:
             try:
                 (last_call, items) = in_queue.get(timeout=queue_block_timeout_sec)
-                loader.load(job_uuid, items, last_call=finished or last_call)
+                start = time.perf_counter()
+                try:
+                    loader.load(job_uuid, items, last_call=finished or last_call)
+                finally:
+                    if latency is not None:
+                        elapsed = time.perf_counter() - start
+                        latency.value = elapsed if latency.value == 0 else latency.value + latency_ewma_alpha * (elapsed - latency.value)
+                    if outstanding is not None:
+                        with outstanding.get_lock():
+                            outstanding.value -= 1
             except queue.Empty:
                 if finished:
                     break
@@ -75,7 +118,10 @@ class LoadBalanceLoader(AbstractLoader):
                             self.loaders[idx][1], 
                             self.queue_block_timeout_sec,
                             self.load_balancer_closed, 
-                            LoggerWrapper(self.logger))
+                            LoggerWrapper(self.logger),
+                            self.outstanding[idx],
+                            self.latencies[idx],
+                            self.latency_ewma_alpha)
                 }
                 self.loaders_threads.append(make_thread_process(self.use_threads_as_loaders_executors, 
                                                                 params["target"], 
@@ -97,47 +143,89 @@ class LoadBalanceLoader(AbstractLoader):
             self.started=True
 
         if len(items) >0: 
-            self.buffer = self.buffer + items
+            self.buffer.extend(items)
             self.ack_dec += len(items)
 
         if last_call or len(self.buffer) >= self.buffer_size:
             self.balance(ack_counter)
+            if last_call:
+                # the loaders stop when their queues are empty
+                self._wait_flushes()
             self.load_balancer_closed.value = 1 if last_call else 0
 
 
     def balance(self, ack_counter: Value=None, last_call: bool = False):
-        for queue_ in self.rotary_iter_queues:
-            try:
-                queue_.put((last_call, [] + self.buffer), timeout=self.queue_no_block_timeout_sec)
-                break
-            except queue.Full:
-                pass
+        items = self.buffer
+        self.buffer = []
+        self._submit_flush(self._put_items, items, last_call)
         if ack_counter is not None:
             ack_counter.value -= self.ack_dec
         self.clear_buffer_and_ack()
-        
+
+    def _candidates(self) -> List[int]:
+        """
+        The loaders indexes ordered by preference according to the policy
+        """
+        if self.policy == 'round_robin':
+            return [self.queues.index(next(self.rotary_iter_queues))]
+        n = len(self.loaders)
+        if self.policy == 'weighted_round_robin':
+            current = self.wrr_current
+            for idx in range(n):
+                current[idx] += self.weights[idx]
+            return sorted(range(n), key=lambda idx: -current[idx])
+        if self.policy == 'least_outstanding':
+            return sorted(range(n), key=lambda idx: self.outstanding[idx].value / self.weights[idx])
+        # latency_aware : the loaders without measures yet are tried first
+        return sorted(range(n), key=lambda idx: (self.latencies[idx].value > 0,
+                                                 (self.outstanding[idx].value + 1) * self.latencies[idx].value / self.weights[idx],
+                                                 self.outstanding[idx].value))
+
+    def _put_items(self, items: List[dict], last_call: bool) -> None:
+        while True:
+            for idx in self._candidates():
+                try:
+                    with self.outstanding[idx].get_lock():
+                        self.outstanding[idx].value += 1
+                    self.queues[idx].put((last_call, items), timeout=self.queue_no_block_timeout_sec)
+                    self.sent_batches[idx] += 1
+                    if self.policy == 'weighted_round_robin':
+                        self.wrr_current[idx] -= sum(self.weights)
+                    return
+                except queue.Full:
+                    with self.outstanding[idx].get_lock():
+                        self.outstanding[idx].value -= 1
+
+    def _log_balance_stats(self) -> None:
+        for (idx, (_, loader)) in enumerate(self.loaders):
+            super().log_msg('LoadBalancer loader N° {} <{}> : {} buffers, average load time {} sec'.format(
+                                idx, loader.__class__.__name__, self.sent_batches[idx], round(self.latencies[idx].value, 4)), level=INFO)
 
     def close(self) -> None:
         super().log_msg("Closing the Loadbalancer <{}> ...".format(str(self.__class__.__name__)), level=INFO)
         try:
-            if self.has_buffered_data():
+            if len(self.buffer)>0:
                 super().log_msg('Flushing buffered data in the LoadBalancer <{}>'.format(str(self.__class__.__name__)), level=INFO)
                 self.balance(last_call=True)
                 self.clear_buffer_and_ack()
                 super().log_msg('Flushed buffered data in the LoadBalancer <{}>'.format(str(self.__class__.__name__)), level=INFO)
+            self._stop_flusher()
         except Exception as ex:
             raise ex
 
         super().log_msg('Joining loaders threads in the LoadBalancer <{}>'.format(str(self.__class__.__name__)), level=INFO)
         self.load_balancer_closed.value=1
         block_join_threads_or_processes(self.loaders_threads, ignore_exception=False)
+        self._log_balance_stats()
 
         super().log_msg('Closing loaders in the LoadBalancer <{}>'.format(str(self.__class__.__name__)), level=INFO)
-        for (_, loader) in self.loaders:
+        errors = []
+        for (idx, (_, loader)) in enumerate(self.loaders):
             try:
                 loader.close()
-            except Exception :
-                pass
+            except Exception as ex:
+                super().log_msg('Error closing the loader N° {} <{}> in the LoadBalancer'.format(idx, loader.__class__.__name__), exception=ex, level=ERROR)
+                errors.append(ex)
 
         super().log_msg('Closing queues in the LoadBalancer <{}>'.format(str(self.__class__.__name__)), level=INFO)
         for q in self.queues:
@@ -148,13 +236,15 @@ class LoadBalanceLoader(AbstractLoader):
                 pass
         self.started=False
         self.loaders_threads.clear()
+        if len(errors) > 0:
+            raise RuntimeError('{} loaders of the LoadBalancer failed to close : {}'.format(len(errors), '; '.join([str(ex) for ex in errors])))
 
     def clear_buffer_and_ack(self):
         self.buffer.clear()
         self.ack_dec = 0
 
     def has_buffered_data(self) -> bool:
-        return len(self.buffer)>0
+        return len(self.buffer)>0 or self._flushes_pending()
 
     def kill_threads_processes(self):
         if len(self.loaders_threads) > 0:
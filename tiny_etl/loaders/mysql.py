@@ -1,12 +1,39 @@
 from logging import INFO, WARN, ERROR, Logger, DEBUG
 from multiprocessing.sharedctypes import Value
+import os
+import tempfile
 import threading
-from typing import AnyStr, List, Set, Tuple
+from typing import Any, AnyStr, Callable, List, Set, Tuple
 
 from tiny_etl.commons import dict_deep_get
 from tiny_etl.loaders.commons import AbstractLoader
 
 
+MYSQL_ESCAPE_TABLE = str.maketrans({'\\': '\\\\', '\t': '\\t', '\n': '\\n', '\r': '\\r', '\0': '\\0'})
+MYSQL_NULL_FIELD = '\\N'
+
+def mysql_escape_field(val) -> str:
+    """
+    Escapes a value for LOAD DATA INFILE (FIELDS TERMINATED BY '\\t' ESCAPED BY '\\\\' LINES TERMINATED BY '\\n')
+    """
+    if val is None:
+        return MYSQL_NULL_FIELD
+    if val is True or val is False:
+        return '1' if val else '0'
+    return (val if type(val) is str else str(val)).translate(MYSQL_ESCAPE_TABLE)
+
+def mysql_error_classes() -> Tuple[type, type, type]:
+    """
+    Returns the mysql.connector (OperationalError, DataError, Error) classes,
+    or (ConnectionError, ValueError, Exception) when mysql.connector isn't installed (ex: with a connection_factory)
+    """
+    try:
+        import mysql.connector
+        return (mysql.connector.OperationalError, mysql.connector.DataError, mysql.connector.Error)
+    except ImportError:
+        return (ConnectionError, ValueError, Exception)
+
+
 class MySQL_DBLoader(AbstractLoader):
     def __init__(self, 
                 logger: Logger, 
@@ -17,8 +44,28 @@ class MySQL_DBLoader(AbstractLoader):
                 host: str, 
                 database: str, 
                 user: str, 
-                password: str):
-        super().__init__(logger, input_key_path, values_path)
+                password: str,
+                bulk_mode: bool = False,
+                bulk_table: str = None,
+                bulk_columns: List[str] = None,
+                bulk_tmp_dir: str = None,
+                connection_factory: Callable[[], Any] = None,
+                write_behind: bool = False,
+                max_inflight_flushes: int = 1):
+        """
+        sql_query          : insert query used by executemany (bulk_mode=False)
+        bulk_mode          : True to write the buffered rows in a temp file then load it using LOAD DATA LOCAL INFILE
+                             (the server should allow local_infile)
+        bulk_table         : table of the bulk mode
+        bulk_columns       : List[str] columns of the bulk mode, default to the values_path titles
+        bulk_tmp_dir       : directory of the temp files, None for the system temp directory
+        connection_factory : picklable callable returning a mysql.connector like connection,
+                             None to use mysql.connector.connect(host, database, user, password)
+        write_behind         : True to insert the buffers in a dedicated thread, the connection is used by this thread only.
+                               A failed insert (after the reconnection retries) is raised by close()
+        max_inflight_flushes : max buffers waiting to be inserted in write behind mode
+        """
+        super().__init__(logger, input_key_path, values_path, write_behind, max_inflight_flushes)
         self.connection = None
         self.sql_query = sql_query
         self.buffer_size=buffer_size
@@ -26,8 +73,16 @@ class MySQL_DBLoader(AbstractLoader):
         self.user=user
         self.password=password
         self.database = database
+        self.bulk_mode = bulk_mode
+        self.bulk_table = bulk_table
+        self.bulk_columns = bulk_columns if bulk_columns is not None else [title for (title, key_path, required) in values_path]
+        self.bulk_tmp_dir = bulk_tmp_dir
+        self.connection_factory = connection_factory
         self.buffer = []
-        self.calling_thread = Value('i', -1)
+        self.calling_thread = Value('q', -1)
+
+        if bulk_mode and bulk_table is None:
+            raise RuntimeError('bulk_table is required in bulk mode')
 
     def _row_from_data(self, item: dict)->list:
         row = []
@@ -39,11 +94,16 @@ class MySQL_DBLoader(AbstractLoader):
         return row
 
     def _connect(self):
-        import mysql.connector
+        (OperationalError, DataError, Error) = mysql_error_classes()
 
         try:
             if self.connection is None:
-                con = mysql.connector.connect(host=self.host, database=self.database, user=self.user, password=self.password)
+                if self.connection_factory is not None:
+                    con = self.connection_factory()
+                else:
+                    import mysql.connector
+                    con = mysql.connector.connect(host=self.host, database=self.database, user=self.user, password=self.password,
+                                                  allow_local_infile=self.bulk_mode)
                 self.connection = (con, con.cursor())
                 super().log_msg("MySQL connection is opened successfully  <{}>".format(self.connection[0].__class__.__name__),  level=INFO)   
             
@@ -51,10 +111,32 @@ class MySQL_DBLoader(AbstractLoader):
                 self.connection[0].reconnect()
             return self.connection
 
-        except mysql.connector.Error as error:
+        except Error as error:
             super().log_msg("Failed to connect to database {}".format(str(error.args)), exception=error, level=ERROR)
             raise error
 
+    def _bulk_statement(self, file_path: str) -> str:
+        return ("LOAD DATA LOCAL INFILE '{}' INTO TABLE {} CHARACTER SET utf8mb4 "
+                "FIELDS TERMINATED BY '\\t' ESCAPED BY '\\\\' LINES TERMINATED BY '\\n' ({})").format(
+                    file_path.replace('\\', '\\\\').replace("'", "\\'"), self.bulk_table, ",".join(self.bulk_columns))
+
+    def _write_bulk_file(self, items: List[list]) -> str:
+        with tempfile.NamedTemporaryFile(mode='wb', prefix='mysql_bulk_', suffix='.tsv', dir=self.bulk_tmp_dir, delete=False) as fh:
+            lines = ["\t".join([mysql_escape_field(val) for val in row]) for row in items]
+            fh.write(("\n".join(lines) + "\n").encode('utf-8'))
+            return fh.name
+
+    def _insert_rows(self, cursor, items: List[list]) -> int:
+        if not self.bulk_mode:
+            cursor.executemany(self.sql_query, items)
+            return cursor.rowcount
+        file_path = self._write_bulk_file(items)
+        try:
+            cursor.execute(self._bulk_statement(file_path))
+            return cursor.rowcount
+        finally:
+            os.remove(file_path)
+
     def load(self, job_uuid: str, items: List[dict], last_call: bool) -> None:
         id = threading.get_ident()
         if self.calling_thread.value==-1:
@@ -71,50 +153,77 @@ class MySQL_DBLoader(AbstractLoader):
                     data.append(d)
 
         if len(data)>0:
-            self.buffer = self.buffer + data
+            self.buffer.extend(data)
 
         if last_call or len(self.buffer) > self.buffer_size:
             self.write_buffered_data_to_disk()
 
     def write_buffered_data_to_disk(self) -> None:
-        import mysql.connector
+        if len(self.buffer) == 0:
+            # ex: empty last_call loads (LoadBalanceLoader children, merge loaders)
+            return
+        rows = self.buffer
+        self.buffer = []
+        if self.write_behind:
+            self._submit_flush(self._insert_or_raise, rows)
+        elif not self._insert_with_retries(rows):
+            # kept for the next flush
+            self.buffer = rows + self.buffer
+
+    def _insert_or_raise(self, items: List[list]) -> None:
+        if not self._insert_with_retries(items):
+            raise RuntimeError('Failed to insert {} rows'.format(len(items)))
+
+    def _insert_with_retries(self, items: List[list]) -> bool:
+        """
+        Returns True if the rows are inserted
+        """
+        if len(items) == 0:
+            return True
+        (OperationalError, DataError, Error) = mysql_error_classes()
 
         (connection, cursor) = self._connect()
         reconnection_retries = 0
         while True:
             try:
-                items =  [] + self.buffer
                 data_len=len(items)
                 inserted_data = 0
-                super().log_msg("{0} rows available to be inserted".format(data_len))
+                super().log_msg("%d rows available to be inserted", args=(data_len,))
 
                 connection.start_transaction()
-                cursor.executemany(self.sql_query, items)   
+                rowcount = self._insert_rows(cursor, items)
                 connection.commit()
 
-                inserted_data+=cursor.rowcount
-                super().log_msg("{} Record inserted successfully".format(cursor.rowcount))
-                super().log_msg("{} Total record inserted successfully".format(data_len))
-                self.buffer.clear()
-            except mysql.connector.OperationalError as error:
-                connection = self._connect()
+                inserted_data+=rowcount
+                super().log_msg("%s Record inserted successfully", args=(rowcount,))
+                super().log_msg("%d Total record inserted successfully", args=(data_len,))
+                return True
+            except OperationalError as error:
+                (connection, cursor) = self._connect()
                 if reconnection_retries<5:
                     reconnection_retries += 1
                     super().log_msg("Reconnection {}/5".format(reconnection_retries), level=INFO)
                     continue
                 else:
                     super().log_msg("Reconnection max retries reached (=5)".format(reconnection_retries), level=INFO)
-            except mysql.connector.DataError as error:
+            except DataError as error:
                 super().log_msg("Failed to insert records. Error={}".format(error), exception=error, level=ERROR)
                 if connection is not None and connection.in_transaction:
                     try:
                         connection.rollback()
                     except Exception as ex:
                         super().log_msg("Failed to rollback inserted records {}".format(ex.args), exception=ex, level=ERROR)
-            except mysql.connector.Error as error:
+            except Error as error:
                 super().log_msg("Failed to insert records. Error={}".format(error), exception=error, level=ERROR)
             
-            return
+            return False
+
+    def _close_connection(self) -> None:
+        if self.connection is not None:
+            (conn, cursor) = self.connection
+            self.connection = None
+            cursor.close()
+            conn.close()
 
     def close(self) -> None:
         try:
@@ -123,13 +232,15 @@ class MySQL_DBLoader(AbstractLoader):
                 self.write_buffered_data_to_disk()
                 self.buffer.clear()
                 super().log_msg('Flushed buffered data in <{}>'.format(str(self.__class__.__name__)), level=INFO)
-            if self.connection is not None:
-                (conn, cursor) = self.connection
-                cursor.close()
-                conn.close()
-            super().log_msg("MySQL connection is closed successfully",  level=INFO)
-        except Exception as ex:
-            super().log_msg("Error closing MySQL connection", exception=ex , level=ERROR)
+            self._wait_flushes()
+        finally:
+            try:
+                # closed by the thread using it
+                self._submit_flush(self._close_connection)
+                self._stop_flusher()
+                super().log_msg("MySQL connection is closed successfully",  level=INFO)
+            except Exception as ex:
+                super().log_msg("Error closing MySQL connection", exception=ex , level=ERROR)
 
     def has_buffered_data(self) -> bool:
-        return len(self.buffer)>0
+        return len(self.buffer)>0 or self._flushes_pending()
@@ -0,0 +1,68 @@
+import logging
+from logging import DEBUG, Handler, Logger
+from logging.handlers import QueueHandler
+import multiprocessing
+from typing import Callable, List
+
+
+class QueueLogListener:
+    def __init__(self, handlers_factory: Callable[[], List[Handler]], level: int = DEBUG) -> None:
+        """
+        Asynchronous multi processes logging : the processes put their log records in a queue (QueueHandler),
+        a single listener process formats and writes them using the handlers, so the workers never wait for a file lock.
+
+        handlers_factory : picklable fn() -> List[logging.Handler], called in the listener process (ex: file and console handlers)
+        level            : level of the root logger of the processes using the queue
+
+        Usage :
+            listener = QueueLogListener(make_handlers)
+            listener.start()
+            listener.install()  # before starting the pipelines, the forked processes inherit the QueueHandler
+            ...
+            listener.stop()
+        """
+        self.handlers_factory = handlers_factory
+        self.level = level
+        self.queue = multiprocessing.Queue()
+        self.process = None
+
+    @staticmethod
+    def listen(log_queue: multiprocessing.Queue, handlers_factory: Callable[[], List[Handler]]) -> None:
+        handlers = handlers_factory()
+        try:
+            while True:
+                record = log_queue.get()
+                if record is None:
+                    break
+                for handler in handlers:
+                    if record.levelno >= handler.level:
+                        handler.handle(record)
+        finally:
+            for handler in handlers:
+                handler.close()
+
+    def start(self) -> None:
+        if self.process is None:
+            self.process = multiprocessing.Process(target=QueueLogListener.listen, args=(self.queue, self.handlers_factory),
+                                                   name='LogListener', daemon=True)
+            self.process.start()
+
+    def install(self, logger: Logger = None) -> None:
+        """
+        Replaces the handlers of the logger (default to the root logger) by a QueueHandler.
+        The spawned processes (Windows, macOS) should call it again with the same listener.
+        """
+        logger = logger if logger is not None else logging.getLogger()
+        for handler in list(logger.handlers):
+            logger.removeHandler(handler)
+        logger.addHandler(QueueHandler(self.queue))
+        logger.setLevel(self.level)
+
+    def stop(self) -> None:
+        """
+        Writes the queued records then stops the listener process
+        """
+        if self.process is not None:
+            self.queue.put(None)
+            self.process.join()
+            self.process = None
@@ -0,0 +1,180 @@
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+import json
+from logging import DEBUG, INFO, Logger
+from multiprocessing.sharedctypes import RawArray
+import threading
+import time
+from typing import List
+
+from tiny_etl.commons import WithLogging
+
+
+class PipelineStats:
+    def __init__(self, transformation_pipelines_count: int, loaders_count: int) -> None:
+        """
+        Pipeline counters in shared memory without locks : each slot has a single writer (the worker owning it) storing its local count,
+        the readers (PipelineStatsServer) may see a value a few items old.
+        """
+        self.extracted = RawArray('q', 2)  # items, bytes
+        self.transformed = RawArray('q', transformation_pipelines_count)
+        self.emitted = RawArray('q', transformation_pipelines_count)
+        self.loaded = RawArray('q', loaders_count)
+        self.in_queues_depths = RawArray('q', transformation_pipelines_count)
+        self.out_queues_depths = RawArray('q', loaders_count)
+        # pipeline, extractor, transformation pipelines, loaders
+        self.pids = RawArray('q', 2 + transformation_pipelines_count + loaders_count)
+        self.times = RawArray('d', 2)  # started_at, finished_at
+
+    def worker_roles(self) -> List[str]:
+        return ['pipeline', 'extractor'] + ['transformer_{}'.format(i) for i in range(len(self.transformed))] + \
+                ['loader_{}'.format(i) for i in range(len(self.loaded))]
+
+    def transformer_pid_idx(self, idx: int) -> int:
+        return 2 + idx
+
+    def loader_pid_idx(self, idx: int) -> int:
+        return 2 + len(self.transformed) + idx
+
+    def bytes_done(self) -> float:
+        """
+        Input bytes already transformed, estimated with the average size of the extracted items
+        """
+        (items, size) = (self.extracted[0], self.extracted[1])
+        if items == 0:
+            return 0.0
+        return size * min(1.0, sum(self.transformed) / items)
+
+    def snapshot(self) -> dict:
+        started_at = self.times[0]
+        finished_at = self.times[1]
+        return {
+            'started_at': started_at if started_at > 0 else None,
+            'finished_at': finished_at if finished_at > 0 else None,
+            'items_extracted': self.extracted[0],
+            'bytes_extracted': self.extracted[1],
+            'items_transformed': sum(self.transformed),
+            'items_emitted': sum(self.emitted),
+            'items_loaded': list(self.loaded),
+            'in_queues_depths': list(self.in_queues_depths),
+            'out_queues_depths': list(self.out_queues_depths),
+        }
+
+
+class _StatsRequestHandler(BaseHTTPRequestHandler):
+    def do_GET(self) -> None:
+        if self.path.split('?')[0] not in ('/', '/stats'):
+            self.send_error(404)
+            return
+        body = json.dumps(self.server.stats_server.stats(), indent=2).encode('utf-8')
+        self.send_response(200)
+        self.send_header('Content-Type', 'application/json')
+        self.send_header('Content-Length', str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def log_message(self, format: str, *args) -> None:
+        self.server.stats_server.log_msg("Stats server : " + format, level=DEBUG, args=args)
+
+
+class PipelineStatsServer(WithLogging):
+    def __init__(self, logger: Logger, pipelines: list, host: str = '127.0.0.1', port: int = 8765, input_size_mo: float = None) -> None:
+        """
+        Serves the stats of the pipelines (ThreadedPipeline(..., collect_stats=True)) as JSON on http://host:port/stats,
+        from a daemon thread of the process starting the pipelines. The workers are never blocked : the stats are read from shared memory.
+
+        pipelines     : List[ThreadedPipeline]
+        host          : default to localhost only
+        port          : 0 to pick a free port (see self.port once started)
+        input_size_mo : the input size (ex: get_dir_size_in_mo(in_dir)) used to compute the progress and the ETA
+
+        The CPU% and the RSS of the workers processes are reported when psutil is installed.
+        """
+        super().__init__(logger)
+        self.pipelines = pipelines
+        self.host = host
+        self.port = port
+        self.input_size_mo = input_size_mo
+        self.httpd = None
+        self.thread = None
+        self.processes = {}
+        try:
+            import psutil
+            self.psutil = psutil
+        except ImportError:
+            self.psutil = None
+
+        for pipeline in pipelines:
+            if pipeline.stats is None:
+                raise RuntimeError('The pipeline {} should be created with collect_stats=True'.format(pipeline.job_uuid))
+
+    def _process_stats(self, pid: int) -> dict:
+        if self.psutil is None or pid <= 0:
+            return {}
+        try:
+            process = self.processes.get(pid)
+            if process is None:
+                process = self.psutil.Process(pid)
+                process.cpu_percent(interval=None)
+                self.processes[pid] = process
+            return {'cpu_percent': process.cpu_percent(interval=None), 'rss_mo': round(process.memory_info().rss/1024/1024, 3)}
+        except Exception:
+            self.processes.pop(pid, None)
+            return {'exited': True}
+
+    def _pipeline_stats(self, pipeline) -> dict:
+        stats = pipeline.stats
+        res = stats.snapshot()
+        res['job_uuid'] = pipeline.job_uuid
+        res['closed'] = pipeline.pipeline_closed.value == 1
+        workers = []
+        seen_pids = set()
+        for (role, pid) in zip(stats.worker_roles(), list(stats.pids)):
+            worker = {'role': role, 'pid': pid}
+            if pid not in seen_pids:
+                # the threads workers share the pipeline process
+                seen_pids.add(pid)
+                worker.update(self._process_stats(pid))
+            workers.append(worker)
+        res['workers'] = workers
+        return res
+
+    def stats(self) -> dict:
+        now = time.time()
+        pipelines = [self._pipeline_stats(pipeline) for pipeline in self.pipelines]
+        started = [p['started_at'] for p in pipelines if p['started_at'] is not None]
+        elapsed = now - min(started) if len(started) > 0 else 0.0
+        done_mo = sum([pipeline.stats.bytes_done() for pipeline in self.pipelines])/1024/1024
+        res = {
+            'time': now,
+            'elapsed_sec': round(elapsed, 3),
+            'input_size_mo': self.input_size_mo,
+            'done_mo': round(done_mo, 3),
+            'progress': None,
+            'eta_sec': None,
+            'items_extracted': sum([p['items_extracted'] for p in pipelines]),
+            'items_emitted': sum([p['items_emitted'] for p in pipelines]),
+            'items_loaded': sum([sum(p['items_loaded']) for p in pipelines]),
+            'pipelines': pipelines,
+        }
+        if self.input_size_mo is not None and self.input_size_mo > 0:
+            progress = min(1.0, done_mo / self.input_size_mo)
+            res['progress'] = round(progress, 4)
+            if progress > 0:
+                res['eta_sec'] = round(elapsed * (1 - progress) / progress, 1)
+        return res
+
+    def start(self) -> None:
+        self.httpd = ThreadingHTTPServer((self.host, self.port), _StatsRequestHandler)
+        self.httpd.daemon_threads = True
+        self.httpd.stats_server = self
+        self.port = self.httpd.server_address[1]
+        self.thread = threading.Thread(target=self.httpd.serve_forever, name='PipelineStatsServer', daemon=True)
+        self.thread.start()
+        super().log_msg("Pipelines stats served on http://{}:{}/stats".format(self.host, self.port), level=INFO)
+
+    def stop(self) -> None:
+        if self.httpd is not None:
+            self.httpd.shutdown()
+            self.httpd.server_close()
+            self.thread.join()
+            self.httpd = None
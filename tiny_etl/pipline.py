@@ -2,19 +2,25 @@
 from abc import ABC, abstractmethod
 from concurrent.futures import thread
 from logging import Logger, INFO, WARN, ERROR
-from multiprocessing import Process, Queue, Manager
+from multiprocessing import Lock, Process, Queue, Manager
 from multiprocessing.sharedctypes import Value
+import os
 import queue
 import signal
 from threading import Timer
-from typing import List, Set
+import time
+from typing import Callable, List, Set
 
 import uuid
 
+from tiny_etl.broadcast import SharedBatchRef, SharedMemoryBroadcaster, read_shared_batch
 from tiny_etl.commons import LoggerWrapper, WithLogging, rotary_iter
 from tiny_etl.extractors.commons import AbstractExtractor
+from tiny_etl.finalizers import AbstractFinalizer
 from tiny_etl.loaders.commons import AbstractLoader
-from tiny_etl.transformers.commons import AbstractTransformer
+from tiny_etl.monitoring import PipelineStats
+from tiny_etl.transformers.commons import AbstractTransformer, new_item_context
+from tiny_etl.tracing import TRACE_MAX_DESCENDANTS, TraceCollector, end_trace, pop_trace, start_trace, trace_descendant
 from tiny_etl.commons import flatMapApply
 from tiny_etl.commons import block_join_threads_or_processes, kill_threads_processes
 from tiny_etl.commons import make_thread_process
@@ -49,7 +55,24 @@ class ThreadedPipeline(AbstractPipeline):
                 use_threads_as_extractors_executors: bool = False,
                 queue_block_timeout_sec: int = 0.1,
                 queue_no_block_timeout_sec: int = 0.05,
-                trans_in_queue_max_size: int = 1_000) -> None:
+                trans_in_queue_max_size: int = 1_000,
+                broadcast_to_loaders: bool = False,
+                broadcast_batch_size: int = 100,
+                finalizers: List[AbstractFinalizer] = [],
+                sample_trace_every: int = None,
+                trace_queue_max_size: int = 100_000,
+                collect_stats: bool = False) -> None:
+        """
+        broadcast_to_loaders : True to pickle each batch of transformed items once in shared memory for all the loaders
+                               (the loaders queues receive a reference), instead of pickling every item once per loader queue
+        broadcast_batch_size : items per shared memory batch
+        finalizers           : called in order once all the loaders are closed, skipped if a loader failed to close
+                               (ex: OutputCompactionFinalizer, ManifestCommitFinalizer)
+        sample_trace_every   : 1 extracted item out of sample_trace_every is traced across the stages (with its first descendants),
+                               the latency percentiles per stage are logged at the end. None to disable the tracing
+        trace_queue_max_size : max spans waiting to be collected by the pipeline process, the next ones are dropped
+        collect_stats        : True to count the items of each worker in shared memory (self.stats), served by PipelineStatsServer
+        """
         super().__init__(logger)
         self.job_uuid = str(uuid.uuid1())
         self.extractor = extractor
@@ -68,6 +91,15 @@ class ThreadedPipeline(AbstractPipeline):
         self.extractor_finished = Value('i', 0)
         self.transformation_pipeline_alive = Value('i', 0)
         self.loaders_alive = Value('i', 0)
+        self.loaders_failed = Value('i', 0)
+        self.broadcast_to_loaders = broadcast_to_loaders
+        self.broadcast_batch_size = max(1, broadcast_batch_size)
+        self.broadcast_lock = Lock()
+        self.finalizers = finalizers
+        self.sample_trace_every = max(1, sample_trace_every) if sample_trace_every is not None else None
+        self.trace_queue_max_size = max(1, trace_queue_max_size)
+        self.trace_collector = TraceCollector()
+        self.stats = PipelineStats(self.max_transformation_pipelines, len(loaders)) if collect_stats and loaders is not None else None
 
         if len(global_cpus_affinity_options)==0:
             raise RuntimeError('Cpu affinity options <global_cpus_affinity_options> should be not empty')
@@ -88,13 +120,25 @@ class ThreadedPipeline(AbstractPipeline):
                         pipeline_closed: Value, 
                         extractor_finished: Value, 
                         queue_no_block_timeout_sec: int,
-                        logger: WithLogging) -> None:
+                        logger: WithLogging,
+                        sample_trace_every: int = None,
+                        stats: PipelineStats = None) -> None:
         out_queues_iter = rotary_iter(out_queues)
 
+        extracted_count = 0
+        if stats is not None:
+            stats.pids[1] = os.getpid()
         for item in extractor.extract():
             if pipeline_started.value==1 and pipeline_closed.value==1:
                 break
             if item is not None:
+                if stats is not None:
+                    stats.extracted[0] += 1
+                    stats.extracted[1] += extractor.item_size_in_bytes(item)
+                if sample_trace_every is not None:
+                    if extracted_count % sample_trace_every == 0:
+                        start_trace(item, extracted_count)
+                    extracted_count += 1
                 for out_queue in out_queues_iter:
                     try:
                         out_queue.put(item, timeout=queue_no_block_timeout_sec)
@@ -115,35 +159,91 @@ class ThreadedPipeline(AbstractPipeline):
                         transformation_pipeline_alive: Value,
                         queue_block_timeout_sec: int,
                         queue_no_block_timeout_sec: int,
-                        logger: WithLogging) -> None:
+                        logger: WithLogging,
+                        broadcast_batch_size: int = None,
+                        trace: bool = False,
+                        stats: PipelineStats = None) -> None:
         finished = False
+        broadcaster = None
+        if broadcast_batch_size is not None:
+            broadcaster = SharedMemoryBroadcaster(out_queues, pipeline_closed, broadcast_batch_size, queue_no_block_timeout_sec)
+            push = broadcaster.push
+        else:
+            push = lambda x: ThreadedPipeline.push_to_loaders(x, out_queues, pipeline_closed, queue_no_block_timeout_sec)
+        if stats is not None:
+            stats.pids[stats.transformer_pid_idx(idx)] = os.getpid()
+            push_item = push
+            def push(x: dict) -> None:
+                push_item(x)
+                stats.emitted[idx] += 1
         while pipeline_closed.value==0:
             try:
                 item = in_queue.get(timeout=queue_block_timeout_sec)
-                context = {}
+                context = new_item_context(item)
                 if item is not None:
+                    item_trace = pop_trace(item) if trace else None
+                    transform_start = time.time()
+                    traced_count = 0
                     for x in flatMapApply(item, list(map(lambda mapper: mapper.transform, trans)), context=context):
                         if x is not None:
-                            pushed_idx = {i for i in range(len(out_queues))}
-                            while not pipeline_closed.value and len(pushed_idx)>0:
-                                for (idx, out_queue) in enumerate(out_queues):
-                                    try:
-                                        if idx in pushed_idx:
-                                            out_queue.put(x, timeout=queue_no_block_timeout_sec)
-                                            pushed_idx.remove(idx)
-                                    except queue.Full:
-                                        pass
+                            if item_trace is not None and traced_count < TRACE_MAX_DESCENDANTS:
+                                trace_descendant(item_trace, x, transform_start)
+                                traced_count += 1
+                            push(x)
                         else:
-                            logger.log_msg("Item found None after applying all transformers")
+                            logger.log_msg_sampled("Item found None after applying all transformers")
+                    if stats is not None:
+                        stats.transformed[idx] += 1
             except queue.Empty:
+                if broadcaster is not None:
+                    broadcaster.flush()
                 if finished is True:
                     break
                 if extractor_finished.value==1:
                     finished=pipeline_started.value==1
+        if finished:
+            ThreadedPipeline.flush_transformers(out_queues, trans, pipeline_closed, queue_no_block_timeout_sec, logger, push)
+        if broadcaster is not None:
+            broadcaster.flush()
         transformation_pipeline_alive.value -= 1
         if finished:
             logger.log_msg("Transformation pipeline N° {} finished her work".format(idx), level=INFO)
     
+    @staticmethod
+    def push_to_loaders(x: dict, out_queues: List[Queue], pipeline_closed: Value, queue_no_block_timeout_sec: int) -> None:
+        pushed_idx = {i for i in range(len(out_queues))}
+        while not pipeline_closed.value and len(pushed_idx)>0:
+            for (idx, out_queue) in enumerate(out_queues):
+                try:
+                    if idx in pushed_idx:
+                        out_queue.put(x, timeout=queue_no_block_timeout_sec)
+                        pushed_idx.remove(idx)
+                except queue.Full:
+                    pass
+
+    @staticmethod
+    def flush_transformers(out_queues: List[Queue],
+                            trans: List[AbstractTransformer],
+                            pipeline_closed: Value,
+                            queue_no_block_timeout_sec: int,
+                            logger: WithLogging,
+                            push: Callable[[dict], None] = None) -> None:
+        """
+        End of stream : the items buffered by each transformer are passed to the next transformers, then to the loaders
+        """
+        if push is None:
+            push = lambda x: ThreadedPipeline.push_to_loaders(x, out_queues, pipeline_closed, queue_no_block_timeout_sec)
+        for (i, tr) in enumerate(trans):
+            next_mappers = list(map(lambda mapper: mapper.transform, trans[i+1:]))
+            for flushed in tr.flush():
+                if pipeline_closed.value:
+                    return
+                for x in flatMapApply(flushed, next_mappers, context={}):
+                    if x is not None:
+                        push(x)
+                    else:
+                        logger.log_msg_sampled("Item found None after applying all transformers")
+
     @staticmethod
     def load_items(idx: int,
                     job_uuid: str, 
@@ -154,19 +254,41 @@ class ThreadedPipeline(AbstractPipeline):
                     transformation_pipeline_alive: Value,
                     loaders_alive: Value,
                     queue_block_timeout_sec: int,
-                    logger: WithLogging) -> None:
+                    logger: WithLogging,
+                    broadcast_lock: Lock = None,
+                    trace_queue: Queue = None,
+                    stats: PipelineStats = None,
+                    loaders_failed: Value = None) -> None:
         finished = False
         ack_counter = Value('i', 0)
+        if stats is not None:
+            stats.pids[stats.loader_pid_idx(idx)] = os.getpid()
         while pipeline_closed.value==0:
             item = None
             try:
                 item = out_queue.get(timeout=queue_block_timeout_sec)
+                if isinstance(item, SharedBatchRef):
+                    items = read_shared_batch(item, broadcast_lock)
+                    last_idx = len(items) - 1
+                    for (i, x) in enumerate(items):
+                        ack_counter.value += 1
+                        ThreadedPipeline.load_item(job_uuid, x, loader, ack_counter, i==last_idx and out_queue.qsize()==0 and finished, trace_queue)
+                    if stats is not None:
+                        stats.loaded[idx] += len(items)
+                    continue
                 ack_counter.value += 1
-                loader.loadWithAck(job_uuid, [item], ack_counter, last_call=out_queue.qsize()==0 and finished)
+                ThreadedPipeline.load_item(job_uuid, item, loader, ack_counter, out_queue.qsize()==0 and finished, trace_queue)
+                if stats is not None:
+                    stats.loaded[idx] += 1
             except queue.Empty:
                 if finished and (ack_counter.value==0 or loader.has_buffered_data()):
                     logger.log_msg("Closing loader N° {} <{}> ({}) : buffered_data: {}".format(idx, loader.__class__.__name__, loader.uuid, loader.has_buffered_data()), level=INFO)
-                    loader.close()
+                    try:
+                        loader.close()
+                    except Exception as ex:
+                        if loaders_failed is not None:
+                            loaders_failed.value = 1
+                        logger.log_msg("Error closing loader N° {} <{}> ({}) : {}".format(idx, loader.__class__.__name__, loader.uuid, ex), level=ERROR)
                     break
             finally:
                 if transformation_pipeline_alive.value==0: # no more transformers to push data to loaders
@@ -176,12 +298,23 @@ class ThreadedPipeline(AbstractPipeline):
         logger.log_msg("Loader N° {} <{}> finished his work ({})".format(idx, loader.__class__.__name__, loader.uuid), level=INFO)
     
 
+    @staticmethod
+    def load_item(job_uuid: str, item: dict, loader: AbstractLoader, ack_counter: Value, last_call: bool, trace_queue: Queue) -> None:
+        if trace_queue is None:
+            loader.loadWithAck(job_uuid, [item], ack_counter, last_call=last_call)
+            return
+        item_trace = pop_trace(item)
+        dequeued = time.time()
+        loader.loadWithAck(job_uuid, [item], ack_counter, last_call=last_call)
+        end_trace(item_trace, dequeued, trace_queue)
+
     def _run(self) -> None:
         extract_threads = []
         trans_threads = []
         load_threads = []
         in_queues = []
         out_queues = []
+        trace_queue = None
         try:
             import sys
             def makeQueue(maxsize: int):
@@ -197,8 +330,14 @@ class ThreadedPipeline(AbstractPipeline):
 
             original_sigint_handler = signal.signal(signal.SIGINT, signal.SIG_IGN)
             signal.signal(signal.SIGINT, original_sigint_handler)
+            if self.broadcast_to_loaders and not sys.platform.startswith('win32'):
+                # one resource tracker shared by the workers : the shared memory blocks are created and released by different processes
+                from multiprocessing import resource_tracker
+                resource_tracker.ensure_running()
             in_queues = [makeQueue(maxsize=self.trans_in_queue_max_size) for _ in range(self.max_transformation_pipelines)]
             out_queues = [makeQueue(maxsize=(self.trans_in_queue_max_size * self.max_transformation_pipelines)) for _ in range(len(self.loaders))]
+            if self.sample_trace_every is not None:
+                trace_queue = makeQueue(maxsize=self.trace_queue_max_size)
 
             extract_threads.append(make_thread_process(self.use_threads_as_extractors_executors, 
                                                                         target=ThreadedPipeline.extract_items, 
@@ -208,7 +347,9 @@ class ThreadedPipeline(AbstractPipeline):
                                                                                 self.pipeline_closed, 
                                                                                 self.extractor_finished,
                                                                                 self.queue_no_block_timeout_sec,
-                                                                                self.logger)))                                                                            
+                                                                                self.logger,
+                                                                                self.sample_trace_every,
+                                                                                self.stats)))                                                                            
             self.logger.log_msg("1 extraction process created", level=INFO)
 
             self.transformation_pipeline_alive.value = self.max_transformation_pipelines
@@ -225,7 +366,10 @@ class ThreadedPipeline(AbstractPipeline):
                             self.transformation_pipeline_alive,
                             self.queue_block_timeout_sec,
                             self.queue_no_block_timeout_sec,
-                            self.logger)
+                            self.logger,
+                            self.broadcast_batch_size if self.broadcast_to_loaders else None,
+                            trace_queue is not None,
+                            self.stats)
                 }
                 trans_threads.append(make_thread_process(self.use_threads_as_transformation_pipelines, 
                                                                         params["target"], 
@@ -246,7 +390,11 @@ class ThreadedPipeline(AbstractPipeline):
                                                             self.transformation_pipeline_alive,
                                                             self.loaders_alive,
                                                             self.queue_block_timeout_sec,
-                                                            self.logger)))
+                                                            self.logger,
+                                                            self.broadcast_lock,
+                                                            trace_queue,
+                                                            self.stats,
+                                                            self.loaders_failed)))
             self.logger.log_msg("{} loaders processes created".format(len(self.loaders)), level=INFO)
             for l in self.loaders:
                 self.logger.log_msg("Loader uuid : {}".format(l.uuid), level=INFO)
@@ -265,11 +413,20 @@ class ThreadedPipeline(AbstractPipeline):
             set_process_affinity(self, self.global_cpus_affinity_options, log_prefix='Pipeline', print_log=True)
             self.pipeline_started.value=1
             self.logger.log_msg("Pipeline {} running".format(self.job_uuid), level=INFO)
+            if self.stats is not None:
+                self.stats.pids[0] = os.getpid()
+                self.stats.times[0] = time.time()
+            stats_updated_at = 0
 
             extractor_joined=False
             transformators_joined=False
             loaders_joined=False
             while self.pipeline_closed.value==0:
+                if trace_queue is not None:
+                    self.trace_collector.drain(trace_queue)
+                if self.stats is not None and time.time() - stats_updated_at >= 0.5:
+                    stats_updated_at = time.time()
+                    self.update_queues_depths(in_queues, out_queues)
                 if not extractor_joined and self.extractor_finished.value==1:
                     extractor_joined = block_join_threads_or_processes(extract_threads, lambda: self.pipeline_closed.value==1)
                     if extractor_joined:
@@ -297,6 +454,13 @@ class ThreadedPipeline(AbstractPipeline):
                         self.logger.log_msg("Loaders threads joined", level=INFO)
                 #endregion
                 if extractor_joined and transformators_joined and loaders_joined:
+                    if trace_queue is not None:
+                        self.trace_collector.drain(trace_queue)
+                        self.logger.log_msg("Pipeline {} latencies : {}".format(self.job_uuid, self.trace_collector.report()), level=INFO)
+                    if self.stats is not None:
+                        self.update_queues_depths(in_queues, out_queues)
+                        self.stats.times[1] = time.time()
+                    self.run_finalizers()
                     self.close()
 
         except KeyboardInterrupt:
@@ -316,7 +480,7 @@ class ThreadedPipeline(AbstractPipeline):
                     loader.kill_threads_processes()
                 except Exception:
                     pass
-            queues = in_queues + out_queues
+            queues = in_queues + out_queues + ([trace_queue] if trace_queue is not None else [])
             self.logger.log_msg("Queues closing ...", level=INFO)
             timer = Timer(interval=1, function=lambda : thread.interrupt_main())#in seconds
             timer.start()
@@ -331,5 +495,27 @@ class ThreadedPipeline(AbstractPipeline):
             self.logger.log_msg("Queues closed", level=INFO)
             self.logger.log_msg("Pipline {} End executing".format(self.job_uuid),  level=INFO)
 
+    def update_queues_depths(self, in_queues: List[Queue], out_queues: List[Queue]) -> None:
+        """
+        Called by the pipeline process : the workers do not count the queued items
+        """
+        for (depths, queues) in ((self.stats.in_queues_depths, in_queues), (self.stats.out_queues_depths, out_queues)):
+            for (i, q) in enumerate(queues):
+                try:
+                    depths[i] = q.qsize()
+                except NotImplementedError:  # macOS
+                    depths[i] = -1
+
+    def run_finalizers(self) -> None:
+        if self.loaders_failed.value == 1:
+            self.logger.log_msg("Finalizers skipped : a loader failed to close", level=ERROR)
+            return
+        for finalizer in self.finalizers:
+            self.logger.log_msg("Running finalizer <{}>".format(finalizer.__class__.__name__), level=INFO)
+            try:
+                finalizer.finalize(self.job_uuid)
+            except Exception as ex:
+                self.logger.log_msg("Finalizer <{}> failed".format(finalizer.__class__.__name__), exception=ex, level=ERROR)
+
     def _close(self) -> None:
         self.pipeline_closed.value = 1
@@ -0,0 +1,276 @@
+import hashlib
+import heapq
+import math
+from typing import Any, List, Tuple
+
+
+def value_to_bytes(value: Any) -> bytes:
+    if isinstance(value, bytes):
+        return value
+    if isinstance(value, str):
+        return value.encode('utf-8', 'surrogatepass')
+    return repr(value).encode('utf-8')
+
+def hash128(value: Any) -> Tuple[int, int]:
+    """
+    Returns two independent 64 bits hashes of the value (stable across processes, unlike hash())
+    """
+    digest = hashlib.blake2b(value_to_bytes(value), digest_size=16).digest()
+    return (int.from_bytes(digest[:8], 'little'), int.from_bytes(digest[8:], 'little'))
+
+
+class BloomFilter:
+    """
+    Set membership with a fixed memory and no false negatives.
+    A value never added is reported present with a probability ~ false_positive_rate (while the items count <= expected_items).
+    Memory : -expected_items * ln(false_positive_rate) / ln(2)² bits (ex: 1M items at 1% ~ 1.2 Mo)
+    """
+    def __init__(self, expected_items: int, false_positive_rate: float = 0.01) -> None:
+        if expected_items <= 0:
+            raise RuntimeError('expected_items should be > 0')
+        if not 0 < false_positive_rate < 1:
+            raise RuntimeError('false_positive_rate should be in ]0, 1[')
+        self.expected_items = expected_items
+        self.false_positive_rate = false_positive_rate
+        self.bits_count = max(8, math.ceil(-expected_items * math.log(false_positive_rate) / (math.log(2) ** 2)))
+        self.hashes_count = max(1, round(self.bits_count / expected_items * math.log(2)))
+        self.bits = bytearray((self.bits_count + 7) // 8)
+        self.items_count = 0
+
+    def _indexes(self, value: Any):
+        (h1, h2) = hash128(value)
+        h2 |= 1
+        for i in range(self.hashes_count):
+            yield (h1 + i * h2) % self.bits_count
+
+    def add(self, value: Any) -> bool:
+        """
+        Returns True if the value was absent (it is added), False if it may be already present
+        """
+        added = False
+        bits = self.bits
+        for idx in self._indexes(value):
+            mask = 1 << (idx & 7)
+            if not bits[idx >> 3] & mask:
+                bits[idx >> 3] |= mask
+                added = True
+        if added:
+            self.items_count += 1
+        return added
+
+    def __contains__(self, value: Any) -> bool:
+        bits = self.bits
+        for idx in self._indexes(value):
+            if not bits[idx >> 3] & (1 << (idx & 7)):
+                return False
+        return True
+
+    def clear(self) -> None:
+        self.bits = bytearray(len(self.bits))
+        self.items_count = 0
+
+    def size_in_bytes(self) -> int:
+        return len(self.bits)
+
+
+class HyperLogLog:
+    """
+    Distinct values count estimation with a fixed memory of 2^precision bytes.
+    The relative standard error is 1.04/sqrt(2^precision) (ex: precision=14 -> 16 Ko, ~0.81%)
+    """
+    def __init__(self, precision: int = 14) -> None:
+        if not 4 <= precision <= 18:
+            raise RuntimeError('precision should be in [4, 18]')
+        self.precision = precision
+        self.registers_count = 1 << precision
+        self.registers = bytearray(self.registers_count)
+
+    @property
+    def relative_error(self) -> float:
+        return 1.04 / math.sqrt(self.registers_count)
+
+    def add(self, value: Any) -> None:
+        h = hash128(value)[0]
+        idx = h & (self.registers_count - 1)
+        rest = h >> self.precision
+        rank = (64 - self.precision) - rest.bit_length() + 1
+        if rank > self.registers[idx]:
+            self.registers[idx] = rank
+
+    def merge(self, other: 'HyperLogLog') -> 'HyperLogLog':
+        if other.precision != self.precision:
+            raise RuntimeError('Cannot merge HyperLogLog of different precisions : {} and {}'.format(self.precision, other.precision))
+        self.registers = bytearray(map(max, self.registers, other.registers))
+        return self
+
+    def count(self) -> int:
+        m = self.registers_count
+        if m >= 128:
+            alpha = 0.7213 / (1 + 1.079 / m)
+        else:
+            alpha = {16: 0.673, 32: 0.697, 64: 0.709}[m]
+        estimate = alpha * m * m / sum(2.0 ** -r for r in self.registers)
+        zeros = self.registers.count(0)
+        if estimate <= 2.5 * m and zeros > 0:
+            estimate = m * math.log(m / zeros)
+        return int(round(estimate))
+
+    def __len__(self) -> int:
+        return self.count()
+
+
+class HyperLogLogDistinctCounter:
+    def __init__(self, precision: int = 14) -> None:
+        """
+        Distinct count reducer for ReduceItemTransformer :
+            ReduceItemTransformer(..., initial_value=None, reducer=counter, finalizer=counter.finalize)
+
+        precision : HyperLogLog precision, memory per reduced item = 2^precision bytes, relative error = 1.04/sqrt(2^precision)
+        """
+        HyperLogLog(precision)
+        self.precision = precision
+
+    @property
+    def relative_error(self) -> float:
+        return 1.04 / math.sqrt(1 << self.precision)
+
+    def __call__(self, hll: HyperLogLog, value: Any) -> HyperLogLog:
+        if hll is None:
+            hll = HyperLogLog(self.precision)
+        hll.add(value)
+        return hll
+
+    def finalize(self, hll: HyperLogLog) -> int:
+        return hll.count() if hll is not None else 0
+
+
+class ExactTopK:
+    """
+    Exact counts (one counter per distinct key), memory grows with the distinct keys count
+    """
+    def __init__(self) -> None:
+        self.counts = {}
+
+    def add(self, key: Any, weight: int = 1) -> None:
+        counts = self.counts
+        counts[key] = counts.get(key, 0) + weight
+
+    def items(self) -> List[Tuple[Any, int]]:
+        return list(self.counts.items())
+
+    def top(self, k: int) -> List[Tuple[Any, int]]:
+        return heapq.nlargest(k, self.counts.items(), key=_count_of)
+
+    def __len__(self) -> int:
+        return len(self.counts)
+
+
+class _MinHeapCounters:
+    """
+    Counters dict with a lazy min heap (stale entries are skipped when popped), used to evict the smallest counter
+    """
+    def __init__(self, capacity: int) -> None:
+        self.capacity = max(1, capacity)
+        self.counts = {}
+        self.heap = []
+
+    def _push(self, key: Any, count: int) -> None:
+        heapq.heappush(self.heap, (count, key))
+        if len(self.heap) > 4 * self.capacity:
+            self.heap = [(c, k) for (k, c) in self.counts.items()]
+            heapq.heapify(self.heap)
+
+    def _min(self) -> Tuple[int, Any]:
+        heap = self.heap
+        while True:
+            (count, key) = heap[0]
+            if self.counts.get(key) == count:
+                return (count, key)
+            heapq.heappop(heap)
+
+    def items(self) -> List[Tuple[Any, int]]:
+        return list(self.counts.items())
+
+    def top(self, k: int) -> List[Tuple[Any, int]]:
+        return heapq.nlargest(k, self.counts.items(), key=_count_of)
+
+    def __len__(self) -> int:
+        return len(self.counts)
+
+
+class SpaceSaving(_MinHeapCounters):
+    """
+    Heavy hitters with capacity counters (Space-Saving algorithm) :
+    every key with a frequency > total/capacity is kept, a count overestimates the real one by at most total/capacity.
+    The keys should be orderable (ex: str).
+    """
+    def __init__(self, capacity: int = 1000) -> None:
+        super().__init__(capacity)
+
+    def add(self, key: Any, weight: int = 1) -> None:
+        counts = self.counts
+        if key in counts:
+            counts[key] += weight
+        elif len(counts) < self.capacity:
+            counts[key] = weight
+        else:
+            (min_count, min_key) = self._min()
+            heapq.heappop(self.heap)
+            del counts[min_key]
+            counts[key] = min_count + weight
+        self._push(key, counts[key])
+
+
+class CountMinSketch:
+    """
+    Frequency estimation with a fixed memory of width*depth counters,
+    an estimate overestimates the real count by at most e/width*total with a probability 1-exp(-depth)
+    """
+    def __init__(self, width: int = 2718, depth: int = 5) -> None:
+        self.width = max(1, width)
+        self.depth = max(1, depth)
+        self.rows = [[0] * self.width for _ in range(self.depth)]
+
+    def _indexes(self, key: Any):
+        (h1, h2) = hash128(key)
+        h2 |= 1
+        for i in range(self.depth):
+            yield (h1 + i * h2) % self.width
+
+    def add(self, key: Any, weight: int = 1) -> int:
+        """
+        Returns the new estimate of the key count
+        """
+        estimate = None
+        for (row, idx) in zip(self.rows, self._indexes(key)):
+            row[idx] += weight
+            estimate = row[idx] if estimate is None else min(estimate, row[idx])
+        return estimate
+
+    def estimate(self, key: Any) -> int:
+        return min([row[idx] for (row, idx) in zip(self.rows, self._indexes(key))])
+
+
+class CountMinTopK(_MinHeapCounters):
+    """
+    Heavy hitters using a CountMinSketch for the counts, and the capacity keys with the highest estimates as candidates.
+    The keys should be orderable (ex: str).
+    """
+    def __init__(self, capacity: int = 1000, width: int = 2718, depth: int = 5) -> None:
+        super().__init__(capacity)
+        self.sketch = CountMinSketch(width, depth)
+
+    def add(self, key: Any, weight: int = 1) -> None:
+        estimate = self.sketch.add(key, weight)
+        counts = self.counts
+        if key not in counts and len(counts) >= self.capacity:
+            (min_count, min_key) = self._min()
+            if estimate <= min_count:
+                return
+            heapq.heappop(self.heap)
+            del counts[min_key]
+        counts[key] = estimate
+        self._push(key, estimate)
+
+def _count_of(key_count: Tuple[Any, int]) -> int:
+    return key_count[1]
@@ -0,0 +1,284 @@
+import bisect
+import heapq
+from logging import INFO, Logger
+import multiprocessing
+import os
+import pickle
+import shutil
+import tempfile
+import time
+from typing import Any, Callable, Generator, Iterable, List, Tuple
+import uuid
+
+from tiny_etl.commons import AbstractConcurrentKeyBagSet, WithLogging
+from tiny_etl.sketches import BloomFilter
+
+SPARSE_INDEX_STEP = 64
+WRITE_BUFFER_SIZE = 1024*1024
+
+
+class SortedRun:
+    """
+    Sorted records file (pickled records), with a sparse index : the key of one record every SPARSE_INDEX_STEP records and its offset
+    """
+    def __init__(self, file_path: str, records_count: int, size_in_bytes: int, index_keys: List[Any], index_offsets: List[int]) -> None:
+        self.file_path = file_path
+        self.records_count = records_count
+        self.size_in_bytes = size_in_bytes
+        self.index_keys = index_keys
+        self.index_offsets = index_offsets
+
+    def __iter__(self) -> Generator[Any, None, None]:
+        with open(self.file_path, 'rb', buffering=WRITE_BUFFER_SIZE) as fh:
+            for _ in range(self.records_count):
+                yield pickle.load(fh)
+
+    def contains_key(self, key: Any, key_fn: Callable[[Any], Any] = None) -> bool:
+        """
+        Seeks to the block of the key using the sparse index, then reads at most SPARSE_INDEX_STEP records
+        """
+        pos = bisect.bisect_right(self.index_keys, key) - 1
+        if pos < 0:
+            return False
+        with open(self.file_path, 'rb') as fh:
+            fh.seek(self.index_offsets[pos])
+            for _ in range(min(SPARSE_INDEX_STEP, self.records_count - pos * SPARSE_INDEX_STEP)):
+                record = pickle.load(fh)
+                record_key = key_fn(record) if key_fn is not None else record
+                if record_key == key:
+                    return True
+                if record_key > key:
+                    return False
+        return False
+
+    def remove(self) -> None:
+        if os.path.isfile(self.file_path):
+            os.remove(self.file_path)
+
+
+def write_sorted_run(dir_path: str, records: Iterable[Any], key_fn: Callable[[Any], Any] = None) -> SortedRun:
+    """
+    records : already sorted records (by key_fn(record), or the record itself when key_fn is None)
+    """
+    file_path = os.path.join(dir_path, 'run_{}.bin'.format(uuid.uuid4().hex))
+    (count, index_keys, index_offsets) = (0, [], [])
+    with open(file_path, 'wb', buffering=WRITE_BUFFER_SIZE) as fh:
+        for record in records:
+            if count % SPARSE_INDEX_STEP == 0:
+                index_keys.append(key_fn(record) if key_fn is not None else record)
+                index_offsets.append(fh.tell())
+            pickle.dump(record, fh, protocol=pickle.HIGHEST_PROTOCOL)
+            count += 1
+        size = fh.tell()
+    return SortedRun(file_path, count, size, index_keys, index_offsets)
+
+def merge_sorted_runs(runs: List[Iterable[Any]], key_fn: Callable[[Any], Any] = None, reverse: bool = False) -> Generator[Any, None, None]:
+    """
+    k-way streaming merge, only one record per run is kept in memory
+    """
+    return heapq.merge(*runs, key=key_fn, reverse=reverse)
+
+
+class SpillStats:
+    def __init__(self) -> None:
+        self.runs = 0
+        self.records = 0
+        self.bytes = 0
+        self.merge_sec = 0.0
+
+    def add_run(self, run: SortedRun) -> None:
+        self.runs += 1
+        self.records += run.records_count
+        self.bytes += run.size_in_bytes
+
+    def __str__(self) -> str:
+        return "{} runs spilled, {} records, {} Mo, merge {} sec".format(self.runs, self.records, round(self.bytes/1024/1024, 3), round(self.merge_sec, 3))
+
+
+class SpillingKeyedAggregator:
+    def __init__(self, combiner: Callable[[Any, Any], Any], max_keys_in_memory: int = 1_000_000, spill_dir: str = None) -> None:
+        """
+        Keyed aggregation table with a bounded memory : past max_keys_in_memory keys, the table is written to disk as a sorted run.
+        items() merges the runs (k-way merge) and combines the values of the same key, the results are exact.
+
+        combiner           : fn(value_1, value_2) -> combined_value
+        max_keys_in_memory : int, None to never spill
+        spill_dir          : directory of the runs temp files, None for the system temp directory
+
+        The keys should be orderable (ex: str)
+        """
+        self.combiner = combiner
+        self.max_keys_in_memory = max(1, max_keys_in_memory) if max_keys_in_memory is not None else None
+        self.spill_dir = spill_dir
+        self.table = {}
+        self.runs = []
+        self.stats = SpillStats()
+        self.tmp_dir = None
+
+    def add(self, key: Any, value: Any) -> None:
+        table = self.table
+        if key in table:
+            table[key] = self.combiner(table[key], value)
+        else:
+            table[key] = value
+            if self.max_keys_in_memory is not None and len(table) >= self.max_keys_in_memory:
+                self.spill()
+
+    def spill(self) -> None:
+        if len(self.table) == 0:
+            return
+        if self.tmp_dir is None:
+            self.tmp_dir = tempfile.mkdtemp(prefix='spill_', dir=self.spill_dir)
+        run = write_sorted_run(self.tmp_dir, sorted(self.table.items(), key=_record_key), key_fn=_record_key)
+        self.stats.add_run(run)
+        self.runs.append(run)
+        self.table = {}
+
+    def __len__(self) -> int:
+        return len(self.table) + sum([run.records_count for run in self.runs])
+
+    def items(self) -> Generator[Tuple[Any, Any], None, None]:
+        """
+        Yields the (key, value) aggregates sorted by key when there are spilled runs, then clears the aggregator
+        """
+        if len(self.runs) == 0:
+            table = self.table
+            self.table = {}
+            yield from table.items()
+            return
+        start = time.perf_counter()
+        self.spill()
+        current = None
+        for (key, value) in merge_sorted_runs(self.runs, key_fn=_record_key):
+            if current is not None and current[0] == key:
+                current[1] = self.combiner(current[1], value)
+            else:
+                if current is not None:
+                    yield (current[0], current[1])
+                current = [key, value]
+        if current is not None:
+            yield (current[0], current[1])
+        self.stats.merge_sec += time.perf_counter() - start
+        self.clear()
+
+    def clear(self) -> None:
+        self.table = {}
+        for run in self.runs:
+            run.remove()
+        self.runs = []
+        if self.tmp_dir is not None:
+            shutil.rmtree(self.tmp_dir, ignore_errors=True)
+            self.tmp_dir = None
+
+def _record_key(record: Tuple[Any, Any]) -> Any:
+    return record[0]
+
+
+class SpillingKeyBagSet(WithLogging, AbstractConcurrentKeyBagSet):
+    def __init__(self, logger: Logger,
+                 lock: multiprocessing.Lock,
+                 max_values_in_memory: int = 1_000_000,
+                 spill_dir: str = None,
+                 max_runs_per_bag: int = 8) -> None:
+        """
+        Exact key bag set with a bounded memory : past max_values_in_memory values (all bags), the bags are written to disk as sorted runs.
+        A lookup checks the in memory set, then the runs of the bag (a BloomFilter per run skips most of them,
+        then the sparse index gives the block to read). The runs of a bag are compacted into one run past max_runs_per_bag.
+
+        lock                 : multiprocessing.Lock
+        max_values_in_memory : int
+        spill_dir            : directory of the runs temp files, None for the system temp directory
+        max_runs_per_bag     : int
+
+        The values should be orderable (ex: str)
+        """
+        super().__init__(logger)
+        self.lock = lock
+        self.max_values_in_memory = max(1, max_values_in_memory)
+        self.spill_dir = spill_dir
+        self.max_runs_per_bag = max(2, max_runs_per_bag)
+        self.content = dict()
+        self.runs = dict()
+        self.values_in_memory = 0
+        self.stats = SpillStats()
+        self.tmp_dir = None
+
+    def _in_runs(self, bag_key, value) -> bool:
+        for (bloom, run) in self.runs.get(bag_key, []):
+            if value in bloom and run.contains_key(value):
+                return True
+        return False
+
+    def _write_run(self, values: Iterable[Any], count: int) -> Tuple[BloomFilter, SortedRun]:
+        if self.tmp_dir is None:
+            self.tmp_dir = tempfile.mkdtemp(prefix='spill_', dir=self.spill_dir)
+        bloom = BloomFilter(max(1, count), 0.01)
+        def with_bloom():
+            for value in values:
+                bloom.add(value)
+                yield value
+        run = write_sorted_run(self.tmp_dir, with_bloom())
+        self.stats.add_run(run)
+        return (bloom, run)
+
+    def _spill(self) -> None:
+        for (bag_key, bag) in self.content.items():
+            if len(bag) == 0:
+                continue
+            bag_runs = self.runs.setdefault(bag_key, [])
+            bag_runs.append(self._write_run(sorted(bag), len(bag)))
+            if len(bag_runs) > self.max_runs_per_bag:
+                self._compact(bag_key)
+        self.content.clear()
+        self.values_in_memory = 0
+        super().log_msg("SpillingKeyBagSet : {}".format(str(self.stats)), level=INFO)
+
+    def _compact(self, bag_key) -> None:
+        start = time.perf_counter()
+        bag_runs = self.runs[bag_key]
+        count = sum([run.records_count for (_, run) in bag_runs])
+        # the runs of a bag are disjoint : a value is spilled only if it is absent from the previous runs
+        compacted = self._write_run(merge_sorted_runs([run for (_, run) in bag_runs]), count)
+        for (_, run) in bag_runs:
+            run.remove()
+        self.runs[bag_key] = [compacted]
+        self.stats.merge_sec += time.perf_counter() - start
+
+    def add_if_absent(self, bag_key, value) -> bool:
+        with self.lock:
+            bag = self.content.get(bag_key)
+            if bag is None:
+                bag = set()
+                self.content[bag_key] = bag
+            if value in bag or self._in_runs(bag_key, value):
+                return False
+            bag.add(value)
+            self.values_in_memory += 1
+            if self.values_in_memory >= self.max_values_in_memory:
+                self._spill()
+            return True
+
+    def clear(self, bag_key):
+        with self.lock:
+            bag = self.content.pop(bag_key, None)
+            if bag is not None:
+                self.values_in_memory -= len(bag)
+            for (_, run) in self.runs.pop(bag_key, []):
+                run.remove()
+
+    def clearAll(self):
+        with self.lock:
+            self.content.clear()
+            self.values_in_memory = 0
+            for bag_runs in self.runs.values():
+                for (_, run) in bag_runs:
+                    run.remove()
+            self.runs.clear()
+            if self.tmp_dir is not None:
+                shutil.rmtree(self.tmp_dir, ignore_errors=True)
+                self.tmp_dir = None
+
+    def contains(self, bag_key, value) -> bool:
+        with self.lock:
+            bag = self.content.get(bag_key)
+            return (bag is not None and value in bag) or self._in_runs(bag_key, value)
@@ -0,0 +1,92 @@
+import queue
+import time
+from typing import Any, List
+
+TRACE_KEY = '__trace__'
+TRACE_MAX_DESCENDANTS = 100
+TRACE_STAGES = ('in_queue', 'transform', 'out_queue', 'load', 'total')
+TRACE_MAX_SAMPLES = 100_000
+
+
+def start_trace(item: Any, trace_id: int) -> None:
+    """
+    Extractor side : attaches the trace to a sampled item
+    """
+    if type(item) is dict:
+        item[TRACE_KEY] = (trace_id, time.time())
+
+def pop_trace(item: Any) -> tuple:
+    """
+    Removes the trace from the item (the transformers and the loaders never see it)
+    """
+    if type(item) is dict:
+        return item.pop(TRACE_KEY, None)
+    return None
+
+def trace_descendant(trace: tuple, item: Any, transform_start: float) -> None:
+    """
+    Transformation side : the items yielded by the transformers for a sampled input item get its trace with the stages timestamps
+    """
+    if type(item) is dict:
+        (trace_id, extracted) = trace[0:2]
+        item[TRACE_KEY] = (trace_id, extracted, transform_start, time.time())
+
+def end_trace(trace: tuple, dequeued: float, trace_queue) -> None:
+    """
+    Loader side : called once the item is loaded, the span is sent to the pipeline process (dropped if the queue is full)
+    """
+    if trace is None or len(trace) < 4:
+        return
+    try:
+        trace_queue.put_nowait(trace + (dequeued, time.time()))
+    except queue.Full:
+        pass
+
+
+def percentile(sorted_values: List[float], p: float) -> float:
+    if len(sorted_values) == 0:
+        return 0.0
+    return sorted_values[min(len(sorted_values) - 1, int(round(p / 100 * (len(sorted_values) - 1))))]
+
+
+class TraceCollector:
+    """
+    Collects the spans (trace_id, extracted, transform_start, emitted, dequeued, loaded) sent by the loaders,
+    and computes the latency percentiles per stage :
+        in_queue  : waiting in the transformation pipelines queues
+        transform : transformers (including the previous descendants of the same item, the flat map is lazy)
+        out_queue : waiting in the loaders queues (including the push backpressure)
+        load      : loader load() call (the flushes happen in some of them)
+        total     : extracted -> loaded
+    """
+    def __init__(self, max_samples: int = TRACE_MAX_SAMPLES) -> None:
+        self.max_samples = max_samples
+        self.stages = {stage: [] for stage in TRACE_STAGES}
+        self.spans_count = 0
+        self.trace_ids = set()
+
+    def add(self, span: tuple) -> None:
+        (trace_id, extracted, transform_start, emitted, dequeued, loaded) = span
+        self.spans_count += 1
+        if len(self.trace_ids) < self.max_samples:
+            self.trace_ids.add(trace_id)
+        if self.spans_count > self.max_samples:
+            return
+        for (stage, duree) in zip(TRACE_STAGES, (transform_start - extracted, emitted - transform_start,
+                                                   dequeued - emitted, loaded - dequeued, loaded - extracted)):
+            self.stages[stage].append(duree)
+
+    def drain(self, trace_queue) -> None:
+        while True:
+            try:
+                self.add(trace_queue.get_nowait())
+            except queue.Empty:
+                return
+
+    def report(self) -> str:
+        lines = ["{} spans of {} sampled items (ms) :".format(self.spans_count, len(self.trace_ids))]
+        for stage in TRACE_STAGES:
+            values = sorted(self.stages[stage])
+            lines.append("  {:<10} p50={:>10.3f} p90={:>10.3f} p99={:>10.3f} max={:>10.3f}".format(
+                stage, *[percentile(values, p) * 1000 for p in (50, 90, 99, 100)]))
+        return "\n".join(lines)
@@ -1,14 +1,18 @@
 from functools import reduce
 from logging import Logger, ERROR, DEBUG, INFO
 from multiprocessing import Lock
+import operator
+import threading
 from typing import Any, AnyStr, Callable, Generator, Tuple, List
 from tiny_etl.commons import dict_deep_get
 from tiny_etl.commons import flatMapApply
 from tiny_etl.commons import dict_deep_remove
 from tiny_etl.commons import AbstractConcurrentKeyBagSet
 from tiny_etl.commons import ConcurrentKeyBagSet
+from tiny_etl.commons import SharedFingerprintKeyBagSet
+from tiny_etl.sketches import CountMinTopK, ExactTopK, SpaceSaving
 
-from tiny_etl.transformers.commons import AbstractTransformer
+from tiny_etl.transformers.commons import AbstractTransformer, new_item_context
 
 class ReduceItemTransformer(AbstractTransformer):
     def __init__(self, logger: Logger, 
@@ -18,7 +22,8 @@ class ReduceItemTransformer(AbstractTransformer):
                  initial_value: Any, 
                  reducer: Callable[[Any, Any], Any],
                  copy_values_key_paths: List[Tuple[str, List[AnyStr]]] = None,
-                 remove_key_paths: List[List[AnyStr]]=None) -> None:
+                 remove_key_paths: List[List[AnyStr]]=None,
+                 finalizer: Callable[[Any], Any] = None) -> None:
         """
         pattern               : str
         input_key_path        : Tuple[List[in_path], value_type]
@@ -29,11 +34,14 @@ class ReduceItemTransformer(AbstractTransformer):
                                     fn(initial_value, value) -> new_value
         copy_values_key_paths : List[Tuple[out_path, List[in_path]]]
         remove_key_paths      : List[List[in_path]]
+        finalizer             : function or method reference (lambda are not allowed) applied on the reduced value
+                                    fn(value) -> output_value (ex: HyperLogLogDistinctCounter.finalize)
         """
         super().__init__(logger, input_key_path[0], input_key_path[1], output_key, copy_values_key_paths, remove_key_paths)
         self.transformers = transformers
         self.initial_value = initial_value
         self.reducer = reducer
+        self.finalizer = finalizer
 
         for trans in self.transformers:
             if trans.input_key_path is None:
@@ -41,7 +49,7 @@ class ReduceItemTransformer(AbstractTransformer):
             if trans.output_key is None: 
                 trans.set_output_key('_')
 
-    def transform(self, item: dict, context: dict={}) -> Generator[dict, None, None]:
+    def transform(self, item: dict, context: dict = None) -> Generator[dict, None, None]:
         if item is None:
             return None
         input_value = dict_deep_get(item, self.input_key_path) if self.input_key_path is not None else item
@@ -53,11 +61,13 @@ class ReduceItemTransformer(AbstractTransformer):
             raise RuntimeError("Input value expected type : {}, is different from the given one : {}".format(self._input_value_type, type(input_value)))
         
         init_val = self.initial_value
+        if context is None:
+            context = new_item_context(item)
         for res in flatMapApply({'_': input_value}, list(map(lambda mapper: mapper.transform, self.transformers)), context=context):
             init_val = self.reducer(init_val, dict_deep_get(res, ['_']))
         item_ = {}
         item_ = AbstractTransformer._copy_input_values_to_output(self.copy_values_key_paths, item_, item)
-        item_[self.output_key] = init_val
+        item_[self.output_key] = self.finalizer(init_val) if self.finalizer is not None else init_val
         yield item_
 
     def _map_item(self, item, context: dict = {}) -> Generator[dict, None, None]:
@@ -69,22 +79,29 @@ class ReduceItemTransformer(AbstractTransformer):
 
 
 class UniqueFilterTransformer(AbstractTransformer):
+    GLOBAL_BAG_KEY = '__global__'
+
     def __init__(self, logger: Logger, 
                     bag_key_path: Tuple[List[AnyStr], Any],
                     unique_key_path: Tuple[List[AnyStr], Any],
                     transformers: List[AbstractTransformer],
                     bag: AbstractConcurrentKeyBagSet = None,
                     unique_value_normalizers: List[Callable[[Any], Any]] = [],
-                    yield_unique_values: bool=True) -> None:
+                    yield_unique_values: bool=True,
+                    clear_bag: bool=True) -> None:
         """
         This is a wrapper transformer class :
 
         bag_key_path              : Tuple[List[in_path], value_type] in the context of the first transformer among the transformers list
+                                    None to use one bag for all the items
         unique_key_path           : Tuple[List[in_path], value_type] in the context of the last transformer among the transformers list
         unique_value_normalizers  : functions or methods ref that takes the value as input and return a new value
         transformers              : List[? extends AbstractTransformer]
         bag                       : AbstractConcurrentKeyBagSet
         yield_unique_values       : True to yield unique values, False otherwise
+        clear_bag                 : True to clear the bag before and after each item,
+                                    False to keep the values across items (ex: corpus wide uniqueness using a SharedFingerprintKeyBagSet).
+                                    It should be False with a SharedFingerprintKeyBagSet (each clear scans the whole shared table)
         """
         super().__init__(logger, None, None, None, None, None)
         self.bag_key_path = bag_key_path
@@ -93,25 +110,35 @@ class UniqueFilterTransformer(AbstractTransformer):
         self.bag = bag if bag is not None else ConcurrentKeyBagSet(Lock())
         self.transformers = transformers
         self.yield_unique_values = yield_unique_values
+        self.clear_bag = clear_bag
 
         if transformers is None:
             raise RuntimeError('transformers arg cannot be None')
 
-    def transform(self, item: dict, context: dict = {}) -> Generator[dict, None, None]:
+        if clear_bag and isinstance(self.bag, SharedFingerprintKeyBagSet):
+            raise RuntimeError('clear_bag should be False with a SharedFingerprintKeyBagSet bag')
+
+    def transform(self, item: dict, context: dict = None) -> Generator[dict, None, None]:
         item = AbstractTransformer._copy_input_values_to_output(self.copy_values_key_paths, item, item)
         if self.remove_key_paths is not None:
             for remove_key_path in self.remove_key_paths:
                 dict_deep_remove(item, remove_key_path)
 
-        bag_key = dict_deep_get(item, self.bag_key_path[0])
-        if bag_key is None:
-            raise RuntimeError('{} key path not found in the item'.format(self.bag_key_path[0]))
+        if self.bag_key_path is None:
+            bag_key = UniqueFilterTransformer.GLOBAL_BAG_KEY
+        else:
+            bag_key = dict_deep_get(item, self.bag_key_path[0])
+            if bag_key is None:
+                raise RuntimeError('{} key path not found in the item'.format(self.bag_key_path[0]))
 
-        if not isinstance(bag_key, self.bag_key_path[1]):
-            raise RuntimeError('{} bag key path should have the type {}, but {} was given'.format(self.bag_key_path[0], self.bag_key_path[1], type(bag_key)))
+            if not isinstance(bag_key, self.bag_key_path[1]):
+                raise RuntimeError('{} bag key path should have the type {}, but {} was given'.format(self.bag_key_path[0], self.bag_key_path[1], type(bag_key)))
 
-        self.bag.clear(bag_key)
+        if self.clear_bag:
+            self.bag.clear(bag_key)
 
+        if context is None:
+            context = new_item_context(item)
         for res in flatMapApply(item, list(map(lambda mapper: mapper.transform, self.transformers)), context=context):
             unique_key = dict_deep_get(res, self.unique_key_path[0])
             if unique_key is None:
@@ -126,7 +153,231 @@ class UniqueFilterTransformer(AbstractTransformer):
 
                 if not (self.yield_unique_values ^ self.bag.add_if_absent(bag_key, unique_key)):
                     yield res
-        self.bag.clear(bag_key)
+        if self.clear_bag:
+            self.bag.clear(bag_key)
+
+    def _map_item(self, item, context: dict = {}) -> Generator[dict, None, None]:
+        yield item
+
+
+class GroupByAggregateTransformer(AbstractTransformer):
+    def __init__(self, logger: Logger,
+                 key_path: Tuple[List[AnyStr], Any],
+                 output_key: str,
+                 value_key_path: List[AnyStr] = None,
+                 combiner: Callable[[Any, Any], Any] = operator.add,
+                 key_output_key: str = 'key',
+                 key_normalizers: List[Callable[[Any], Any]] = [],
+                 max_keys: int = 100_000,
+                 flush_every_items: int = None) -> None:
+        """
+        Worker side combiner : aggregates the items by key in a local table (one per transformation pipeline)
+        and yields partial aggregates {key_output_key: key, output_key: value} instead of the items,
+        the partial aggregates of all the pipelines are merged by a GroupByMergeLoader.
+
+        key_path          : Tuple[List[in_path], value_type]
+        output_key        : str
+        value_key_path    : List[in_path] of the value to aggregate, None to count the items (value = 1)
+        combiner          : function or method reference (lambda are not allowed)
+                                fn(value_1, value_2) -> combined_value (ex: operator.add)
+        key_output_key    : str
+        key_normalizers   : functions or methods ref that takes the key as input and return a new key (ex: str.lower)
+        max_keys          : the table is flushed when it contains max_keys keys (memory bound)
+        flush_every_items : the table is flushed every flush_every_items items, None to flush only on max_keys and at the end of the stream
+
+        It should be in the pipeline transformers list (not inside a wrapper transformer like ReduceItemTransformer),
+        so the remaining partial aggregates are flushed at the end of the stream.
+        """
+        super().__init__(logger, key_path[0], key_path[1], output_key, None, None)
+        self.value_key_path = value_key_path
+        self.combiner = combiner
+        self.key_output_key = key_output_key
+        self.key_normalizers = [kn for kn in key_normalizers if kn is not None]
+        self.max_keys = max(1, max_keys)
+        self.flush_every_items = flush_every_items
+        self.table = {}
+        self.items_count = 0
+        self.flushed_count = 0
+        self.lock = threading.Lock()
+
+        if combiner is None:
+            raise RuntimeError('combiner arg cannot be None')
+
+    def __getstate__(self):
+        state = self.__dict__.copy()
+        del state['lock']
+        return state
+
+    def __setstate__(self, state):
+        self.__dict__.update(state)
+        self.lock = threading.Lock()
+
+    def transform(self, item: dict, context: dict = None) -> Generator[dict, None, None]:
+        if item is None:
+            return None
+        key = dict_deep_get(item, self.input_key_path)
+        if key is None:
+            raise RuntimeError("Item doesn't contains the key_path={}".format('.'.join(self.input_key_path)))
+        if not isinstance(key, self._input_value_type):
+            raise RuntimeError("Key expected type : {}, is different from the given one : {}".format(self._input_value_type, type(key)))
+        key = reduce(lambda val, kn: kn(val), self.key_normalizers, key)
+
+        if self.value_key_path is None:
+            value = 1
+        else:
+            value = dict_deep_get(item, self.value_key_path)
+            if value is None:
+                raise RuntimeError("Item doesn't contains the value_key_path={}".format('.'.join(self.value_key_path)))
+
+        with self.lock:
+            table = self.table
+            if key in table:
+                table[key] = self.combiner(table[key], value)
+            else:
+                table[key] = value
+            self.items_count += 1
+            must_flush = len(table) >= self.max_keys or \
+                            (self.flush_every_items is not None and self.items_count % self.flush_every_items == 0)
+            if must_flush:
+                self.table = {}
+        if must_flush:
+            yield from self._partial_aggregates(table)
+
+    def _partial_aggregates(self, table: dict) -> Generator[dict, None, None]:
+        self.flushed_count += len(table)
+        for (key, value) in table.items():
+            yield {self.key_output_key: key, self.output_key: value}
+
+    def _map_item(self, item, context: dict = {}) -> Generator[dict, None, None]:
+        yield item
+
+    def flush(self) -> Generator[dict, None, None]:
+        with self.lock:
+            table = self.table
+            self.table = {}
+        yield from self._partial_aggregates(table)
+        super().log_msg("GroupBy {} : {} items combined into {} partial aggregates".format(self.output_key, self.items_count, self.flushed_count), level=INFO)
+
+
+class TopKTransformer(AbstractTransformer):
+    MODES = ('exact', 'space_saving', 'count_min')
+
+    def __init__(self, logger: Logger,
+                 key_path: Tuple[List[AnyStr], Any],
+                 k: int,
+                 transformers: List[AbstractTransformer] = None,
+                 mode: str = 'exact',
+                 capacity: int = None,
+                 weight_key_path: List[AnyStr] = None,
+                 key_output_key: str = 'key',
+                 count_output_key: str = 'count',
+                 rank_output_key: str = 'rank',
+                 key_normalizers: List[Callable[[Any], Any]] = [],
+                 copy_values_key_paths: List[Tuple[str, List[AnyStr]]] = None,
+                 count_min_width: int = 2718,
+                 count_min_depth: int = 5) -> None:
+        """
+        Top K keys by count (ex: most frequent words), two scopes :
+          - per item (transformers not None) : the transformers are applied on each item (like ReduceItemTransformer)
+                and the top K keys of the results are yielded at the end of the item (ex: top words per file)
+          - global (transformers None) : the items are counted in the transformation pipeline,
+                the counts are yielded at the end of the stream and merged by a TopKMergeLoader
+
+        key_path              : Tuple[List[in_path], value_type] (in the results of the transformers for the per item scope)
+        k                     : int
+        transformers          : List[? extends AbstractTransformer], None for the global scope
+        mode                  : 'exact' (counter per distinct key, the global scope yields all the counts),
+                                'space_saving' or 'count_min' (bounded memory : capacity candidates, the counts are over estimated)
+                                (the per pipeline streams are merged, so the global scope error grows with the pipelines count)
+        capacity              : candidates count of the sketches modes, default to max(1000, 100*k)
+        weight_key_path       : List[in_path] of the count to add, None to count 1 per item
+        key_output_key        : str
+        count_output_key      : str
+        rank_output_key       : str (per item scope only)
+        key_normalizers       : functions or methods ref that takes the key as input and return a new key (ex: str.lower)
+        copy_values_key_paths : List[Tuple[out_path, List[in_path]]] values copied from the input item (per item scope only)
+        count_min_width       : CountMinSketch width (error ~ e/width*total)
+        count_min_depth       : CountMinSketch depth (error probability ~ exp(-depth))
+        """
+        super().__init__(logger, key_path[0], key_path[1], None, copy_values_key_paths, None)
+        self.k = max(1, k)
+        self.transformers = transformers
+        self.mode = mode
+        self.capacity = capacity if capacity is not None else max(1000, 100 * self.k)
+        self.weight_key_path = weight_key_path
+        self.key_output_key = key_output_key
+        self.count_output_key = count_output_key
+        self.rank_output_key = rank_output_key
+        self.key_normalizers = [kn for kn in key_normalizers if kn is not None]
+        self.count_min_width = count_min_width
+        self.count_min_depth = count_min_depth
+        self.counter = self._make_counter()
+        self.lock = threading.Lock()
+
+        if mode not in TopKTransformer.MODES:
+            raise RuntimeError('Unknown mode {}, available : {}'.format(mode, ', '.join(TopKTransformer.MODES)))
+
+    def __getstate__(self):
+        state = self.__dict__.copy()
+        del state['lock']
+        return state
+
+    def __setstate__(self, state):
+        self.__dict__.update(state)
+        self.lock = threading.Lock()
+
+    def _make_counter(self):
+        if self.mode == 'space_saving':
+            return SpaceSaving(self.capacity)
+        if self.mode == 'count_min':
+            return CountMinTopK(self.capacity, self.count_min_width, self.count_min_depth)
+        return ExactTopK()
+
+    def _key_weight(self, item: dict) -> Tuple[Any, int]:
+        key = dict_deep_get(item, self.input_key_path)
+        if key is None:
+            raise RuntimeError("Item doesn't contains the key_path={}".format('.'.join(self.input_key_path)))
+        if not isinstance(key, self._input_value_type):
+            raise RuntimeError("Key expected type : {}, is different from the given one : {}".format(self._input_value_type, type(key)))
+        key = reduce(lambda val, kn: kn(val), self.key_normalizers, key)
+        weight = dict_deep_get(item, self.weight_key_path) if self.weight_key_path is not None else 1
+        if weight is None:
+            raise RuntimeError("Item doesn't contains the weight_key_path={}".format('.'.join(self.weight_key_path)))
+        return (key, weight)
+
+    def transform(self, item: dict, context: dict = None) -> Generator[dict, None, None]:
+        if item is None:
+            return None
+        if self.transformers is None:
+            (key, weight) = self._key_weight(item)
+            with self.lock:
+                self.counter.add(key, weight)
+            return
+
+        counter = self._make_counter()
+        if context is None:
+            context = new_item_context(item)
+        for res in flatMapApply(item, list(map(lambda mapper: mapper.transform, self.transformers)), context=context):
+            (key, weight) = self._key_weight(res)
+            counter.add(key, weight)
+        for (rank, (key, count)) in enumerate(counter.top(self.k)):
+            item_ = {}
+            item_ = AbstractTransformer._copy_input_values_to_output(self.copy_values_key_paths, item_, item)
+            item_[self.key_output_key] = key
+            item_[self.count_output_key] = count
+            item_[self.rank_output_key] = rank + 1
+            yield item_
 
     def _map_item(self, item, context: dict = {}) -> Generator[dict, None, None]:
-        yield item
\ No newline at end of file
+        yield item
+
+    def flush(self) -> Generator[dict, None, None]:
+        if self.transformers is not None:
+            return
+        with self.lock:
+            counter = self.counter
+            self.counter = self._make_counter()
+        # the exact mode yields all the counts, so the merged top K is exact
+        candidates = counter.items() if self.mode == 'exact' else counter.top(self.capacity)
+        for (key, count) in candidates:
+            yield {self.key_output_key: key, self.count_output_key: count}
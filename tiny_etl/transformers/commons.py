@@ -6,6 +6,15 @@ from tiny_etl.commons import dict_deep_get
 from tiny_etl.commons import dict_deep_remove
 
 IgnoreTransformationResult = object()
+ITEM_CACHE_CONTEXT_KEY = '__item_cache__'
+EXTRACTED_ITEM_CONTEXT_KEY = '__extracted_item__'
+
+
+def new_item_context(item: dict) -> dict:
+    """
+    Context shared by the transformers (the nested ones included) while one extracted item is transformed
+    """
+    return {EXTRACTED_ITEM_CONTEXT_KEY: item}
 
 class AbstractTransformer(WithLogging):
     def __init__(self, logger: Logger, 
@@ -13,13 +22,21 @@ class AbstractTransformer(WithLogging):
                 input_value_type: Any,
                 output_key: str,
                 copy_values_key_paths: List[Tuple[str, List[AnyStr]]] = None,
-                remove_key_paths: List[List[AnyStr]]=None) -> None:
+                remove_key_paths: List[List[AnyStr]]=None,
+                memoize: bool = False) -> None:
+        """
+        memoize : True to cache the _map_item results in the context of the item being processed by the transformation pipeline,
+                  so the same sub-computation (ex: reading the same file) is done once when it appears in many nested chains.
+                  The cache is released when the item finishes. It requires _memo_key() to be implemented,
+                  transform() calls without a context are not memoized.
+        """
         super().__init__(logger)
         self.input_key_path = input_key_path
         self.output_key = output_key
         self._input_value_type = input_value_type
         self.copy_values_key_paths = copy_values_key_paths
         self.remove_key_paths = remove_key_paths
+        self.memoize = memoize
 
     @staticmethod
     def _copy_input_values_to_output(copy_values_key_paths: List[Tuple[str, List[AnyStr]]], dest: dict, source: dict):
@@ -30,7 +47,7 @@ class AbstractTransformer(WithLogging):
                     dest[key] = x
         return dest
 
-    def transform(self, item: dict, context: dict={}) -> Generator[dict, None, None]:
+    def transform(self, item: dict, context: dict = None) -> Generator[dict, None, None]:
         if item is None:
             return None
         input_value = dict_deep_get(item, self.input_key_path) if self.input_key_path is not None else item
@@ -41,8 +58,14 @@ class AbstractTransformer(WithLogging):
         if not isinstance(input_value, self._input_value_type):
             raise RuntimeError("Input value expected type : {}, is different from the given one : {}".format(self._input_value_type, type(input_value)))
         
+        memoize = self.memoize
+        if context is None:
+            # no per item context (called outside of a transformation pipeline) : nowhere to release the cache, not memoized
+            context = new_item_context(item)
+            memoize = False
         context['__input_item__'] = item
-        for res in self._map_item(input_value, context):
+        results = self._memoized_map_item(input_value, context) if memoize else self._map_item(input_value, context)
+        for res in results:
             if res != IgnoreTransformationResult:
                 item_ = {}
                 item_ = AbstractTransformer._copy_input_values_to_output(self.copy_values_key_paths, item_, item)
@@ -52,7 +75,7 @@ class AbstractTransformer(WithLogging):
                 item_[self.output_key] = res
                 yield item_
             else:
-                super().log_msg("Result ignored <IgnoreTransformationResult> : {}".format(str(res)))
+                super().log_msg_sampled("Result ignored <IgnoreTransformationResult> by <%s>", args=(self.__class__.__name__,))
         if "__input_item__" in context:
             del context["__input_item__"]
 
@@ -60,6 +83,45 @@ class AbstractTransformer(WithLogging):
     def _map_item(self, item, context: dict={}) -> Generator[dict, None, None]:
         pass
 
+    def _memo_key(self) -> Any:
+        """
+        Hashable value identifying the transformer configuration used by _map_item,
+        two transformers with the same key yield the same results for the same input value.
+        None if the results can't be memoized.
+        """
+        return None
+
+    def _memoized_map_item(self, input_value, context: dict) -> Generator[dict, None, None]:
+        memo_key = self._memo_key()
+        try:
+            key = (memo_key, input_value)
+            hash(key)
+        except TypeError:
+            memo_key = None
+        if memo_key is None:
+            yield from self._map_item(input_value, context)
+            return
+
+        cache = context.get(ITEM_CACHE_CONTEXT_KEY)
+        if cache is None:
+            cache = {}
+            context[ITEM_CACHE_CONTEXT_KEY] = cache
+        results = cache.get(key)
+        if results is None:
+            results = [res for res in self._map_item(input_value, context)]
+            cache[key] = results
+        for res in results:
+            # the next transformers may update the yielded dicts
+            yield dict(res) if type(res) is dict else res
+
+    def flush(self) -> Generator[dict, None, None]:
+        """
+        Called by each transformation pipeline at the end of the stream, on the transformers of the pipeline transformers list.
+        Yields the items buffered by the transformer (ex: GroupByAggregateTransformer partial aggregates),
+        they are passed to the next transformers of the list.
+        """
+        return iter(())
+
     def close(self) -> None:
         super().log_msg("Closing loader <>".format(__class__.__name__), level=INFO)
 
@@ -81,9 +143,9 @@ class OneToOneNoopTransformer(AbstractTransformer):
         self.log_level = log_level
         self.log_prefix = log_prefix
 
-    def transform(self, item: dict, context: dict={}) -> Generator[dict, None, None]:
+    def transform(self, item: dict, context: dict = None) -> Generator[dict, None, None]:
         if self.log:
-            super().log_msg("{} {}".format(self.log_prefix, str(item)),level=self.log_level)
+            super().log_msg_sampled("%s %s", level=self.log_level, args=(self.log_prefix, item))
         yield item
 
     def _map_item(self, item, context: dict = {}) -> Generator[dict, None, None]:
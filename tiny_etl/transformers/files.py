@@ -1,8 +1,10 @@
 from abc import abstractmethod
 import codecs
+import io
 from functools import reduce
 from logging import Logger, ERROR, DEBUG, INFO
 from multiprocessing import Lock
+import mmap
 import os
 from typing import Any, AnyStr, Callable, Generator, Tuple, List
 from tiny_etl.commons import WithLogging
@@ -11,7 +13,62 @@ from tiny_etl.commons import flatMapApply
 from tiny_etl.commons import dict_deep_remove
 from tiny_etl.commons import AbstractConcurrentKeyBagSet
 from tiny_etl.commons import ConcurrentKeyBagSet
-from tiny_etl.transformers.commons import AbstractTransformer
+from tiny_etl.compression import detect_compression, open_input_file, strip_compression_suffix
+from tiny_etl.transformers.commons import AbstractTransformer, EXTRACTED_ITEM_CONTEXT_KEY
+from tiny_etl.transformers.commons import IgnoreTransformationResult
+
+LINE_BOUNDARIES = '\n\r\x0b\x0c\x1c\x1d\x1e\x85\u2028\u2029'
+
+
+def is_tombstone(context: dict, tombstone_key: str) -> bool:
+    """
+    True if the item being transformed, or the extracted item it comes from (nested transformers, ex: ReduceItemTransformer),
+    is a deleted file yielded by IncrementalFilesExtractor(emit_tombstones=True)
+    """
+    if tombstone_key is None:
+        return False
+    for key in ('__input_item__', EXTRACTED_ITEM_CONTEXT_KEY):
+        item = context.get(key)
+        if type(item) is dict and item.get(tombstone_key) is True:
+            return True
+    return False
+
+def iter_file_text_blocks(file_path: str, 
+                          buffer_size: int, 
+                          encoding: str = "utf-8", 
+                          errors: str = "strict", 
+                          use_mmap: bool = False,
+                          decompress: bool = False) -> Generator[str, None, None]:
+    """
+    Yields the decoded text of the file by blocks of at most buffer_size bytes.
+    The bytes are read using one reusable buffer (or a mmap view) and decoded incrementally,
+    so the memory used doesn't depend on the file size.
+    decompress : True to decompress gzip, bz2 and xz files on the fly (in a separate thread), mmap isn't used for them
+    """
+    decoder = codecs.getincrementaldecoder(encoding)(errors)
+    compressed = decompress and detect_compression(file_path) is not None
+    with open_input_file(file_path, decompress=compressed, block_size=buffer_size) as fh:
+        if use_mmap and not compressed and os.fstat(fh.fileno()).st_size > 0:
+            with mmap.mmap(fh.fileno(), 0, access=mmap.ACCESS_READ) as mm:
+                size = len(mm)
+                for offset in range(0, size, buffer_size):
+                    text = decoder.decode(mm[offset:offset + buffer_size])
+                    if text:
+                        yield text
+        else:
+            buffer = bytearray(buffer_size)
+            view = memoryview(buffer)
+            while True:
+                n = fh.readinto(buffer)
+                if not n:
+                    break
+                text = decoder.decode(view[:n])
+                if text:
+                    yield text
+            view.release()
+    text = decoder.decode(b'', final=True)
+    if text:
+        yield text
 
 
 class FileToTextLinesTransformer(AbstractTransformer):
@@ -20,29 +77,50 @@ class FileToTextLinesTransformer(AbstractTransformer):
                  input_key_path: List[AnyStr], 
                  output_key: str,
                  copy_values_key_paths: List[Tuple[str, List[AnyStr]]] = None,
-                 remove_key_paths: List[List[AnyStr]]=None) -> None:
+                 remove_key_paths: List[List[AnyStr]]=None,
+                 check_file_exists: bool = True,
+                 memoize: bool = False,
+                 decompress: bool = False,
+                 tombstone_key: str = 'deleted') -> None:
         """
         pattern               : str
         input_key_path        : List[in_path]
         output_key            : str
         copy_values_key_paths : List[Tuple[out_path, List[in_path]]]
         remove_key_paths      : List[List[in_path]]
+        check_file_exists     : False to skip the os.path.isfile call (ex: files listed by ScandirFilesExtractor)
+        memoize               : True to read the file once per item, even if it is read in many nested chains
+        decompress            : True to read gzip, bz2 and xz files (ex: file.txt.gz matches the pattern .txt)
+        tombstone_key         : the items with tombstone_key=True (deleted files, IncrementalFilesExtractor) are skipped
 
         Yield elements : {line: str}
         """
-        super().__init__(logger, input_key_path, (str), output_key, copy_values_key_paths, remove_key_paths)
+        super().__init__(logger, input_key_path, (str), output_key, copy_values_key_paths, remove_key_paths, memoize)
         self.pattern = pattern
+        self.check_file_exists = check_file_exists
+        self.tombstone_key = tombstone_key
+        self.decompress = decompress
+
+    def _memo_key(self):
+        return (FileToTextLinesTransformer, self.pattern, self.decompress)
 
     def _map_item(self, file_path: str, context: dict = {}) -> Generator[dict, None, None]:
-        if not os.path.isfile(file_path):
+        if is_tombstone(context, self.tombstone_key):
+            return IgnoreTransformationResult
+
+        if self.check_file_exists and not os.path.isfile(file_path):
             raise RuntimeError("File not found {}".format(file_path))
         
-        if not file_path.endswith(self.pattern):
+        if not (strip_compression_suffix(file_path) if self.decompress else file_path).endswith(self.pattern):
             super().log_msg("File {} should ends with {}".format(file_path, self.pattern))
             return IgnoreTransformationResult
 
         try:
-            with codecs.open(file_path, mode="r", encoding="utf-8") as fh:
+            if self.decompress and detect_compression(file_path) is not None:
+                fh = io.TextIOWrapper(io.BufferedReader(open_input_file(file_path, decompress=True)), encoding="utf-8")
+            else:
+                fh = codecs.open(file_path, mode="r", encoding="utf-8")
+            with fh:
                 while True:
                     line = fh.readline()
                     if not line:
@@ -59,30 +137,259 @@ class FileTextReaderTransformer(AbstractTransformer):
                  input_key_path: List[AnyStr], 
                  output_key: str,
                  copy_values_key_paths: List[Tuple[str, List[AnyStr]]] = None,
-                 remove_key_paths: List[List[AnyStr]]=None) -> None:
+                 remove_key_paths: List[List[AnyStr]]=None,
+                 check_file_exists: bool = True,
+                 memoize: bool = False,
+                 decompress: bool = False,
+                 tombstone_key: str = 'deleted') -> None:
         """
         pattern                 : str
         input_key_path          : List[in_path]
         output_key              : str
         copy_values_key_paths   : List[Tuple[out_path, List[in_path]]]
         remove_key_paths        : List[List[in_path]]
+        check_file_exists       : False to skip the os.path.isfile call (ex: files listed by ScandirFilesExtractor)
+        memoize                 : True to read the file once per item, even if it is read in many nested chains
+        decompress              : True to read gzip, bz2 and xz files (ex: file.txt.gz matches the pattern .txt)
+        tombstone_key           : the items with tombstone_key=True (deleted files, IncrementalFilesExtractor) are skipped
 
         Yield elements : {content: str}
         """
-        super().__init__(logger, input_key_path, (str), output_key, copy_values_key_paths, remove_key_paths)
+        super().__init__(logger, input_key_path, (str), output_key, copy_values_key_paths, remove_key_paths, memoize)
         self.pattern = pattern
+        self.check_file_exists = check_file_exists
+        self.tombstone_key = tombstone_key
+        self.decompress = decompress
+
+    def _memo_key(self):
+        return (FileTextReaderTransformer, self.pattern, self.decompress)
 
     def _map_item(self, file_path: str, context: dict = {}) -> Generator[dict, None, None]:
-        if not os.path.isfile(file_path):
+        if is_tombstone(context, self.tombstone_key):
+            return IgnoreTransformationResult
+
+        if self.check_file_exists and not os.path.isfile(file_path):
             raise RuntimeError("File not found {}".format(file_path))
         
-        if not file_path.endswith(self.pattern):
+        if not (strip_compression_suffix(file_path) if self.decompress else file_path).endswith(self.pattern):
             super().log_msg("File {} should ends with {}".format(file_path, self.pattern))
             return IgnoreTransformationResult
 
         try:
-            with codecs.open(file_path, mode="r", encoding="utf-8") as fh:
-                yield {'content': fh.read()}
+            if self.decompress and detect_compression(file_path) is not None:
+                yield {'content': ''.join(iter_file_text_blocks(file_path, 1024*1024, decompress=True))}
+            else:
+                with codecs.open(file_path, mode="r", encoding="utf-8") as fh:
+                    yield {'content': fh.read()}
                         
         except Exception as e:
             super().log_msg("File error {} : {}".format(file_path, str(e.args)), exception=e, level=ERROR)
+
+class FileByteRangeReaderTransformer(AbstractTransformer):
+    def __init__(self, logger: Logger, 
+                 input_key_path: List[AnyStr], 
+                 output_key: str,
+                 encoding: str = "utf-8",
+                 errors: str = "strict",
+                 copy_values_key_paths: List[Tuple[str, List[AnyStr]]] = None,
+                 remove_key_paths: List[List[AnyStr]]=None) -> None:
+        """
+        input_key_path          : List[in_path] of the range dict yielded by FileByteRangesExtractor
+        output_key              : str
+        encoding                : str
+        errors                  : decode errors policy ('strict', 'replace', 'ignore')
+        copy_values_key_paths   : List[Tuple[out_path, List[in_path]]]
+        remove_key_paths        : List[List[in_path]]
+
+        The whitespaces at the cut edges of the range are removed, so tokenizing all the ranges gives the words of the whole file.
+        The compressed files (gzip, bz2, xz) are yielded by FileByteRangesExtractor as one range, they are decompressed and read whole
+        (use FileTextBlocksReaderTransformer(decompress=True) for big compressed files, its memory is bounded).
+        Yield elements : {content: str}
+        """
+        super().__init__(logger, input_key_path, (dict), output_key, copy_values_key_paths, remove_key_paths)
+        self.encoding = encoding
+        self.errors = errors
+
+    def _map_item(self, byte_range: dict, context: dict = {}) -> Generator[dict, None, None]:
+        file_path = byte_range['file_path']
+        (start, end) = (byte_range['start'], byte_range['end'])
+        try:
+            compression = byte_range['compression'] if 'compression' in byte_range else detect_compression(file_path)
+            if compression is not None and byte_range['chunk_idx'] > 0:
+                super().log_msg("Compressed file {} is read by its first range only".format(file_path), level=ERROR)
+                return
+            if compression is not None:
+                # one range per compressed file (FileByteRangesExtractor)
+                content = ''.join(iter_file_text_blocks(file_path, 4*1024*1024, self.encoding, self.errors, decompress=True))
+            else:
+                with open(file_path, mode="rb") as fh:
+                    fh.seek(start)
+                    content = fh.read(end - start).decode(self.encoding, self.errors)
+        except Exception as e:
+            super().log_msg("File error {} : {}".format(file_path, str(e.args)), exception=e, level=ERROR)
+            return
+        if byte_range['chunk_idx'] > 0:
+            content = content.lstrip()
+        if byte_range['chunk_idx'] < byte_range['chunks_count'] - 1:
+            content = content.rstrip()
+        yield {'content': content}
+
+class FileTextBlocksReaderTransformer(AbstractTransformer):
+    def __init__(self, logger: Logger, 
+                 pattern: str, 
+                 input_key_path: List[AnyStr], 
+                 output_key: str,
+                 block_size: int = 4*1024*1024,
+                 use_mmap: bool = False,
+                 encoding: str = "utf-8",
+                 errors: str = "strict",
+                 copy_values_key_paths: List[Tuple[str, List[AnyStr]]] = None,
+                 remove_key_paths: List[List[AnyStr]]=None,
+                 check_file_exists: bool = True,
+                 memoize: bool = False,
+                 decompress: bool = False,
+                 tombstone_key: str = 'deleted') -> None:
+        """
+        pattern                 : str
+        input_key_path          : List[in_path]
+        output_key              : str
+        block_size              : bytes read and decoded at once
+        use_mmap                : True to read the file through mmap, False to use a reusable readinto buffer
+        encoding                : str
+        errors                  : decode errors policy ('strict', 'replace', 'ignore')
+        copy_values_key_paths   : List[Tuple[out_path, List[in_path]]]
+        remove_key_paths        : List[List[in_path]]
+        check_file_exists       : False to skip the os.path.isfile call (ex: files listed by ScandirFilesExtractor)
+        memoize                 : True to read the file once per item, even if it is read in many nested chains
+        decompress              : True to read gzip, bz2 and xz files (ex: file.txt.gz matches the pattern .txt)
+        tombstone_key           : the items with tombstone_key=True (deleted files, IncrementalFilesExtractor) are skipped
+
+        The blocks are cut on whitespaces, so a word is never split between two blocks (unless it is longer than block_size).
+        It can replace FileTextReaderTransformer for big files, the memory used is bounded by block_size.
+        Yield elements : {content: str}
+        """
+        super().__init__(logger, input_key_path, (str), output_key, copy_values_key_paths, remove_key_paths, memoize)
+        self.pattern = pattern
+        self.block_size = max(1024, block_size)
+        self.use_mmap = use_mmap
+        self.encoding = encoding
+        self.errors = errors
+        self.check_file_exists = check_file_exists
+        self.tombstone_key = tombstone_key
+        self.decompress = decompress
+
+    def _memo_key(self):
+        return (FileTextBlocksReaderTransformer, self.pattern, self.block_size, self.encoding, self.errors, self.decompress)
+
+    def _map_item(self, file_path: str, context: dict = {}) -> Generator[dict, None, None]:
+        if is_tombstone(context, self.tombstone_key):
+            return IgnoreTransformationResult
+
+        if self.check_file_exists and not os.path.isfile(file_path):
+            raise RuntimeError("File not found {}".format(file_path))
+        
+        if not (strip_compression_suffix(file_path) if self.decompress else file_path).endswith(self.pattern):
+            super().log_msg("File {} should ends with {}".format(file_path, self.pattern))
+            return IgnoreTransformationResult
+
+        try:
+            # the last block is yielded with its trailing whitespace, like FileTextReaderTransformer content
+            (carry, pending, cut, lead) = ('', None, False, '')
+            for text in iter_file_text_blocks(file_path, self.block_size, self.encoding, self.errors, self.use_mmap, self.decompress):
+                text = carry + text if not cut else text.lstrip()
+                if not text:
+                    continue
+                i = len(text) - 1
+                while i >= 0 and not text[i].isspace():
+                    i -= 1
+                if i < 0 and len(text) < self.block_size:
+                    carry = text
+                    continue
+                (block, carry) = (text, '') if i < 0 else (text[:i].rstrip(), text[i+1:])
+                cut = i >= 0 and carry == ''
+                if block:
+                    if pending is not None:
+                        yield {'content': pending}
+                    pending = lead + block if pending is None else block
+                elif pending is None:
+                    lead = ' '
+            if carry:
+                yield {'content': pending if pending is not None else lead + carry}
+                if pending is not None:
+                    yield {'content': carry}
+            else:
+                yield {'content': (pending if pending is not None else lead) + (' ' if cut else '')}
+        except Exception as e:
+            super().log_msg("File error {} : {}".format(file_path, str(e.args)), exception=e, level=ERROR)
+
+class FileTextLinesReaderTransformer(AbstractTransformer):
+    def __init__(self, logger: Logger, 
+                 pattern: str, 
+                 input_key_path: List[AnyStr], 
+                 output_key: str,
+                 block_size: int = 4*1024*1024,
+                 use_mmap: bool = False,
+                 encoding: str = "utf-8",
+                 errors: str = "strict",
+                 copy_values_key_paths: List[Tuple[str, List[AnyStr]]] = None,
+                 remove_key_paths: List[List[AnyStr]]=None,
+                 check_file_exists: bool = True,
+                 memoize: bool = False,
+                 decompress: bool = False,
+                 tombstone_key: str = 'deleted') -> None:
+        """
+        pattern               : str
+        input_key_path        : List[in_path]
+        output_key            : str
+        block_size            : bytes read and decoded at once
+        use_mmap              : True to read the file through mmap, False to use a reusable readinto buffer
+        encoding              : str
+        errors                : decode errors policy ('strict', 'replace', 'ignore')
+        copy_values_key_paths : List[Tuple[out_path, List[in_path]]]
+        remove_key_paths      : List[List[in_path]]
+        check_file_exists     : False to skip the os.path.isfile call (ex: files listed by ScandirFilesExtractor)
+        memoize               : True to read the file once per item, even if it is read in many nested chains
+        decompress            : True to read gzip, bz2 and xz files (ex: file.txt.gz matches the pattern .txt)
+        tombstone_key         : the items with tombstone_key=True (deleted files, IncrementalFilesExtractor) are skipped
+
+        Same output as FileToTextLinesTransformer, the lines are split from big decoded blocks instead of readline() calls.
+        Yield elements : {line: str}
+        """
+        super().__init__(logger, input_key_path, (str), output_key, copy_values_key_paths, remove_key_paths, memoize)
+        self.pattern = pattern
+        self.block_size = max(1024, block_size)
+        self.use_mmap = use_mmap
+        self.encoding = encoding
+        self.errors = errors
+        self.check_file_exists = check_file_exists
+        self.tombstone_key = tombstone_key
+        self.decompress = decompress
+
+    def _memo_key(self):
+        return (FileTextLinesReaderTransformer, self.pattern, self.encoding, self.errors, self.decompress)
+
+    def _map_item(self, file_path: str, context: dict = {}) -> Generator[dict, None, None]:
+        if is_tombstone(context, self.tombstone_key):
+            return IgnoreTransformationResult
+
+        if self.check_file_exists and not os.path.isfile(file_path):
+            raise RuntimeError("File not found {}".format(file_path))
+        
+        if not (strip_compression_suffix(file_path) if self.decompress else file_path).endswith(self.pattern):
+            super().log_msg("File {} should ends with {}".format(file_path, self.pattern))
+            return IgnoreTransformationResult
+
+        try:
+            carry = ''
+            for text in iter_file_text_blocks(file_path, self.block_size, self.encoding, self.errors, self.use_mmap, self.decompress):
+                lines = (carry + text).splitlines()
+                carry = lines.pop() if text[-1] not in LINE_BOUNDARIES and len(lines) > 0 else ''
+                for line in lines:
+                    line = line.strip()
+                    if line!='':
+                        yield {'line': line}
+            carry = carry.strip()
+            if carry!='':
+                yield {'line': carry}
+        except Exception as e:
+            super().log_msg("File error {} : {}".format(file_path, str(e.args)), exception=e, level=ERROR)
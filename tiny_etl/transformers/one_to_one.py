@@ -25,7 +25,7 @@ class OneToOneItemAttributesTransformer(AbstractTransformer):
         self.static_values_1 = static_values_1
         self.derived_values_2 = derived_values_2
 
-    def transform(self, item: dict, context: dict={}) -> Generator[dict, None, None]:
+    def transform(self, item: dict, context: dict = None) -> Generator[dict, None, None]:
         if item is None:
             return None
 
@@ -1,8 +1,29 @@
 from abc import abstractmethod
 from functools import reduce
 from logging import Logger, ERROR, DEBUG, INFO
+import re
 from typing import Any, AnyStr, Callable, Generator, Tuple, List
+import unicodedata
 from tiny_etl.transformers.commons import AbstractTransformer
+from tiny_etl.transformers.commons import IgnoreTransformationResult
+
+# Mappers that give the same result when applied on the whole text before splitting it on whitespaces
+BULK_CASE_MAPPERS = (str.lower, str.upper, str.casefold)
+# Mappers that commute with the BULK_CASE_MAPPERS
+STRIP_MAPPERS = (str.strip, str.lstrip, str.rstrip)
+WHITESPACE_PATTERN_TOKENS = re.compile(r'\\[stnrfv]|[\[\]+*()?]|\{\d*,?\d*\}|[ \t\n\r\f\v]')
+
+def is_whitespace_pattern(pattern: str) -> bool:
+    """
+    True if the regex pattern can only match whitespaces (ex: "\\s+", "[ \\t]+").
+    The patterns matching the empty string (ex: "\\s*", "\\s?") split inside the words, they are rejected
+    """
+    if len(pattern) == 0 or WHITESPACE_PATTERN_TOKENS.sub('', pattern) != '':
+        return False
+    try:
+        return re.compile(pattern).fullmatch('') is None
+    except re.error:
+        return False
 
 
 class AbstractTextWordTokenizerTransformer(AbstractTransformer):
@@ -13,27 +34,73 @@ class AbstractTextWordTokenizerTransformer(AbstractTransformer):
                 remove_chars: List[AnyStr] = [],
                 ignore_word_fn: Callable[[Any], bool] = None,
                 copy_values_key_paths: List[Tuple[str, List[AnyStr]]] = None,
-                remove_key_paths: List[List[AnyStr]]=None) -> None:
+                remove_key_paths: List[List[AnyStr]]=None,
+                memoize: bool = False) -> None:
         """
         Yield {'word': str}
         """
-        super().__init__(logger, input_key_path, (str), output_key, copy_values_key_paths, remove_key_paths)
+        super().__init__(logger, input_key_path, (str), output_key, copy_values_key_paths, remove_key_paths, memoize)
         self.mappers = mappers
         self.ignore_word_fn = ignore_word_fn
         self.remove_chars = remove_chars
+        self._engine = None
+
+    def _bulk_normalization_allowed(self) -> bool:
+        """
+        True if the tokens of the text mapped by BULK_CASE_MAPPERS are the mapped tokens of the text
+        """
+        return False
+
+    def _build_engine(self) -> Tuple[List[Callable[[Any], Any]], List[Callable[[Any], Any]], dict, List[AnyStr]]:
+        """
+        Built once per worker :
+            - the case mappers applied to the whole text,
+            - the mappers applied to each token,
+            - the str.translate table removing the remove_chars (None if some of them aren't single chars)
+        """
+        remove_chars = [car for car in self.remove_chars if car is not None and car != '']
+        remove_table = None
+        if all([len(car)==1 for car in remove_chars]):
+            remove_table = str.maketrans('', '', ''.join(remove_chars)) if len(remove_chars) > 0 else None
+            remove_chars = []
+
+        bulk_mappers = []
+        token_mappers = list(self.mappers)
+        uncased_removed_chars = all([car.lower() == car.upper() == car and unicodedata.category(car) != 'Mn' 
+                                    for car in self.remove_chars if car is not None and car != ''])
+        if len(remove_chars) == 0 and uncased_removed_chars and self._bulk_normalization_allowed():
+            token_mappers = []
+            for (idx, mapper) in enumerate(self.mappers):
+                if mapper in BULK_CASE_MAPPERS:
+                    bulk_mappers.append(mapper)
+                elif mapper in STRIP_MAPPERS:
+                    token_mappers.append(mapper)
+                else:
+                    token_mappers = token_mappers + list(self.mappers[idx:])
+                    break
+        return (bulk_mappers, token_mappers, remove_table, remove_chars)
 
     def _map_item(self, text: str, context: dict = {}) -> Generator[dict, None, None]:
         if text is None:
-            super().log_msg("Item value is None")
+            super().log_msg_sampled("Item value is None")
             return IgnoreTransformationResult
 
+        if self._engine is None:
+            self._engine = self._build_engine()
+        (bulk_mappers, token_mappers, remove_table, remove_chars) = self._engine
+        ignore_word_fn = self.ignore_word_fn
+
+        for mapper in bulk_mappers:
+            text = mapper(text)
+
         for x in self._tokenize_text(text, context):
-            for car in self.remove_chars:
-                if car is not None:
-                    x = x.replace(car, '')
-                    
-            x = reduce(lambda val, uvn: uvn(val), self.mappers, x)
-            if x is not None and (self.ignore_word_fn is None or not self.ignore_word_fn(x)):
+            if remove_table is not None:
+                x = x.translate(remove_table)
+            for car in remove_chars:
+                x = x.replace(car, '')
+            for mapper in token_mappers:
+                x = mapper(x)
+            if x is not None and (ignore_word_fn is None or not ignore_word_fn(x)):
                 yield {'word': x}
 
     @abstractmethod
@@ -49,7 +116,9 @@ class TextWordTokenizerTransformer(AbstractTextWordTokenizerTransformer):
                 remove_chars: List[AnyStr] = [],
                 ignore_word_fn: Callable[[Any], bool] = None,
                 copy_values_key_paths: List[Tuple[str, List[AnyStr]]] = None,
-                remove_key_paths: List[List[AnyStr]]=None) -> None:
+                remove_key_paths: List[List[AnyStr]]=None,
+                memoize: bool = False,
+                stream_threshold: int = 1024*1024) -> None:
         """
         pattern               : str
         input_key_path        : List[in_path]
@@ -59,13 +128,108 @@ class TextWordTokenizerTransformer(AbstractTextWordTokenizerTransformer):
         ignore_word_fn        : Callable[[word], bool],
         copy_values_key_paths : List[Tuple[out_path, List[in_path]]]
         remove_key_paths      : List[List[in_path]]
+        memoize               : True to tokenize the same text once per item, even if it is tokenized in many nested chains
+        stream_threshold      : texts longer than this are tokenized using finditer instead of building the whole split list
 
+        The pattern is compiled once per worker, the remove_chars are removed by one str.translate call,
+        and when the pattern only matches whitespaces the str.lower/upper/casefold mappers are applied once on the whole text.
         Yield {'word': str}
         """
-        super().__init__(logger, input_key_path, output_key, mappers, remove_chars,ignore_word_fn, copy_values_key_paths, remove_key_paths)
+        super().__init__(logger, input_key_path, output_key, mappers, remove_chars,ignore_word_fn, copy_values_key_paths, remove_key_paths, memoize)
         self.pattern = pattern
+        self.stream_threshold = stream_threshold
+        self._compiled_pattern = None
+
+    def _bulk_normalization_allowed(self) -> bool:
+        return is_whitespace_pattern(self.pattern)
+
+    def _memo_key(self):
+        return (TextWordTokenizerTransformer, self.pattern, tuple(self.mappers), tuple(self.remove_chars), self.ignore_word_fn)
+
+    def _tokenize_text(self, text: str, context: dict) -> Generator[str, None, None]:
+        if self._compiled_pattern is None:
+            self._compiled_pattern = re.compile(self.pattern)
+        compiled_pattern = self._compiled_pattern
+        if len(text) < self.stream_threshold or compiled_pattern.groups > 0:
+            yield from compiled_pattern.split(text)
+        else:
+            start = 0
+            for m in compiled_pattern.finditer(text):
+                yield text[start:m.start()]
+                start = m.end()
+            yield text[start:]
+
+
+#=========================================================== Arabic :
+# fathatan, dammatan, kasratan, fatha, damma, kasra, shadda, sukun
+ARABIC_DIACRITICS = 'ًٌٍَُِّْ'
+ARABIC_TATWEEL = 'ـ'
+ARABIC_PUNCTUATION = '،؛؟٪٫٬٭۔«»×'
+# hamza, alef forms, letters (teh marbuta excluded), tatweel and diacritics
+ARABIC_WORD_PATTERN = re.compile('[ء-بت-غـ-ْ]+')
+
+ARABIC_DIACRITICS_TABLE = str.maketrans('', '', ARABIC_DIACRITICS)
+ARABIC_TATWEEL_TABLE = str.maketrans('', '', ARABIC_TATWEEL)
+ARABIC_DIACRITICS_TATWEEL_TABLE = str.maketrans('', '', ARABIC_DIACRITICS + ARABIC_TATWEEL)
+ARABIC_NORMALIZATION_TABLE = str.maketrans(dict([(c, None) for c in ARABIC_DIACRITICS + ARABIC_TATWEEL] + 
+                                                [(c, ' ') for c in ARABIC_PUNCTUATION]))
+
+def remove_arabic_diacritics(text: str) -> str:
+    return text if text is None else text.translate(ARABIC_DIACRITICS_TABLE)
+
+def remove_arabic_tatweel(text: str) -> str:
+    return text if text is None else text.translate(ARABIC_TATWEEL_TABLE)
+
+def normalize_arabic_text(text: str) -> str:
+    """
+    Removes the diacritics and the tatweel, replaces the Arabic punctuation by spaces.
+    Apply it once on the whole text (ex: OneToOneItemAttributesTransformer trans_values_3 on the content) instead of once per word.
+    """
+    return text if text is None else text.translate(ARABIC_NORMALIZATION_TABLE)
+
+class ArabicTextWordsTokenizerTransformer(AbstractTextWordTokenizerTransformer):
+    def __init__(self, logger: Logger, 
+                input_key_path: List[AnyStr],
+                output_key: str,
+                mappers: List[Callable[[Any], Any]] = [],
+                remove_chars: List[AnyStr] = [],
+                ignore_word_fn: Callable[[Any], bool] = None,
+                copy_values_key_paths: List[Tuple[str, List[AnyStr]]] = None,
+                remove_key_paths: List[List[AnyStr]]=None,
+                memoize: bool = False,
+                strip_diacritics: bool = False,
+                strip_tatweel: bool = False) -> None:
+        """
+        input_key_path        : List[in_path]
+        output_key            : str
+        mappers               : List[Callable[[word], new_value]]
+        remove_chars          : List[char_to_be_removed] it will be called before mappers
+        ignore_word_fn        : Callable[[word], bool],
+        copy_values_key_paths : List[Tuple[out_path, List[in_path]]]
+        remove_key_paths      : List[List[in_path]]
+        memoize               : True to tokenize the same text once per item, even if it is tokenized in many nested chains
+        strip_diacritics      : True to remove the diacritics once from the whole text before tokenizing it
+        strip_tatweel         : True to remove the tatweel once from the whole text before tokenizing it
+
+        The words are the runs of Arabic letters, tatweel and diacritics, found in one compiled regex pass.
+        Yield {'word': str}
+        """
+        super().__init__(logger, input_key_path, output_key, mappers, remove_chars,ignore_word_fn, copy_values_key_paths, remove_key_paths, memoize)
+        self.strip_diacritics = strip_diacritics
+        self.strip_tatweel = strip_tatweel
+
+    def _memo_key(self):
+        return (ArabicTextWordsTokenizerTransformer, self.strip_diacritics, self.strip_tatweel,
+                tuple(self.mappers), tuple(self.remove_chars), self.ignore_word_fn)
 
     def _tokenize_text(self, text: str, context: dict) -> Generator[str, None, None]:
-        import re
-        for x in re.split(self.pattern, text):
-            yield x
+        if self.strip_diacritics and self.strip_tatweel:
+            text = text.translate(ARABIC_DIACRITICS_TATWEEL_TABLE)
+        elif self.strip_diacritics:
+            text = text.translate(ARABIC_DIACRITICS_TABLE)
+        elif self.strip_tatweel:
+            text = text.translate(ARABIC_TATWEEL_TABLE)
+        for m in ARABIC_WORD_PATTERN.finditer(text):
+            yield m.group()
+
+    remove_diac = staticmethod(remove_arabic_diacritics)